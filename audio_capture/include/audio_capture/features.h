@@ -0,0 +1,248 @@
+#ifndef AUDIO_CAPTURE__FEATURES__H__
+#define AUDIO_CAPTURE__FEATURES__H__
+
+#include <algorithm>
+#include <cmath>
+#include <complex>
+#include <string>
+#include <vector>
+
+#include "audio_capture/pcm.h"
+
+namespace audio_transport
+{
+  /** \brief Accumulates per-channel RMS, peak and clipping statistics. */
+  class LevelMeter
+  {
+    public:
+      LevelMeter() : _channels(0), _frames(0) {}
+
+      /** \brief Add interleaved samples.
+       *
+       * \param clip Samples whose magnitude reaches this are counted as clipped.
+       */
+      void add(const std::vector<float> &samples, size_t channels, float clip)
+      {
+        if (channels != _channels)
+        {
+          _channels = channels;
+          reset();
+        }
+        if (_channels == 0)
+          return;
+
+        size_t frames = samples.size() / _channels;
+        for (size_t i = 0; i < frames; i++)
+        {
+          for (size_t c = 0; c < _channels; c++)
+          {
+            float v = std::fabs(samples[i * _channels + c]);
+            _sum[c] += v * v;
+            if (v > _peak[c])
+              _peak[c] = v;
+            if (v >= clip)
+              _clipped[c]++;
+          }
+        }
+        _frames += frames;
+      }
+
+      size_t frames() const { return _frames; }
+
+      double rmsDb(size_t channel) const
+      {
+        if (_frames == 0)
+          return toDb(0.0);
+        return toDb(std::sqrt(_sum[channel] / _frames));
+      }
+
+      double peakDb(size_t channel) const { return toDb(_peak[channel]); }
+
+      uint32_t clipped(size_t channel) const { return _clipped[channel]; }
+
+      void reset()
+      {
+        _sum.assign(_channels, 0.0);
+        _peak.assign(_channels, 0.0f);
+        _clipped.assign(_channels, 0);
+        _frames = 0;
+      }
+
+    private:
+      size_t _channels, _frames;
+      std::vector<double> _sum;
+      std::vector<float> _peak;
+      std::vector<uint32_t> _clipped;
+  };
+
+  /** \brief In-place radix-2 FFT. The size of \a data must be a power of two. */
+  inline void fft(std::vector<std::complex<float> > &data)
+  {
+    size_t n = data.size();
+    for (size_t i = 1, j = 0; i < n; i++)
+    {
+      size_t bit = n >> 1;
+      for (; j & bit; bit >>= 1)
+        j ^= bit;
+      j ^= bit;
+      if (i < j)
+        std::swap(data[i], data[j]);
+    }
+
+    for (size_t len = 2; len <= n; len <<= 1)
+    {
+      double angle = -2.0 * M_PI / len;
+      std::complex<float> step(std::cos(angle), std::sin(angle));
+      for (size_t i = 0; i < n; i += len)
+      {
+        std::complex<float> w(1.0f, 0.0f);
+        for (size_t k = 0; k < len / 2; k++)
+        {
+          std::complex<float> a = data[i + k];
+          std::complex<float> b = data[i + k + len / 2] * w;
+          data[i + k] = a + b;
+          data[i + k + len / 2] = a - b;
+          w *= step;
+        }
+      }
+    }
+  }
+
+  inline double hzToMel(double hz) { return 2595.0 * std::log10(1.0 + hz / 700.0); }
+
+  inline double melToHz(double mel) { return 700.0 * (std::pow(10.0, mel / 2595.0) - 1.0); }
+
+  /** \brief Short-time band energies of a (downmixed) signal.
+   *
+   * Frames of \a window samples are taken every \a hop samples, weighted
+   * with a Hann window and reduced to \a bands triangular bands spaced on
+   * the mel or linear scale.
+   */
+  class Spectrogram
+  {
+    public:
+      /** \param window Analysis window in samples, rounded up to a power of two. */
+      Spectrogram(int sample_rate, size_t window, size_t hop, size_t bands,
+                  double min_freq, double max_freq, bool mel)
+        : _hop(std::max<size_t>(hop, 1)), _offset(0)
+      {
+        _window = 1;
+        while (_window < window)
+          _window <<= 1;
+
+        _taper.resize(_window);
+        double gain = 0.0;
+        for (size_t i = 0; i < _window; i++)
+        {
+          _taper[i] = 0.5 - 0.5 * std::cos(2.0 * M_PI * i / _window);
+          gain += _taper[i];
+        }
+        // Scale so a full scale sine peaks near 0 dB
+        _scale = gain > 0.0 ? 4.0 / (gain * gain) : 1.0;
+
+        double nyquist = sample_rate / 2.0;
+        if (max_freq <= 0.0 || max_freq > nyquist)
+          max_freq = nyquist;
+        min_freq = std::max(0.0, std::min(min_freq, max_freq));
+        _min_freq = min_freq;
+        _max_freq = max_freq;
+
+        // Band edges, evenly spaced on the chosen scale
+        std::vector<double> edges(bands + 2);
+        double lo = mel ? hzToMel(min_freq) : min_freq;
+        double hi = mel ? hzToMel(max_freq) : max_freq;
+        for (size_t i = 0; i < edges.size(); i++)
+        {
+          double v = lo + (hi - lo) * i / (bands + 1);
+          edges[i] = mel ? melToHz(v) : v;
+        }
+
+        size_t bins = _window / 2 + 1;
+        double bin_width = (double)sample_rate / _window;
+        _weights.assign(bands, std::vector<float>(bins, 0.0f));
+        for (size_t b = 0; b < bands; b++)
+        {
+          for (size_t k = 0; k < bins; k++)
+          {
+            double f = k * bin_width;
+            double w = 0.0;
+            if (f > edges[b] && f <= edges[b + 1])
+              w = (f - edges[b]) / (edges[b + 1] - edges[b]);
+            else if (f > edges[b + 1] && f < edges[b + 2])
+              w = (edges[b + 2] - f) / (edges[b + 2] - edges[b + 1]);
+            _weights[b][k] = w;
+          }
+        }
+      }
+
+      /** \brief Add interleaved samples, mixing the channels down to mono. */
+      void push(const std::vector<float> &samples, size_t channels)
+      {
+        if (channels == 0)
+          return;
+        size_t frames = samples.size() / channels;
+        for (size_t i = 0; i < frames; i++)
+        {
+          float sum = 0.0f;
+          for (size_t c = 0; c < channels; c++)
+            sum += samples[i * channels + c];
+          _pending.push_back(sum / channels);
+        }
+      }
+
+      /** \brief Compute the next frame, if enough samples have been pushed.
+       *
+       * \param lag Set to the number of pushed samples that follow the frame.
+       */
+      bool pop(std::vector<float> &energies, size_t &lag)
+      {
+        if (_pending.size() < _offset + _window)
+          return false;
+
+        _frame.resize(_window);
+        for (size_t i = 0; i < _window; i++)
+          _frame[i] = std::complex<float>(_pending[_offset + i] * _taper[i], 0.0f);
+        fft(_frame);
+
+        energies.resize(_weights.size());
+        for (size_t b = 0; b < _weights.size(); b++)
+        {
+          double energy = 0.0;
+          const std::vector<float> &weights = _weights[b];
+          for (size_t k = 0; k < weights.size(); k++)
+          {
+            if (weights[k] > 0.0f)
+              energy += weights[k] * std::norm(_frame[k]);
+          }
+          energies[b] = 10.0 * std::log10(energy * _scale + 1e-20);
+        }
+        lag = _pending.size() - _offset - _window;
+
+        // Drop consumed samples in batches rather than on every hop
+        _offset += _hop;
+        if (_offset >= _window)
+        {
+          size_t drop = std::min(_offset, _pending.size());
+          _pending.erase(_pending.begin(), _pending.begin() + drop);
+          _offset -= drop;
+        }
+        return true;
+      }
+
+      size_t window() const { return _window; }
+
+      double minFreq() const { return _min_freq; }
+
+      double maxFreq() const { return _max_freq; }
+
+    private:
+      size_t _window, _hop, _offset;
+      double _scale, _min_freq, _max_freq;
+      std::vector<double> _taper;
+      std::vector<std::vector<float> > _weights;
+      std::vector<float> _pending;
+      std::vector<std::complex<float> > _frame;
+  };
+}
+
+#endif
@@ -0,0 +1,135 @@
+#ifndef AUDIO_CAPTURE__PCM__H__
+#define AUDIO_CAPTURE__PCM__H__
+
+#include <stdint.h>
+#include <string.h>
+#include <cmath>
+#include <string>
+#include <vector>
+
+namespace audio_transport
+{
+  /** \brief Raw sample formats the capture-side analysis understands. */
+  enum SampleFormat
+  {
+    SAMPLE_FORMAT_UNSUPPORTED = 0,
+    SAMPLE_FORMAT_S16LE,
+    SAMPLE_FORMAT_S32LE,
+    SAMPLE_FORMAT_F32LE
+  };
+
+  inline SampleFormat parseSampleFormat(const std::string &format)
+  {
+    if (format == "S16LE")
+      return SAMPLE_FORMAT_S16LE;
+    if (format == "S32LE")
+      return SAMPLE_FORMAT_S32LE;
+    if (format == "F32LE")
+      return SAMPLE_FORMAT_F32LE;
+    return SAMPLE_FORMAT_UNSUPPORTED;
+  }
+
+  inline size_t sampleSize(SampleFormat format)
+  {
+    switch (format)
+    {
+      case SAMPLE_FORMAT_S16LE:
+        return 2;
+      case SAMPLE_FORMAT_S32LE:
+      case SAMPLE_FORMAT_F32LE:
+        return 4;
+      default:
+        return 0;
+    }
+  }
+
+  /** \brief Convert little-endian raw samples to floats in [-1, 1].
+   *
+   * Assumes a little-endian host, like the rest of the pipeline.
+   */
+  inline void toFloat(const uint8_t *data, size_t size, SampleFormat format,
+                      std::vector<float> &out)
+  {
+    size_t width = sampleSize(format);
+    if (width == 0)
+    {
+      out.clear();
+      return;
+    }
+
+    size_t count = size / width;
+    out.resize(count);
+    for (size_t i = 0; i < count; i++)
+    {
+      const uint8_t *p = data + i * width;
+      if (format == SAMPLE_FORMAT_S16LE)
+      {
+        int16_t v;
+        memcpy(&v, p, sizeof(v));
+        out[i] = v / 32768.0f;
+      }
+      else if (format == SAMPLE_FORMAT_S32LE)
+      {
+        int32_t v;
+        memcpy(&v, p, sizeof(v));
+        out[i] = v / 2147483648.0f;
+      }
+      else
+      {
+        memcpy(&out[i], p, sizeof(float));
+      }
+    }
+  }
+
+  /** \brief Copy a subset of the channels out of interleaved samples.
+   *
+   * \param width Bytes per sample.
+   * \param channels Number of channels interleaved in \a data.
+   * \param group Channels to keep, in output order.
+   */
+  inline void deinterleave(const uint8_t *data, size_t size, size_t width, size_t channels,
+                           const std::vector<int> &group, std::vector<uint8_t> &out)
+  {
+    size_t frame = width * channels;
+    size_t count = frame ? size / frame : 0;
+    out.resize(count * width * group.size());
+
+    uint8_t *dst = out.empty() ? NULL : &out[0];
+    for (size_t i = 0; i < count; i++)
+    {
+      const uint8_t *src = data + i * frame;
+      for (size_t c = 0; c < group.size(); c++)
+      {
+        memcpy(dst, src + group[c] * width, width);
+        dst += width;
+      }
+    }
+  }
+
+  /** \brief Level in dBFS corresponding to a linear amplitude. */
+  inline double toDb(double amplitude)
+  {
+    if (amplitude <= 1e-10)
+      return -200.0;
+    return 20.0 * std::log10(amplitude);
+  }
+
+  /** \brief Linear amplitude corresponding to a level in dBFS. */
+  inline double fromDb(double level)
+  {
+    return std::pow(10.0, level / 20.0);
+  }
+
+  /** \brief RMS level of a block of samples in dBFS. */
+  inline double rmsDb(const std::vector<float> &samples)
+  {
+    if (samples.empty())
+      return -200.0;
+    double sum = 0.0;
+    for (size_t i = 0; i < samples.size(); i++)
+      sum += samples[i] * samples[i];
+    return toDb(std::sqrt(sum / samples.size()));
+  }
+}
+
+#endif
@@ -0,0 +1,66 @@
+#ifndef AUDIO_CAPTURE__VOICE_ACTIVITY_DETECTOR__H__
+#define AUDIO_CAPTURE__VOICE_ACTIVITY_DETECTOR__H__
+
+namespace audio_transport
+{
+  /** \brief Energy based voice activity detector with hangover.
+   *
+   * Voice becomes active as soon as a block's level reaches the start
+   * threshold. It stays active until the level has been below the (lower)
+   * stop threshold for the hangover time, so short pauses between words
+   * don't chop an utterance apart.
+   */
+  class VoiceActivityDetector
+  {
+    public:
+      VoiceActivityDetector(double start_threshold, double stop_threshold, double hangover)
+        : _start_threshold(start_threshold),
+          _stop_threshold(stop_threshold < start_threshold ? stop_threshold : start_threshold),
+          _hangover(hangover),
+          _active(false),
+          _quiet_time(0.0)
+      {
+      }
+
+      /** \brief Feed the level [dBFS] of a block lasting duration seconds.
+       *
+       * Returns true if the voice activity state changed.
+       */
+      bool update(double level, double duration)
+      {
+        if (!_active)
+        {
+          if (level >= _start_threshold)
+          {
+            _active = true;
+            _quiet_time = 0.0;
+            return true;
+          }
+          return false;
+        }
+
+        if (level >= _stop_threshold)
+        {
+          _quiet_time = 0.0;
+          return false;
+        }
+
+        _quiet_time += duration;
+        if (_quiet_time >= _hangover)
+        {
+          _active = false;
+          return true;
+        }
+        return false;
+      }
+
+      bool active() const { return _active; }
+
+    private:
+      double _start_threshold, _stop_threshold, _hangover;
+      bool _active;
+      double _quiet_time;
+  };
+}
+
+#endif
@@ -2,188 +2,960 @@
 #include <gst/gst.h>
 #include <gst/app/gstappsink.h>
 #include <boost/thread.hpp>
+#include <boost/lexical_cast.hpp>
+#include <deque>
+#include <set>
 
 #include <ros/ros.h>
+#include <nodelet/nodelet.h>
+#include <pluginlib/class_list_macros.h>
 
 #include "audio_common_msgs/AudioData.h"
+#include "audio_common_msgs/AudioDataStamped.h"
+#include "audio_common_msgs/AudioInfo.h"
+#include "audio_common_msgs/AudioLevel.h"
+#include "audio_common_msgs/AudioSpectrum.h"
+#include "audio_common_msgs/VoiceActivity.h"
+#include "audio_capture/features.h"
+#include "audio_capture/pcm.h"
+#include "audio_capture/voice_activity_detector.h"
 
 namespace audio_transport
 {
   class RosGstCapture
   {
     public:
-      RosGstCapture()
+      // Settings for one capture device. The node's own parameters give
+      // the defaults, which each entry of ~devices may override.
+      struct DeviceConfig
       {
-        _bitrate = 192;
+        std::string name, src_type, device, src_location, test_wave;
+        std::string format, dst, sample_format;
+        double test_freq;
+        int num_buffers, bitrate, channels, depth, sample_rate;
+      };
 
-        std::string dst_type;
+      RosGstCapture(ros::NodeHandle nh, ros::NodeHandle pnh)
+        : _nh(nh), _pipeline(NULL), _bus(NULL), _context(NULL), _loop(NULL)
+      {
+        DeviceConfig defaults;
+        _stopping = false;
+        _failed = false;
+
+        // End the process when the capture can't be set up or fails. The
+        // standalone node turns this on; in a nodelet manager it would take
+        // every other nodelet down too.
+        pnh.param<bool>("shutdown_on_error", _shutdown_on_error, false);
 
         // Need to encoding or publish raw wave data
-        ros::param::param<std::string>("~format", _format, "mp3");
-        ros::param::param<std::string>("~sample_format", _sample_format, "S16LE");
+        pnh.param<std::string>("format", defaults.format, "mp3");
+        pnh.param<std::string>("sample_format", defaults.sample_format, "S16LE");
 
         // The bitrate at which to encode the audio
-        ros::param::param<int>("~bitrate", _bitrate, 192);
+        pnh.param<int>("bitrate", defaults.bitrate, 192);
 
         // only available for raw data
-        ros::param::param<int>("~channels", _channels, 1);
-        ros::param::param<int>("~depth", _depth, 16);
-        ros::param::param<int>("~sample_rate", _sample_rate, 16000);
+        pnh.param<int>("channels", defaults.channels, 1);
+        pnh.param<int>("depth", defaults.depth, 16);
+        pnh.param<int>("sample_rate", defaults.sample_rate, 16000);
 
         // The destination of the audio
-        ros::param::param<std::string>("~dst", dst_type, "appsink");
+        pnh.param<std::string>("dst", defaults.dst, "appsink");
+
+        // The source of the audio: alsasrc, file, test or stdin. Files and
+        // stdin may hold anything decodebin understands.
+        pnh.param<std::string>("src", defaults.src_type, "alsasrc");
+        pnh.param<std::string>("device", defaults.device, "");
+        pnh.param<std::string>("src_location", defaults.src_location, "");
+        pnh.param<std::string>("test_wave", defaults.test_wave, "sine");
+        pnh.param<double>("test_freq", defaults.test_freq, 440.0);
+        // Stop after this many source buffers, e.g. for benchmarks
+        pnh.param<int>("num_buffers", defaults.num_buffers, -1);
+
+        // Non-live sources (file, test, stdin) play at their natural rate
+        // when realtime, and as fast as the outputs accept otherwise
+        pnh.param<bool>("realtime", _realtime, true);
+        pnh.param<bool>("wait_for_subscribers", _wait_for_subscribers, false);
+        // Shut ROS down when a file or stdin source ends. The standalone
+        // node turns this on; in a nodelet manager it would take every
+        // other nodelet down too.
+        pnh.param<bool>("shutdown_on_eos", _shutdown_on_eos, false);
 
-        // The source of the audio
-        //ros::param::param<std::string>("~src", source_type, "alsasrc");
-        std::string device;
-        ros::param::param<std::string>("~device", device, "");
+        // Optionally only publish while someone is talking. Levels are in
+        // dBFS; preroll is how much audio before the onset gets published
+        // so utterances aren't clipped.
+        pnh.param<bool>("vad", _vad_enabled, false);
+        pnh.param<double>("vad_start_threshold", _vad_start_threshold, -40.0);
+        pnh.param<double>("vad_stop_threshold", _vad_stop_threshold, -45.0);
+        pnh.param<double>("vad_hangover", _vad_hangover, 0.5);
+        pnh.param<double>("vad_preroll", _vad_preroll, 0.3);
+
+        // Optional analysis of the raw audio, published on "level" and
+        // "spectrum" so monitors don't need the full audio stream. Levels
+        // are measured over level_interval seconds; spectrum frames cover
+        // spectrum_window samples every spectrum_hop seconds.
+        pnh.param<bool>("level", _level_enabled, false);
+        pnh.param<double>("level_interval", _level_interval, 0.1);
+        pnh.param<double>("clip_threshold", _clip_threshold, -0.1);
+        pnh.param<bool>("spectrum", _spectrum_enabled, false);
+        pnh.param<int>("spectrum_window", _spectrum_window, 512);
+        pnh.param<double>("spectrum_hop", _spectrum_hop, 0.01);
+        pnh.param<int>("spectrum_bands", _spectrum_bands, 40);
+        pnh.param<std::string>("spectrum_scale", _spectrum_scale, "mel");
+        pnh.param<double>("spectrum_min_freq", _spectrum_min_freq, 20.0);
+        pnh.param<double>("spectrum_max_freq", _spectrum_max_freq, 0.0);
+        if (_spectrum_scale != "mel" && _spectrum_scale != "linear")
+        {
+          ROS_ERROR_STREAM("spectrum_scale must be \"mel\" or \"linear\"");
+          fail();
+          return;
+        }
 
-        _pub = _nh.advertise<audio_common_msgs::AudioData>("audio", 10, true);
+        // The outputs fed from each device. Without ~outputs, a single
+        // output is built from ~format and ~dst, publishing on "audio".
+        XmlRpc::XmlRpcValue outputs;
+        bool has_outputs = pnh.getParam("outputs", outputs);
 
-        _loop = g_main_loop_new(NULL, false);
+        // Each instance runs its own main context, so several captures can
+        // share a nodelet manager without fighting over the default one.
+        _context = g_main_context_new();
+        _loop = g_main_loop_new(_context, false);
         _pipeline = gst_pipeline_new("ros_pipeline");
         _bus = gst_pipeline_get_bus(GST_PIPELINE(_pipeline));
+        g_main_context_push_thread_default(_context);
         gst_bus_add_signal_watch(_bus);
+        g_main_context_pop_thread_default(_context);
         g_signal_connect(_bus, "message::error",
                          G_CALLBACK(onMessage), this);
+        g_signal_connect(_bus, "message::eos",
+                         G_CALLBACK(onEos), this);
         g_object_unref(_bus);
 
-        // We create the sink first, just for convenience
-        if (dst_type == "appsink")
+        // All devices share the one pipeline, main loop and thread. Each
+        // entry of ~devices publishes under its own name; without it a
+        // single device is configured from the parameters above.
+        XmlRpc::XmlRpcValue devices;
+        if (pnh.getParam("devices", devices))
         {
-          _sink = gst_element_factory_make("appsink", "sink");
-          g_object_set(G_OBJECT(_sink), "emit-signals", true, NULL);
-          g_object_set(G_OBJECT(_sink), "max-buffers", 100, NULL);
-          g_signal_connect( G_OBJECT(_sink), "new-sample",
-                            G_CALLBACK(onNewBuffer), this);
+          if (devices.getType() != XmlRpc::XmlRpcValue::TypeArray || devices.size() == 0)
+          {
+            ROS_ERROR_STREAM("~devices must be a non-empty list");
+            fail();
+            return;
+          }
+          for (int i = 0; i < devices.size(); i++)
+          {
+            XmlRpc::XmlRpcValue &entry = devices[i];
+            if (entry.getType() != XmlRpc::XmlRpcValue::TypeStruct)
+            {
+              ROS_ERROR_STREAM("~devices entries must be dictionaries");
+              fail();
+              return;
+            }
+            DeviceConfig config = defaults;
+            config.name = getString(entry, "name", "");
+            config.src_type = getString(entry, "src", defaults.src_type);
+            config.device = getString(entry, "device", defaults.device);
+            config.src_location = getString(entry, "src_location", defaults.src_location);
+            config.test_wave = getString(entry, "test_wave", defaults.test_wave);
+            config.test_freq = getDouble(entry, "test_freq", defaults.test_freq);
+            config.num_buffers = getInt(entry, "num_buffers", defaults.num_buffers);
+            config.format = getString(entry, "format", defaults.format);
+            config.dst = getString(entry, "dst", defaults.dst);
+            config.sample_format = getString(entry, "sample_format", defaults.sample_format);
+            config.bitrate = getInt(entry, "bitrate", defaults.bitrate);
+            config.channels = getInt(entry, "channels", defaults.channels);
+            config.depth = getInt(entry, "depth", defaults.depth);
+            config.sample_rate = getInt(entry, "sample_rate", defaults.sample_rate);
+            if (config.name.empty())
+            {
+              ROS_ERROR_STREAM("~devices entries must have a name");
+              fail();
+              return;
+            }
+
+            XmlRpc::XmlRpcValue *device_outputs = NULL;
+            if (entry.hasMember("outputs"))
+              device_outputs = &entry["outputs"];
+            else if (has_outputs)
+              device_outputs = &outputs;
+            if (!addDevice(config, device_outputs))
+            {
+              fail();
+              return;
+            }
+          }
         }
-        else
+        else if (!addDevice(defaults, has_outputs ? &outputs : NULL))
+        {
+          fail();
+          return;
+        }
+
+        std::set<std::string> topics;
+        for (size_t i = 0; i < _devices.size(); i++)
         {
-          printf("file sink\n");
-          _sink = gst_element_factory_make("filesink", "sink");
-          g_object_set( G_OBJECT(_sink), "location", dst_type.c_str(), NULL);
+          for (size_t j = 0; j < _devices[i]->outputs.size(); j++)
+          {
+            const Output &output = *_devices[i]->outputs[j];
+            for (size_t k = 0; k < output.streams.size(); k++)
+            {
+              if (!topics.insert(output.streams[k].topic).second)
+              {
+                ROS_ERROR_STREAM("Several outputs publish on topic " << output.streams[k].topic);
+                fail();
+                return;
+              }
+            }
+          }
         }
 
-        _source = gst_element_factory_make("alsasrc", "source");
-        // if device isn't specified, it will use the default which is
-        // the alsa default source.
-        // A valid device will be of the foram hw:0,0 with other numbers
-        // than 0 and 0 as are available.
-        if (device != "")
+        _gst_thread = boost::thread( boost::bind(&RosGstCapture::run, this) );
+      }
+
+      void run()
+      {
+        // Offline runs would otherwise lose whatever is published before
+        // the consumers have connected
+        if (_wait_for_subscribers)
+        {
+          ROS_INFO("Waiting for subscribers before starting the capture");
+          for (size_t i = 0; i < _devices.size() && ros::ok(); i++)
+          {
+            for (size_t j = 0; j < _devices[i]->outputs.size() && ros::ok(); j++)
+            {
+              const Output &output = *_devices[i]->outputs[j];
+              for (size_t k = 0; k < output.streams.size(); k++)
+              {
+                while (output.streams[k].pub.getNumSubscribers() == 0 && ros::ok() && !_stopping)
+                  ros::WallDuration(0.1).sleep();
+              }
+            }
+          }
+        }
+
+        if (_stopping)
+          return;
+        _start_time = ros::WallTime::now();
+        gst_element_set_state(GST_ELEMENT(_pipeline), GST_STATE_PLAYING);
+        g_main_loop_run(_loop);
+        // Release the device once the stream has ended or failed
+        gst_element_set_state(GST_ELEMENT(_pipeline), GST_STATE_NULL);
+      }
+
+      // False once the capture couldn't be set up or has failed
+      bool ok() const
+      {
+        return !_failed;
+      }
+
+      ~RosGstCapture()
+      {
+        // Quitting the loop before it runs has no effect, so the quit is
+        // dispatched from the loop's own context, and run() gives up
+        // waiting for subscribers
+        _stopping = true;
+        if (_gst_thread.joinable())
         {
-          // ghcar *gst_device = device.c_str();
-          g_object_set(G_OBJECT(_source), "device", device.c_str(), NULL);
+          GSource *source = g_idle_source_new();
+          g_source_set_callback(source, quitLoop, _loop, NULL);
+          g_source_attach(source, _context);
+          g_source_unref(source);
+          g_main_loop_quit(_loop);
+          _gst_thread.join();
         }
+        // Setting up may have stopped part way, see fail()
+        if (_pipeline)
+        {
+          gst_element_set_state(_pipeline, GST_STATE_NULL);
+          gst_object_unref(_pipeline);
+        }
+        for (size_t i = 0; i < _devices.size(); i++)
+        {
+          if (_devices[i]->caps)
+            gst_caps_unref(_devices[i]->caps);
+        }
+        if (_loop)
+          g_main_loop_unref(_loop);
+        if (_context)
+          g_main_context_unref(_context);
+      }
+
+      struct Device;
+
+      // A topic published by an output. Outputs that split the channels
+      // publish one stream per channel group.
+      struct Stream
+      {
+        std::string topic;
+        // Channels carried by this stream, empty for all of them as captured
+        std::vector<int> channels;
+        ros::Publisher pub, pub_stamped, pub_info;
+        uint32_t seq;
+        uint64_t bytes;
+        GstClockTime last_pts;
+        std::deque<std::pair<GstClockTime, audio_common_msgs::AudioDataConstPtr> > preroll;
+      };
+
+      // One branch hanging off a device's tee, published on topics or
+      // written to a file
+      struct Output
+      {
+        std::string format, dst, topic;
+        int bitrate;
+        std::vector<Stream> streams;
+        Device *device;
+      };
+
+      struct Device : public DeviceConfig
+      {
+        Device(const DeviceConfig &config)
+          : DeviceConfig(config), server(NULL), raw_format(SAMPLE_FORMAT_UNSUPPORTED), width(0),
+            source(NULL), decoder(NULL), convert(NULL), raw(NULL), filter(NULL), tee(NULL),
+            caps(NULL), vad_enabled(false), vad(0.0, 0.0, 0.0), voice_active(false),
+            level_enabled(false)
+        {}
 
+        RosGstCapture *server;
+        SampleFormat raw_format;
+        // Bytes per sample
+        size_t width;
+        // raw is the end of the source chain producing raw audio
+        GstElement *source, *decoder, *convert, *raw, *filter, *tee;
         GstCaps *caps;
-        caps = gst_caps_new_simple("audio/x-raw",
-                                   "format", G_TYPE_STRING, _sample_format.c_str(),
-                                   "channels", G_TYPE_INT, _channels,
-                                   "width",    G_TYPE_INT, _depth,
-                                   "depth",    G_TYPE_INT, _depth,
-                                   "rate",     G_TYPE_INT, _sample_rate,
-                                   "signed",   G_TYPE_BOOLEAN, TRUE,
-                                   NULL);
-
-        gboolean link_ok;
-        if (_format == "mp3"){
-          _filter = gst_element_factory_make("capsfilter", "filter");
-          g_object_set( G_OBJECT(_filter), "caps", caps, NULL);
-          gst_caps_unref(caps);
+        std::vector<boost::shared_ptr<Output> > outputs;
+
+        // Voice activity gating
+        bool vad_enabled;
+        VoiceActivityDetector vad;
+        bool voice_active;
+        boost::mutex vad_mutex;
+        ros::Publisher pub_vad;
+
+        // Level and spectrum analysis
+        bool level_enabled;
+        LevelMeter level;
+        boost::shared_ptr<Spectrogram> spectrum;
+        std::vector<float> energies;
+        ros::Publisher pub_level, pub_spectrum;
+
+        // The latest raw buffer, converted to floats
+        std::vector<float> samples;
+      };
+
+      // Topics of named devices live in the device's namespace
+      static std::string resolve(const Device &device, const std::string &topic)
+      {
+        if (device.name.empty())
+          return topic;
+        return device.name + "/" + topic;
+      }
+
+      bool addDevice(const DeviceConfig &config, XmlRpc::XmlRpcValue *outputs)
+      {
+        boost::shared_ptr<Device> device(new Device(config));
+        device->server = this;
+        device->raw_format = parseSampleFormat(device->sample_format);
+        device->width = sampleSize(device->raw_format);
+        if (device->width == 0)
+          device->width = device->depth / 8;
+        device->vad_enabled = _vad_enabled;
+        device->vad = VoiceActivityDetector(_vad_start_threshold, _vad_stop_threshold, _vad_hangover);
+        device->level_enabled = _level_enabled;
+        if (_spectrum_enabled)
+        {
+          device->spectrum.reset(new Spectrogram(device->sample_rate, _spectrum_window,
+                                                 static_cast<size_t>(_spectrum_hop * device->sample_rate), _spectrum_bands,
+                                                 _spectrum_min_freq, _spectrum_max_freq,
+                                                 _spectrum_scale == "mel"));
+        }
+        if ((device->vad_enabled || device->level_enabled || device->spectrum) &&
+            device->raw_format == SAMPLE_FORMAT_UNSUPPORTED)
+        {
+          ROS_WARN("Audio analysis does not support sample format %s, disabling it",
+                   device->sample_format.c_str());
+          device->vad_enabled = false;
+          device->level_enabled = false;
+          device->spectrum.reset();
+        }
+
+        if (device->src_type == "alsasrc")
+        {
+          device->source = gst_element_factory_make("alsasrc", NULL);
+          // if device isn't specified, it will use the default which is
+          // the alsa default source.
+          // A valid device will be of the foram hw:0,0 with other numbers
+          // than 0 and 0 as are available.
+          if (device->device != "")
+          {
+            // ghcar *gst_device = device.c_str();
+            g_object_set(G_OBJECT(device->source), "device", device->device.c_str(), NULL);
+          }
+          device->raw = device->source;
+        }
+        else if (device->src_type == "test")
+        {
+          device->source = gst_element_factory_make("audiotestsrc", NULL);
+          gst_util_set_object_arg(G_OBJECT(device->source), "wave", device->test_wave.c_str());
+          g_object_set(G_OBJECT(device->source), "freq", device->test_freq, NULL);
+          g_object_set(G_OBJECT(device->source), "is-live", _realtime, NULL);
+          device->raw = device->source;
+        }
+        else if (device->src_type == "file" || device->src_type == "stdin")
+        {
+          if (device->src_type == "file")
+          {
+            device->source = gst_element_factory_make("filesrc", NULL);
+            g_object_set(G_OBJECT(device->source), "location", device->src_location.c_str(), NULL);
+          }
+          else
+          {
+            device->source = gst_element_factory_make("fdsrc", NULL);
+            g_object_set(G_OBJECT(device->source), "fd", 0, NULL);
+          }
+          device->decoder = gst_element_factory_make("decodebin", NULL);
+          g_signal_connect(device->decoder, "pad-added", G_CALLBACK(onNewPad), device.get());
+          device->convert = gst_element_factory_make("audioconvert", NULL);
+          device->raw = gst_element_factory_make("audioresample", NULL);
+          gst_bin_add_many( GST_BIN(_pipeline), device->source, device->decoder,
+                            device->convert, device->raw, NULL);
+          if (!gst_element_link(device->source, device->decoder) ||
+              !gst_element_link(device->convert, device->raw))
+          {
+            ROS_ERROR_STREAM("Failed to link the " << device->src_type << " source");
+            return false;
+          }
+        }
+        else
+        {
+          ROS_ERROR_STREAM("src must be \"alsasrc\", \"file\", \"test\" or \"stdin\"");
+          return false;
+        }
+        if (device->num_buffers > 0)
+          g_object_set(G_OBJECT(device->source), "num-buffers", device->num_buffers, NULL);
+
+        device->caps = gst_caps_new_simple("audio/x-raw",
+                                           "format", G_TYPE_STRING, device->sample_format.c_str(),
+                                           "channels", G_TYPE_INT, device->channels,
+                                           "width",    G_TYPE_INT, device->depth,
+                                           "depth",    G_TYPE_INT, device->depth,
+                                           "rate",     G_TYPE_INT, device->sample_rate,
+                                           "signed",   G_TYPE_BOOLEAN, TRUE,
+                                           NULL);
+
+        // The device is opened once and its audio fanned out to every
+        // output, each behind its own queue
+        device->filter = gst_element_factory_make("capsfilter", NULL);
+        g_object_set( G_OBJECT(device->filter), "caps", device->caps, NULL);
+        device->tee = gst_element_factory_make("tee", NULL);
+
+        if (device->raw == device->source)
+          gst_bin_add( GST_BIN(_pipeline), device->source);
+        gst_bin_add_many( GST_BIN(_pipeline), device->filter, device->tee, NULL);
+        if (!gst_element_link_many(device->raw, device->filter, device->tee, NULL)) {
+          ROS_ERROR_STREAM("Unsupported media type.");
+          return false;
+        }
+
+        // Analyse the raw audio as it enters the tee, before any encoding
+        if (device->vad_enabled)
+          device->pub_vad = _nh.advertise<audio_common_msgs::VoiceActivity>(
+            resolve(*device, "voice_activity"), 1, true);
+        if (device->level_enabled)
+          device->pub_level = _nh.advertise<audio_common_msgs::AudioLevel>(
+            resolve(*device, "level"), 10);
+        if (device->spectrum)
+          device->pub_spectrum = _nh.advertise<audio_common_msgs::AudioSpectrum>(
+            resolve(*device, "spectrum"), 10);
+        if (device->vad_enabled || device->level_enabled || device->spectrum)
+        {
+          GstPad *pad = gst_element_get_static_pad(device->filter, "src");
+          gst_pad_add_probe(pad, GST_PAD_PROBE_TYPE_BUFFER, onRawBuffer, device.get(), NULL);
+          gst_object_unref(pad);
+        }
+
+        if (outputs)
+        {
+          if (outputs->getType() != XmlRpc::XmlRpcValue::TypeArray || outputs->size() == 0)
+          {
+            ROS_ERROR_STREAM("~outputs must be a non-empty list");
+            return false;
+          }
+          for (int i = 0; i < outputs->size(); i++)
+          {
+            XmlRpc::XmlRpcValue &entry = (*outputs)[i];
+            if (entry.getType() != XmlRpc::XmlRpcValue::TypeStruct)
+            {
+              ROS_ERROR_STREAM("~outputs entries must be dictionaries");
+              return false;
+            }
+            boost::shared_ptr<Output> output(new Output);
+            output->format = getString(entry, "format", device->format);
+            output->dst = getString(entry, "dst", "appsink");
+            output->topic = getString(entry, "topic", "audio");
+            output->bitrate = getInt(entry, "bitrate", device->bitrate);
+            if (!addStreams(*device, *output, entry))
+              return false;
+            device->outputs.push_back(output);
+          }
+        }
+        else
+        {
+          boost::shared_ptr<Output> output(new Output);
+          output->format = device->format;
+          output->dst = device->dst;
+          output->topic = "audio";
+          output->bitrate = device->bitrate;
+          XmlRpc::XmlRpcValue none;
+          if (!addStreams(*device, *output, none))
+            return false;
+          device->outputs.push_back(output);
+        }
+
+        for (size_t i = 0; i < device->outputs.size(); i++)
+        {
+          if (!addOutput(*device, *device->outputs[i]))
+            return false;
+        }
+        _devices.push_back(device);
+        return true;
+      }
+
+      // Work out the topics an output publishes on. Raw outputs may split
+      // the channels: "split: true" publishes each channel on <topic>_ch<N>,
+      // and a list of channel groups such as "split: [[0, 1], [2, 3]]"
+      // publishes group i on <topic>_group<i>.
+      bool addStreams(const Device &device, Output &output, XmlRpc::XmlRpcValue &entry)
+      {
+        if (output.dst != "appsink")
+          return true;
+
+        std::vector<std::vector<int> > groups;
+        std::vector<std::string> suffixes;
+        if (entry.getType() == XmlRpc::XmlRpcValue::TypeStruct && entry.hasMember("split"))
+        {
+          XmlRpc::XmlRpcValue &split = entry["split"];
+          if (split.getType() == XmlRpc::XmlRpcValue::TypeBoolean)
+          {
+            for (int c = 0; static_cast<bool>(split) && c < device.channels; c++)
+            {
+              groups.push_back(std::vector<int>(1, c));
+              suffixes.push_back("_ch" + boost::lexical_cast<std::string>(c));
+            }
+          }
+          else if (split.getType() == XmlRpc::XmlRpcValue::TypeArray)
+          {
+            for (int i = 0; i < split.size(); i++)
+            {
+              std::vector<int> group;
+              if (split[i].getType() == XmlRpc::XmlRpcValue::TypeInt)
+                group.push_back(static_cast<int>(split[i]));
+              else if (split[i].getType() == XmlRpc::XmlRpcValue::TypeArray)
+              {
+                for (int j = 0; j < split[i].size(); j++)
+                {
+                  if (split[i][j].getType() != XmlRpc::XmlRpcValue::TypeInt)
+                    break;
+                  group.push_back(static_cast<int>(split[i][j]));
+                }
+              }
+              for (size_t j = 0; j < group.size(); j++)
+              {
+                if (group[j] < 0 || group[j] >= device.channels)
+                  group.clear();
+              }
+              if (group.empty())
+              {
+                ROS_ERROR_STREAM("Invalid channel group in the split of output " << output.topic
+                                 << ", channels must be numbered 0 to " << device.channels - 1);
+                return false;
+              }
+              groups.push_back(group);
+              suffixes.push_back("_group" + boost::lexical_cast<std::string>(i));
+            }
+          }
+          else
+          {
+            ROS_ERROR_STREAM("split must be a boolean or a list of channel groups");
+            return false;
+          }
+          if (!groups.empty() && (output.format != "wave" || device.width == 0))
+          {
+            ROS_ERROR_STREAM("Only raw wave outputs can split channels");
+            return false;
+          }
+        }
+
+        if (groups.empty())
+        {
+          groups.push_back(std::vector<int>());
+          suffixes.push_back("");
+        }
+        for (size_t i = 0; i < groups.size(); i++)
+        {
+          Stream stream;
+          stream.topic = resolve(device, output.topic + suffixes[i]);
+          stream.channels = groups[i];
+          stream.seq = 0;
+          stream.bytes = 0;
+          stream.last_pts = GST_CLOCK_TIME_NONE;
+          output.streams.push_back(stream);
+        }
+        return true;
+      }
 
-          _convert = gst_element_factory_make("audioconvert", "convert");
-          if (!_convert) {
+      bool addOutput(Device &device, Output &output)
+      {
+        output.device = &device;
+
+        GstElement *queue = gst_element_factory_make("queue", NULL);
+        GstElement *sink;
+        if (output.dst == "appsink")
+        {
+          sink = gst_element_factory_make("appsink", NULL);
+          g_object_set(G_OBJECT(sink), "sync", _realtime, NULL);
+          g_object_set(G_OBJECT(sink), "emit-signals", true, NULL);
+          g_object_set(G_OBJECT(sink), "max-buffers", 100, NULL);
+          g_signal_connect( G_OBJECT(sink), "new-sample",
+                            G_CALLBACK(onNewBuffer), &output);
+        }
+        else
+        {
+          sink = gst_element_factory_make("filesink", NULL);
+          g_object_set( G_OBJECT(sink), "location", output.dst.c_str(), NULL);
+          g_object_set(G_OBJECT(sink), "sync", _realtime && device.src_type != "alsasrc", NULL);
+        }
+
+        std::vector<GstElement*> chain;
+        chain.push_back(queue);
+        if (output.format == "mp3")
+        {
+          GstElement *convert = gst_element_factory_make("audioconvert", NULL);
+          if (!convert) {
             ROS_ERROR_STREAM("Failed to create audioconvert element");
-            exitOnMainThread(1);
+            return false;
           }
 
-          _encode = gst_element_factory_make("lamemp3enc", "encoder");
-          if (!_encode) {
+          GstElement *encode = gst_element_factory_make("lamemp3enc", NULL);
+          if (!encode) {
             ROS_ERROR_STREAM("Failed to create encoder element");
-            exitOnMainThread(1);
-          }
-          g_object_set( G_OBJECT(_encode), "target", 1, NULL);
-          g_object_set( G_OBJECT(_encode), "bitrate", _bitrate, NULL);
-
-          gst_bin_add_many( GST_BIN(_pipeline), _source, _filter, _convert, _encode, _sink, NULL);
-          link_ok = gst_element_link_many(_source, _filter, _convert, _encode, _sink, NULL);
-        } else if (_format == "wave") {
-          if (dst_type == "appsink") {
-            g_object_set( G_OBJECT(_sink), "caps", caps, NULL);
-            gst_caps_unref(caps);
-            gst_bin_add_many( GST_BIN(_pipeline), _source, _sink, NULL);
-            link_ok = gst_element_link_many( _source, _sink, NULL);
-          } else {
-            _filter = gst_element_factory_make("wavenc", "filter");
-            gst_bin_add_many( GST_BIN(_pipeline), _source, _filter, _sink, NULL);
-            link_ok = gst_element_link_many( _source, _filter, _sink, NULL);
-          }
-        } else {
-          ROS_ERROR_STREAM("format must be \"wave\" or \"mp3\"");
-          exitOnMainThread(1);
+            return false;
+          }
+          g_object_set( G_OBJECT(encode), "target", 1, NULL);
+          g_object_set( G_OBJECT(encode), "bitrate", output.bitrate, NULL);
+
+          chain.push_back(convert);
+          chain.push_back(encode);
+        }
+        else if (output.format == "wave")
+        {
+          if (output.dst == "appsink")
+            g_object_set( G_OBJECT(sink), "caps", device.caps, NULL);
+          else
+            chain.push_back(gst_element_factory_make("wavenc", NULL));
         }
-        /*}
         else
         {
-          _sleep_time = 10000;
-          _source = gst_element_factory_make("filesrc", "source");
-          g_object_set(G_OBJECT(_source), "location", source_type.c_str(), NULL);
+          ROS_ERROR_STREAM("format must be \"wave\" or \"mp3\"");
+          return false;
+        }
+        chain.push_back(sink);
 
-          gst_bin_add_many( GST_BIN(_pipeline), _source, _sink, NULL);
-          gst_element_link_many(_source, _sink, NULL);
+        for (size_t i = 0; i < chain.size(); i++)
+          gst_bin_add(GST_BIN(_pipeline), chain[i]);
+        for (size_t i = 1; i < chain.size(); i++)
+        {
+          if (!gst_element_link(chain[i - 1], chain[i]))
+          {
+            ROS_ERROR_STREAM("Unsupported media type.");
+            return false;
+          }
+        }
+        if (!gst_element_link(device.tee, queue))
+        {
+          ROS_ERROR_STREAM("Failed to link output to the capture tee");
+          return false;
         }
-        */
 
-        if (!link_ok) {
-          ROS_ERROR_STREAM("Unsupported media type.");
-          exitOnMainThread(1);
+        for (size_t i = 0; i < output.streams.size(); i++)
+        {
+          Stream &stream = output.streams[i];
+          stream.pub = _nh.advertise<audio_common_msgs::AudioData>(stream.topic, 10, true);
+          stream.pub_stamped = _nh.advertise<audio_common_msgs::AudioDataStamped>(stream.topic + "_stamped", 10, true);
+          stream.pub_info = _nh.advertise<audio_common_msgs::AudioInfo>(stream.topic + "_info", 1, true);
+
+          // Describe the stream once, latched, so consumers don't have to
+          // mirror our parameters by hand
+          audio_common_msgs::AudioInfo info;
+          info.channels = stream.channels.empty() ? device.channels : stream.channels.size();
+          info.sample_rate = device.sample_rate;
+          info.sample_format = device.sample_format;
+          if (output.format == "mp3")
+            info.bitrate = output.bitrate;
+          else
+            info.bitrate = info.channels * device.sample_rate * device.depth / 1000;
+          info.coding_format = output.format;
+          stream.pub_info.publish(info);
         }
+        return true;
+      }
 
-        gst_element_set_state(GST_ELEMENT(_pipeline), GST_STATE_PLAYING);
+      static std::string getString(XmlRpc::XmlRpcValue &value, const std::string &key,
+                                   const std::string &default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeString)
+          return static_cast<std::string>(value[key]);
+        return default_value;
+      }
 
-        _gst_thread = boost::thread( boost::bind(g_main_loop_run, _loop) );
+      static int getInt(XmlRpc::XmlRpcValue &value, const std::string &key, int default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeInt)
+          return static_cast<int>(value[key]);
+        return default_value;
       }
 
-      ~RosGstCapture()
+      static double getDouble(XmlRpc::XmlRpcValue &value, const std::string &key, double default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeDouble)
+          return static_cast<double>(value[key]);
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeInt)
+          return static_cast<int>(value[key]);
+        return default_value;
+      }
+
+      // Give up after an error that leaves nothing to capture
+      void fail()
+      {
+        _failed = true;
+        if (_shutdown_on_error)
+          ros::requestShutdown();
+      }
+
+      void publish( Device &device, Stream &stream, const audio_common_msgs::AudioDataConstPtr &msg, GstClockTime pts )
+      {
+        if (device.vad_enabled)
+        {
+          boost::mutex::scoped_lock lock(device.vad_mutex);
+          if (!device.voice_active)
+          {
+            // Hold on to the most recent audio so the onset of the next
+            // utterance can be published along with it
+            stream.preroll.push_back(std::make_pair(pts, msg));
+            while (stream.preroll.size() > 1 &&
+                   ((GST_CLOCK_TIME_IS_VALID(pts) && GST_CLOCK_TIME_IS_VALID(stream.preroll.front().first) &&
+                     pts - stream.preroll.front().first > _vad_preroll * GST_SECOND) ||
+                    stream.preroll.size() > max_preroll_frames))
+            {
+              stream.preroll.pop_front();
+            }
+            return;
+          }
+          while (!stream.preroll.empty())
+          {
+            doPublish(stream, stream.preroll.front().second, stream.preroll.front().first);
+            stream.preroll.pop_front();
+          }
+        }
+        doPublish(stream, msg, pts);
+      }
+
+      // Messages are published as shared pointers, so subscribers in the
+      // same nodelet manager receive them without serialization.
+      void doPublish( Stream &stream, const audio_common_msgs::AudioDataConstPtr &msg, GstClockTime pts )
       {
-        g_main_loop_quit(_loop);
-        gst_element_set_state(_pipeline, GST_STATE_NULL);
-        gst_object_unref(_pipeline);
-        g_main_loop_unref(_loop);
+        stream.pub.publish(msg);
+
+        uint32_t seq = stream.seq++;
+        stream.bytes += msg->data.size();
+        stream.last_pts = pts;
+        if (stream.pub_stamped.getNumSubscribers() > 0)
+        {
+          audio_common_msgs::AudioDataStampedPtr stamped(new audio_common_msgs::AudioDataStamped);
+          stamped->header.seq = seq;
+          stamped->header.stamp = captureTime(pts);
+          stamped->audio = *msg;
+          stream.pub_stamped.publish(stamped);
+        }
       }
 
-      void exitOnMainThread(int code)
+      // Map a buffer's running time onto ROS time. The buffer was captured
+      // (now - running_time_now + pts), so this is independent of how long
+      // it sat in the pipeline before reaching the appsink.
+      ros::Time captureTime(GstClockTime pts)
       {
-        exit(code);
+        ros::Time now = ros::Time::now();
+        if (!GST_CLOCK_TIME_IS_VALID(pts))
+          return now;
+
+        GstClock *clock = gst_element_get_clock(_pipeline);
+        if (!clock)
+          return now;
+        GstClockTime running = gst_clock_get_time(clock) - gst_element_get_base_time(_pipeline);
+        gst_object_unref(clock);
+
+        if (running < pts)
+          return now;
+        ros::Duration age;
+        age.fromNSec(running - pts);
+        return now - age;
       }
 
-      void publish( const audio_common_msgs::AudioData &msg )
+      void measureLevel(Device &device, GstClockTime pts, double duration)
       {
-        _pub.publish(msg);
+        device.level.add(device.samples, device.channels, fromDb(_clip_threshold));
+        if (device.level.frames() < _level_interval * device.sample_rate)
+          return;
+
+        audio_common_msgs::AudioLevelPtr msg(new audio_common_msgs::AudioLevel);
+        msg->header.stamp = captureTime(pts) + ros::Duration(duration);
+        msg->duration = (double)device.level.frames() / device.sample_rate;
+        for (int c = 0; c < device.channels; c++)
+        {
+          msg->rms.push_back(device.level.rmsDb(c));
+          msg->peak.push_back(device.level.peakDb(c));
+          msg->clipped.push_back(device.level.clipped(c));
+        }
+        device.pub_level.publish(msg);
+        device.level.reset();
+      }
+
+      void analyseSpectrum(Device &device, GstClockTime pts, double duration)
+      {
+        device.spectrum->push(device.samples, device.channels);
+
+        ros::Time end = captureTime(pts) + ros::Duration(duration);
+        size_t lag;
+        while (device.spectrum->pop(device.energies, lag))
+        {
+          audio_common_msgs::AudioSpectrumPtr msg(new audio_common_msgs::AudioSpectrum);
+          msg->header.stamp = end - ros::Duration((double)lag / device.sample_rate);
+          msg->scale = _spectrum_scale;
+          msg->min_freq = device.spectrum->minFreq();
+          msg->max_freq = device.spectrum->maxFreq();
+          msg->hop = _spectrum_hop;
+          msg->energies = device.energies;
+          device.pub_spectrum.publish(msg);
+        }
       }
 
       static GstFlowReturn onNewBuffer (GstAppSink *appsink, gpointer userData)
       {
-        RosGstCapture *server = reinterpret_cast<RosGstCapture*>(userData);
+        Output *output = reinterpret_cast<Output*>(userData);
+        Device &device = *output->device;
         GstMapInfo map;
 
         GstSample *sample;
         g_signal_emit_by_name(appsink, "pull-sample", &sample);
 
         GstBuffer *buffer = gst_sample_get_buffer(sample);
+        GstClockTime pts = GST_BUFFER_PTS(buffer);
 
-        audio_common_msgs::AudioData msg;
         gst_buffer_map(buffer, &map, GST_MAP_READ);
-        msg.data.resize( map.size );
+        for (size_t i = 0; i < output->streams.size(); i++)
+        {
+          Stream &stream = output->streams[i];
+          audio_common_msgs::AudioDataPtr msg(new audio_common_msgs::AudioData);
+          if (stream.channels.empty())
+          {
+            msg->data.resize( map.size );
+            memcpy( &msg->data[0], map.data, map.size );
+          }
+          else
+          {
+            deinterleave(map.data, map.size, device.width, device.channels,
+                         stream.channels, msg->data);
+          }
+          device.server->publish(device, stream, msg, pts);
+        }
+        gst_buffer_unmap(buffer, &map);
+        gst_sample_unref(sample);
+
+        return GST_FLOW_OK;
+      }
 
-        memcpy( &msg.data[0], map.data, map.size );
+      static GstPadProbeReturn onRawBuffer (GstPad *pad, GstPadProbeInfo *info, gpointer userData)
+      {
+        Device *device = reinterpret_cast<Device*>(userData);
+        GstBuffer *buffer = GST_PAD_PROBE_INFO_BUFFER(info);
+        GstMapInfo map;
 
+        if (!buffer || !gst_buffer_map(buffer, &map, GST_MAP_READ))
+          return GST_PAD_PROBE_OK;
+        toFloat(map.data, map.size, device->raw_format, device->samples);
         gst_buffer_unmap(buffer, &map);
-        gst_sample_unref(sample);
 
-        server->publish(msg);
+        GstClockTime pts = GST_BUFFER_PTS(buffer);
+        double duration = (double)device->samples.size() / (device->channels * device->sample_rate);
+        if (device->level_enabled)
+          device->server->measureLevel(*device, pts, duration);
+        if (device->spectrum)
+          device->server->analyseSpectrum(*device, pts, duration);
+        if (!device->vad_enabled)
+          return GST_PAD_PROBE_OK;
 
-        return GST_FLOW_OK;
+        double level = rmsDb(device->samples);
+        boost::mutex::scoped_lock lock(device->vad_mutex);
+        if (device->vad.update(level, duration))
+        {
+          device->voice_active = device->vad.active();
+
+          audio_common_msgs::VoiceActivity event;
+          event.header.stamp = device->server->captureTime(pts);
+          event.active = device->voice_active;
+          event.level = level;
+          device->pub_vad.publish(event);
+        }
+        return GST_PAD_PROBE_OK;
+      }
+
+      static void onNewPad (GstElement *decodebin, GstPad *pad, gpointer userData)
+      {
+        Device *device = reinterpret_cast<Device*>(userData);
+        GstPad *sinkpad = gst_element_get_static_pad(device->convert, "sink");
+        if (!GST_PAD_IS_LINKED(sinkpad))
+        {
+          GstCaps *caps = gst_pad_query_caps(pad, NULL);
+          const gchar *name = gst_structure_get_name(gst_caps_get_structure(caps, 0));
+          if (g_str_has_prefix(name, "audio/"))
+            gst_pad_link(pad, sinkpad);
+          gst_caps_unref(caps);
+        }
+        gst_object_unref(sinkpad);
+      }
+
+      static gboolean onEos (GstBus *bus, GstMessage *message, gpointer userData)
+      {
+        RosGstCapture *server = reinterpret_cast<RosGstCapture*>(userData);
+        double elapsed = (ros::WallTime::now() - server->_start_time).toSec();
+        ROS_INFO("End of stream after %.2fs", elapsed);
+        for (size_t i = 0; i < server->_devices.size(); i++)
+        {
+          for (size_t j = 0; j < server->_devices[i]->outputs.size(); j++)
+          {
+            const Output &output = *server->_devices[i]->outputs[j];
+            for (size_t k = 0; k < output.streams.size(); k++)
+            {
+              const Stream &stream = output.streams[k];
+              double audio = GST_CLOCK_TIME_IS_VALID(stream.last_pts) ?
+                (double)stream.last_pts / GST_SECOND : 0.0;
+              ROS_INFO("  %s: %u frames, %lu bytes (%.0f bytes/s), %.2fs of audio (%.1fx realtime)",
+                       stream.topic.c_str(), stream.seq, (unsigned long)stream.bytes,
+                       elapsed > 0 ? stream.bytes / elapsed : 0.0, audio,
+                       elapsed > 0 ? audio / elapsed : 0.0);
+            }
+          }
+        }
+        g_main_loop_quit(server->_loop);
+        if (server->_shutdown_on_eos)
+          ros::requestShutdown();
+        return FALSE;
+      }
+
+      static gboolean quitLoop(gpointer loop)
+      {
+        g_main_loop_quit(reinterpret_cast<GMainLoop*>(loop));
+        return FALSE;
       }
 
       static gboolean onMessage (GstBus *bus, GstMessage *message, gpointer userData)
@@ -197,29 +969,57 @@ namespace audio_transport
         g_error_free(err);
         g_free(debug);
         g_main_loop_quit(server->_loop);
-        server->exitOnMainThread(1);
+        server->fail();
         return FALSE;
       }
 
     private:
       ros::NodeHandle _nh;
-      ros::Publisher _pub;
+      std::vector<boost::shared_ptr<Device> > _devices;
+
+      // Voice activity gating, shared by all devices
+      static const size_t max_preroll_frames = 1000;
+      bool _vad_enabled;
+      double _vad_start_threshold, _vad_stop_threshold, _vad_hangover, _vad_preroll;
+
+      // Level and spectrum analysis, shared by all devices
+      bool _level_enabled, _spectrum_enabled;
+      double _level_interval, _clip_threshold;
+      int _spectrum_window, _spectrum_bands;
+      double _spectrum_hop, _spectrum_min_freq, _spectrum_max_freq;
+      std::string _spectrum_scale;
 
       boost::thread _gst_thread;
 
-      GstElement *_pipeline, *_source, *_filter, *_sink, *_convert, *_encode;
+      GstElement *_pipeline;
       GstBus *_bus;
-      int _bitrate, _channels, _depth, _sample_rate;
+      GMainContext *_context;
       GMainLoop *_loop;
-      std::string _format, _sample_format;
+      bool _realtime, _wait_for_subscribers, _shutdown_on_eos, _shutdown_on_error;
+      volatile bool _stopping, _failed;
+      ros::WallTime _start_time;
   };
 }
 
-int main (int argc, char **argv)
+namespace audio_capture
 {
-  ros::init(argc, argv, "audio_capture");
-  gst_init(&argc, &argv);
+  class AudioCaptureNodelet : public nodelet::Nodelet
+  {
+    public:
+      virtual void onInit()
+      {
+        gst_init(NULL, NULL);
+        _capture.reset(new audio_transport::RosGstCapture(getNodeHandle(), getPrivateNodeHandle()));
+        if (!_capture->ok())
+        {
+          NODELET_ERROR("Could not set up the capture, see the errors above");
+          _capture.reset();
+        }
+      }
 
-  audio_transport::RosGstCapture server;
-  ros::spin();
+    private:
+      boost::shared_ptr<audio_transport::RosGstCapture> _capture;
+  };
 }
+
+PLUGINLIB_EXPORT_CLASS(audio_capture::AudioCaptureNodelet, nodelet::Nodelet)
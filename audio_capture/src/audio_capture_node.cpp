@@ -0,0 +1,27 @@
+#include <ros/ros.h>
+#include <nodelet/loader.h>
+
+// Standalone audio_capture: loads the nodelet into this process so the
+// node behaves exactly as when it runs inside a nodelet manager.
+int main (int argc, char **argv)
+{
+  ros::init(argc, argv, "audio_capture");
+
+  // The process exists for this one capture, so it ends with the stream
+  ros::NodeHandle pnh("~");
+  if (!pnh.hasParam("shutdown_on_eos"))
+    pnh.setParam("shutdown_on_eos", true);
+  if (!pnh.hasParam("shutdown_on_error"))
+    pnh.setParam("shutdown_on_error", true);
+
+  nodelet::Loader nodelet(false);
+  nodelet::M_string remap(ros::names::getRemappings());
+  nodelet::V_string nargv(argv + 1, argv + argc);
+  if (!nodelet.load(ros::this_node::getName(), "audio_capture/AudioCaptureNodelet", remap, nargv))
+  {
+    ROS_ERROR("Failed to load the audio_capture nodelet");
+    return 1;
+  }
+
+  ros::spin();
+}
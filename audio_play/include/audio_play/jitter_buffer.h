@@ -0,0 +1,122 @@
+#ifndef AUDIO_PLAY__JITTER_BUFFER__H__
+#define AUDIO_PLAY__JITTER_BUFFER__H__
+
+#include <algorithm>
+#include <cmath>
+#include <deque>
+
+namespace audio_transport
+{
+  /** \brief Adaptive playout buffer for audio frames arriving over a network.
+   *
+   * Frames are queued on arrival and released one at a time when the sink
+   * asks for data. The amount of audio held back adapts to the measured
+   * arrival jitter (RFC 3550 style running estimate), bounded by the
+   * configured target and maximum latency. When the producer outruns the
+   * sink, the oldest frames are dropped to catch up; when the buffer runs
+   * dry, it re-primes to the target before releasing frames again.
+   *
+   * Time is in seconds; the buffer itself is not thread safe.
+   */
+  template <typename Frame>
+  class JitterBuffer
+  {
+    public:
+      JitterBuffer(double target_latency, double max_latency, double jitter_factor)
+        : _target_latency(target_latency),
+          _max_latency(std::max(target_latency, max_latency)),
+          _jitter_factor(jitter_factor),
+          _last_arrival(-1.0),
+          _period(0.0),
+          _jitter(0.0),
+          _priming(true),
+          _underruns(0),
+          _overruns(0),
+          _received(0)
+      {
+      }
+
+      /** \brief Queue a frame that arrived at the given time. */
+      void push(const Frame &frame, double arrival)
+      {
+        if (_last_arrival >= 0.0)
+        {
+          double interval = arrival - _last_arrival;
+          if (_period <= 0.0)
+            _period = interval;
+          else
+            _period += (interval - _period) / 16.0;
+          _jitter += (std::fabs(interval - _period) - _jitter) / 16.0;
+        }
+        _last_arrival = arrival;
+        _received++;
+
+        _frames.push_back(frame);
+
+        // Catch up once we are well behind, rather than letting latency grow
+        // for as long as the producer outruns the sink.
+        if (depth() > std::min(_max_latency, 2.0 * targetLatency()) && _period > 0.0)
+        {
+          while (_frames.size() > 1 && depth() > targetLatency())
+          {
+            _frames.pop_front();
+            _overruns++;
+          }
+        }
+      }
+
+      /** \brief Release the next frame for playback.
+       *
+       * Returns false while the buffer is (re-)priming or empty.
+       */
+      bool pop(Frame &frame)
+      {
+        if (_priming)
+        {
+          if (_frames.empty() || depth() < targetLatency())
+            return false;
+          _priming = false;
+        }
+
+        if (_frames.empty())
+        {
+          _underruns++;
+          _priming = true;
+          return false;
+        }
+
+        frame = _frames.front();
+        _frames.pop_front();
+        return true;
+      }
+
+      /** \brief Latency currently aimed for, adapted to the arrival jitter. */
+      double targetLatency() const
+      {
+        return std::min(_max_latency, std::max(_target_latency, _jitter_factor * _jitter));
+      }
+
+      /** \brief Amount of audio queued, estimated from the arrival rate. */
+      double depth() const
+      {
+        return _frames.size() * _period;
+      }
+
+      size_t size() const { return _frames.size(); }
+      bool priming() const { return _priming; }
+      double jitter() const { return _jitter; }
+      double period() const { return _period; }
+      unsigned long underruns() const { return _underruns; }
+      unsigned long overruns() const { return _overruns; }
+      unsigned long received() const { return _received; }
+
+    private:
+      std::deque<Frame> _frames;
+      double _target_latency, _max_latency, _jitter_factor;
+      double _last_arrival, _period, _jitter;
+      bool _priming;
+      unsigned long _underruns, _overruns, _received;
+  };
+}
+
+#endif
@@ -2,75 +2,373 @@
 #include <gst/app/gstappsrc.h>
 #include <gst/gstplugin.h>
 #include <ros/ros.h>
+#include <nodelet/nodelet.h>
+#include <pluginlib/class_list_macros.h>
 #include <boost/thread.hpp>
+#include <sstream>
+#include <diagnostic_msgs/DiagnosticArray.h>
 
 #include "audio_common_msgs/AudioData.h"
+#include "audio_common_msgs/AudioInfo.h"
+#include "audio_play/jitter_buffer.h"
 
 namespace audio_transport
 {
   class RosGstPlay
   {
     public:
-      RosGstPlay()
+      RosGstPlay(ros::NodeHandle nh, ros::NodeHandle pnh)
+        : _nh(nh), _started(false), _failed(false), _pipeline(NULL), _sink(NULL), _mixer(NULL),
+          _context(NULL), _loop(NULL)
       {
-        GstPad *audiopad;
-        GstCaps *caps;
+        bool use_audio_info;
+        double target_latency, max_latency, jitter_factor;
+        std::string format, sample_format;
+        int channels, sample_rate;
 
-        std::string dst_type;
-        std::string device;
-        bool do_timestamp;
-        std::string format;
-        int channels;
-        int sample_rate;
-        std::string sample_format;
+        // End the process when playback can't be set up. The standalone
+        // node turns this on; in a nodelet manager it would take every
+        // other nodelet down too.
+        pnh.param<bool>("shutdown_on_error", _shutdown_on_error, false);
 
         // The destination of the audio
-        ros::param::param<std::string>("~dst", dst_type, "alsasink");
-        ros::param::param<std::string>("~device", device, std::string());
-        ros::param::param<bool>("~do_timestamp", do_timestamp, true);
-        ros::param::param<std::string>("~format", format, "mp3");
-        ros::param::param<int>("~channels", channels, 1);
-        ros::param::param<int>("~sample_rate", sample_rate, 16000);
-        ros::param::param<std::string>("~sample_format", sample_format, "S16LE");
+        pnh.param<std::string>("dst", _dst_type, "alsasink");
+        pnh.param<std::string>("device", _device, std::string());
+        pnh.param<bool>("do_timestamp", _do_timestamp, true);
+        pnh.param<std::string>("format", format, "mp3");
+        pnh.param<int>("channels", channels, 1);
+        pnh.param<int>("sample_rate", sample_rate, 16000);
+        pnh.param<std::string>("sample_format", sample_format, "S16LE");
+
+        // Prefer the stream description published by audio_capture over
+        // the parameters above, which have to be kept in sync by hand
+        pnh.param<bool>("use_audio_info", use_audio_info, true);
+        pnh.param<double>("audio_info_timeout", _audio_info_timeout, 5.0);
+
+        // Playout buffering: hold back at least ~target_latency seconds of
+        // audio, more when the measured arrival jitter calls for it, but
+        // never more than ~max_latency.
+        pnh.param<double>("target_latency", target_latency, 0.1);
+        pnh.param<double>("max_latency", max_latency, 0.5);
+        pnh.param<double>("jitter_factor", jitter_factor, 3.0);
+        // How long a gap in a raw stream is filled with silence
+        pnh.param<double>("max_conceal", _max_conceal, 0.5);
+        // Bound on the appsrc queue, which only ever holds the frame being
+        // handed to the decoder/sink
+        pnh.param<int>("max_queue_bytes", _max_queue_bytes, 65536);
+
+        // Several streams can be mixed into the one sink. Each entry of
+        // ~inputs overrides the parameters above for one topic and may set
+        // a gain and a priority; while a stream plays, streams of lower
+        // priority are ducked to ~duck_gain over ~duck_ramp seconds.
+        pnh.param<int>("mix_sample_rate", _mix_sample_rate, 48000);
+        pnh.param<int>("mix_channels", _mix_channels, 2);
+        pnh.param<double>("duck_gain", _duck_gain, 0.25);
+        pnh.param<double>("duck_ramp", _duck_ramp, 0.2);
+        pnh.param<double>("duck_hold", _duck_hold, 0.5);
+
+        _mixing = false;
+        XmlRpc::XmlRpcValue inputs;
+        if (pnh.getParam("inputs", inputs))
+        {
+          if (inputs.getType() != XmlRpc::XmlRpcValue::TypeArray || inputs.size() == 0)
+          {
+            ROS_ERROR_STREAM("~inputs must be a non-empty list");
+            fail();
+            return;
+          }
+          _mixing = true;
+          for (int i = 0; i < inputs.size(); i++)
+          {
+            XmlRpc::XmlRpcValue &entry = inputs[i];
+            if (entry.getType() != XmlRpc::XmlRpcValue::TypeStruct || !entry.hasMember("topic"))
+            {
+              ROS_ERROR_STREAM("~inputs entries must be dictionaries with a topic");
+              fail();
+              return;
+            }
+            boost::shared_ptr<Input> input(new Input);
+            input->topic = getString(entry, "topic", "audio");
+            input->format = getString(entry, "format", format);
+            input->channels = getInt(entry, "channels", channels);
+            input->sample_rate = getInt(entry, "sample_rate", sample_rate);
+            input->sample_format = getString(entry, "sample_format", sample_format);
+            input->gain = getDouble(entry, "gain", 1.0);
+            input->priority = getInt(entry, "priority", 0);
+            _inputs.push_back(input);
+          }
+        }
+        else
+        {
+          boost::shared_ptr<Input> input(new Input);
+          input->topic = "audio";
+          input->format = format;
+          input->channels = channels;
+          input->sample_rate = sample_rate;
+          input->sample_format = sample_format;
+          input->gain = 1.0;
+          input->priority = 0;
+          _inputs.push_back(input);
+        }
+
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          Input &input = *_inputs[i];
+          input.server = this;
+          input.jitter = JitterBuffer<audio_common_msgs::AudioDataConstPtr>(
+              target_latency, max_latency, jitter_factor);
+          input.configured = !use_audio_info;
+        }
+
+        _diagnostic_pub = _nh.advertise<diagnostic_msgs::DiagnosticArray>("/diagnostics", 1);
+        _diagnostic_timer = _nh.createTimer(ros::Duration(1.0), &RosGstPlay::publishDiagnostics, this);
+
+        if (!use_audio_info)
+        {
+          start();
+          return;
+        }
+
+        // The pipeline depends on the stream formats, so it is built once
+        // every <topic>_info has arrived, or the parameters are used after
+        // ~audio_info_timeout. Waiting here would stall a nodelet manager.
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          Input &input = *_inputs[i];
+          input.sub_info = _nh.subscribe<audio_common_msgs::AudioInfo>(
+              input.topic + "_info", 1, boost::bind(&RosGstPlay::onAudioInfo, this, &input, _1));
+        }
+        _info_timer = _nh.createTimer(ros::Duration(_audio_info_timeout), &RosGstPlay::onInfoTimeout, this, true);
+      }
+
+      // False once setting up playback has failed
+      bool ok() const
+      {
+        return !_failed;
+      }
+
+      ~RosGstPlay()
+      {
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          _inputs[i]->sub.shutdown();
+          _inputs[i]->sub_info.shutdown();
+        }
+        _diagnostic_timer.stop();
+        _duck_timer.stop();
+        _info_timer.stop();
+        if (!_started)
+          return;
+
+        gst_element_set_state(_pipeline, GST_STATE_NULL);
+        gst_object_unref(_pipeline);
+        g_main_loop_quit(_loop);
+        _gst_thread.join();
+        g_main_loop_unref(_loop);
+        g_main_context_unref(_context);
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          if (_inputs[i]->pool)
+          {
+            gst_buffer_pool_set_active(_inputs[i]->pool, FALSE);
+            gst_object_unref(_inputs[i]->pool);
+          }
+        }
+      }
 
-        _sub = _nh.subscribe("audio", 10, &RosGstPlay::onAudio, this);
+    private:
 
-        _loop = g_main_loop_new(NULL, false);
+      // One subscribed stream, fed into the pipeline through its own appsrc
+      struct Input
+      {
+        Input()
+          : server(NULL), channels(1), sample_rate(16000), gain(1.0), priority(0),
+            configured(false), info_mismatch(false), source(NULL), decoder(NULL), audio(NULL), volume(NULL),
+            jitter(0.0, 0.0, 0.0), need_data(false), last_size(0), pool(NULL), pool_size(0),
+            conceal_time(0.0), concealed(0), push_errors(0), last_arrival(-1.0), duck(1.0)
+        {}
+
+        RosGstPlay *server;
+        std::string topic, format, sample_format;
+        int channels, sample_rate;
+        double gain;
+        int priority;
+        // Whether the format is settled, from <topic>_info or the parameters
+        bool configured;
+        bool info_mismatch;
+        ros::Subscriber sub, sub_info;
+
+        // audio is the element decoded audio is linked to
+        GstElement *source, *decoder, *audio, *volume;
+
+        JitterBuffer<audio_common_msgs::AudioDataConstPtr> jitter;
+        bool need_data;
+        size_t last_size;
+        GstBufferPool *pool;
+        size_t pool_size;
+        double conceal_time;
+        unsigned long concealed, push_errors;
+
+        // Ducking state: wall time of the last frame and the current
+        // attenuation applied on top of the gain
+        double last_arrival;
+        double duck;
+      };
+
+      // Build the pipeline and start playing, once all inputs are
+      // configured. Called with _mutex held, or before any callback runs.
+      void start()
+      {
+        _started = true;
+        _context = g_main_context_new();
+        _loop = g_main_loop_new(_context, false);
 
         _pipeline = gst_pipeline_new("app_pipeline");
-        _source = gst_element_factory_make("appsrc", "app_source");
-        g_object_set(G_OBJECT(_source), "do-timestamp", (do_timestamp) ? TRUE : FALSE, NULL);
+        if (!_mixing)
+        {
+          Input &input = *_inputs[0];
+          createSource(input, _do_timestamp, _max_queue_bytes);
+          buildPipeline(input, _dst_type, _device);
+        }
+        else
+        {
+          if (!buildMixer(_dst_type, _device))
+          {
+            abortStart();
+            return;
+          }
+          for (size_t i = 0; i < _inputs.size(); i++)
+          {
+            // Live sources let the mixer carry on while an input is idle
+            createSource(*_inputs[i], true, _max_queue_bytes);
+            g_object_set(G_OBJECT(_inputs[i]->source), "is-live", TRUE, NULL);
+            g_object_set(G_OBJECT(_inputs[i]->source), "format", GST_FORMAT_TIME, NULL);
+            if (!addInput(*_inputs[i], _mix_sample_rate, _mix_channels))
+            {
+              abortStart();
+              return;
+            }
+          }
+        }
+
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          Input &input = *_inputs[i];
+          input.sub = _nh.subscribe<audio_common_msgs::AudioData>(
+              input.topic, 10, boost::bind(&RosGstPlay::onAudio, this, &input, _1));
+        }
+
+        bool ducking = false;
+        for (size_t i = 1; i < _inputs.size(); i++)
+          ducking = ducking || _inputs[i]->priority != _inputs[0]->priority;
+        if (ducking)
+          _duck_timer = _nh.createTimer(ros::Duration(duck_period), &RosGstPlay::updateDucking, this);
+
+        gst_element_set_state(GST_ELEMENT(_pipeline), GST_STATE_PLAYING);
+
+        _gst_thread = boost::thread( boost::bind(g_main_loop_run, _loop) );
+      }
+
+      // Drop a pipeline that couldn't be built. Nothing is playing yet, so
+      // the main loop hasn't been started.
+      void abortStart()
+      {
+        gst_object_unref(_pipeline);
+        g_main_loop_unref(_loop);
+        g_main_context_unref(_context);
+        _pipeline = NULL;
+        _loop = NULL;
+        _context = NULL;
+        _started = false;
+        fail();
+      }
+
+      // Give up after an error that leaves nothing to play
+      void fail()
+      {
+        _failed = true;
+        if (_shutdown_on_error)
+          ros::requestShutdown();
+      }
+
+      // Start once every input is configured. Called with _mutex held.
+      void startWhenConfigured()
+      {
+        if (_started || _failed)
+          return;
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          if (!_inputs[i]->configured)
+            return;
+        }
+        _info_timer.stop();
+        start();
+      }
+
+      // Inputs whose <topic>_info hasn't arrived in time use the parameters
+      void onInfoTimeout(const ros::TimerEvent &)
+      {
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          Input &input = *_inputs[i];
+          if (!input.configured)
+          {
+            ROS_WARN("No %s_info received within %.1fs, using parameters",
+                     input.topic.c_str(), _audio_info_timeout);
+            input.configured = true;
+          }
+        }
+        startWhenConfigured();
+      }
+
+      void createSource(Input &input, bool do_timestamp, int max_queue_bytes)
+      {
+        input.source = gst_element_factory_make("appsrc", NULL);
+        g_object_set(G_OBJECT(input.source), "do-timestamp", (do_timestamp) ? TRUE : FALSE, NULL);
+        g_object_set(G_OBJECT(input.source), "max-bytes", (guint64)max_queue_bytes, NULL);
+        g_object_set(G_OBJECT(input.source), "block", FALSE, NULL);
+        g_signal_connect(input.source, "need-data", G_CALLBACK(cb_need_data), &input);
+        g_signal_connect(input.source, "enough-data", G_CALLBACK(cb_enough_data), &input);
+      }
+
+      GstCaps *rawCaps(const Input &input)
+      {
+        return gst_caps_new_simple(
+            "audio/x-raw",
+            "format", G_TYPE_STRING, input.sample_format.c_str(),
+            "rate", G_TYPE_INT, input.sample_rate,
+            "channels", G_TYPE_INT, input.channels,
+            "layout", G_TYPE_STRING, "interleaved",
+            NULL);
+      }
+
+      // A single stream straight into the sink
+      void buildPipeline(Input &input, const std::string &dst_type, const std::string &device)
+      {
+        GstPad *audiopad;
+        GstCaps *caps;
 
-        //_playbin = gst_element_factory_make("playbin2", "uri_play");
-        //g_object_set( G_OBJECT(_playbin), "uri", "file:///home/test/test.mp3", NULL);
         if (dst_type == "alsasink")
         {
-          caps = gst_caps_new_simple(
-              "audio/x-raw",
-              "format", G_TYPE_STRING, sample_format.c_str(),
-              "rate", G_TYPE_INT, sample_rate,
-              "channels", G_TYPE_INT, channels,
-              "layout", G_TYPE_STRING, "interleaved",
-              NULL);
-          if (format == "mp3")
+          caps = rawCaps(input);
+          if (input.format == "mp3")
           {
-            gst_bin_add( GST_BIN(_pipeline), _source);
-            _decoder = gst_element_factory_make("decodebin", "decoder");
-            g_signal_connect(_decoder, "pad-added", G_CALLBACK(cb_newpad),this);
-            gst_bin_add( GST_BIN(_pipeline), _decoder);
-            gst_element_link(_source, _decoder);
-
-            _audio = gst_bin_new("audiobin");
-            _convert = gst_element_factory_make("audioconvert", "convert");
-            audiopad = gst_element_get_static_pad(_convert, "sink");
-
-            _filter = gst_element_factory_make("capsfilter", "filter");
-            g_object_set(G_OBJECT(_filter), "caps", caps, NULL);
-
-            _sink = gst_element_factory_make("autoaudiosink", "sink");
-            if (!device.empty()) {
-              g_object_set(G_OBJECT(_sink), "device", device.c_str(), NULL);
-            }
+            gst_bin_add( GST_BIN(_pipeline), input.source);
+            input.decoder = gst_element_factory_make("decodebin", "decoder");
+            g_signal_connect(input.decoder, "pad-added", G_CALLBACK(cb_newpad), &input);
+            gst_bin_add( GST_BIN(_pipeline), input.decoder);
+            gst_element_link(input.source, input.decoder);
+
+            input.audio = gst_bin_new("audiobin");
+            GstElement *convert = gst_element_factory_make("audioconvert", "convert");
+            audiopad = gst_element_get_static_pad(convert, "sink");
+
+            GstElement *filter = gst_element_factory_make("capsfilter", "filter");
+            g_object_set(G_OBJECT(filter), "caps", caps, NULL);
+
+            _sink = makeAudioSink(device, "sink");
 
             GstElement *_rgvolume = gst_element_factory_make ("rgvolume", "volume");
             
@@ -79,27 +377,27 @@ namespace audio_transport
             g_object_set(G_OBJECT(_rgvolume), "fallback-gain",  20.0, NULL);
             // ------------------------ gain setting ------------------------
 
-            gst_bin_add_many( GST_BIN(_audio), _convert, _rgvolume, _sink, NULL);
-            gst_element_link(_convert, _rgvolume);
+            gst_bin_add_many( GST_BIN(input.audio), convert, _rgvolume, _sink, NULL);
+            gst_element_link(convert, _rgvolume);
             gst_element_link(_rgvolume, _sink);
-            gst_element_add_pad(_audio, gst_ghost_pad_new("sink", audiopad));
+            gst_element_add_pad(input.audio, gst_ghost_pad_new("sink", audiopad));
             gst_object_unref(audiopad);
             gst_caps_unref(caps);
 
-            gst_bin_add(GST_BIN(_pipeline), _audio);
+            gst_bin_add(GST_BIN(_pipeline), input.audio);
           }
-          else if (format == "wave")
+          else if (input.format == "wave")
           {
-            g_object_set( G_OBJECT(_source), "caps", caps, NULL);
-            g_object_set (G_OBJECT (_source), "format", GST_FORMAT_TIME, NULL);
-            _sink = gst_element_factory_make( "autoaudiosink", "sink" );
-            gst_bin_add_many( GST_BIN(_pipeline), _source, _sink, NULL);
-            gst_element_link_many( _source, _sink, NULL);
+            g_object_set( G_OBJECT(input.source), "caps", caps, NULL);
+            g_object_set (G_OBJECT (input.source), "format", GST_FORMAT_TIME, NULL);
+            _sink = makeAudioSink(device, "sink");
+            gst_bin_add_many( GST_BIN(_pipeline), input.source, _sink, NULL);
+            gst_element_link_many( input.source, _sink, NULL);
             gst_caps_unref(caps);
           }
           else
           {
-            ROS_ERROR("Unsupported format: %s", format.c_str());
+            ROS_ERROR("Unsupported format: %s", input.format.c_str());
           }
         }
         else
@@ -107,37 +405,389 @@ namespace audio_transport
           _sink = gst_element_factory_make("filesink", "sink");
           g_object_set( G_OBJECT(_sink), "location", dst_type.c_str(), NULL);
           gst_bin_add(GST_BIN(_pipeline), _sink);
-          gst_element_link(_source, _sink);
+          gst_element_link(input.source, _sink);
         }
+      }
 
-        gst_element_set_state(GST_ELEMENT(_pipeline), GST_STATE_PLAYING);
-        //gst_element_set_state(GST_ELEMENT(_playbin), GST_STATE_PLAYING);
+      // autoaudiosink has no device property, so a given device is opened
+      // with alsasink
+      static GstElement *makeAudioSink(const std::string &device, const char *name)
+      {
+        if (device.empty())
+          return gst_element_factory_make("autoaudiosink", name);
+        GstElement *sink = gst_element_factory_make("alsasink", name);
+        g_object_set(G_OBJECT(sink), "device", device.c_str(), NULL);
+        return sink;
+      }
 
-        _gst_thread = boost::thread( boost::bind(g_main_loop_run, _loop) );
+      // Several streams mixed into one sink, which is opened only once
+      bool buildMixer(const std::string &dst_type, const std::string &device)
+      {
+        _mixer = gst_element_factory_make("audiomixer", NULL);
+        GstElement *convert = gst_element_factory_make("audioconvert", NULL);
+        if (!_mixer || !convert)
+        {
+          ROS_ERROR_STREAM("Failed to create the audio mixer");
+          return false;
+        }
+
+        std::vector<GstElement*> chain;
+        chain.push_back(_mixer);
+        chain.push_back(convert);
+        if (dst_type == "alsasink")
+        {
+          _sink = makeAudioSink(device, NULL);
+        }
+        else
+        {
+          chain.push_back(gst_element_factory_make("wavenc", NULL));
+          _sink = gst_element_factory_make("filesink", NULL);
+          g_object_set( G_OBJECT(_sink), "location", dst_type.c_str(), NULL);
+        }
+        chain.push_back(_sink);
+
+        for (size_t i = 0; i < chain.size(); i++)
+          gst_bin_add(GST_BIN(_pipeline), chain[i]);
+        for (size_t i = 1; i < chain.size(); i++)
+        {
+          if (!gst_element_link(chain[i - 1], chain[i]))
+          {
+            ROS_ERROR_STREAM("Failed to link the mixer to the sink");
+            return false;
+          }
+        }
+        return true;
       }
 
-    private:
+      // source -> [decode] -> convert -> resample -> mix format -> volume -> mixer
+      bool addInput(Input &input, int mix_sample_rate, int mix_channels)
+      {
+        GstElement *convert = gst_element_factory_make("audioconvert", NULL);
+        GstElement *resample = gst_element_factory_make("audioresample", NULL);
+        GstElement *filter = gst_element_factory_make("capsfilter", NULL);
+        input.volume = gst_element_factory_make("volume", NULL);
+        g_object_set(G_OBJECT(input.volume), "volume", input.gain, NULL);
+
+        GstCaps *caps = gst_caps_new_simple(
+            "audio/x-raw",
+            "format", G_TYPE_STRING, "F32LE",
+            "rate", G_TYPE_INT, mix_sample_rate,
+            "channels", G_TYPE_INT, mix_channels,
+            "layout", G_TYPE_STRING, "interleaved",
+            NULL);
+        g_object_set(G_OBJECT(filter), "caps", caps, NULL);
+        gst_caps_unref(caps);
+
+        gst_bin_add_many(GST_BIN(_pipeline), input.source, convert, resample, filter, input.volume, NULL);
+        input.audio = convert;
+        if (input.format == "mp3")
+        {
+          input.decoder = gst_element_factory_make("decodebin", NULL);
+          g_signal_connect(input.decoder, "pad-added", G_CALLBACK(cb_newpad), &input);
+          gst_bin_add(GST_BIN(_pipeline), input.decoder);
+          gst_element_link(input.source, input.decoder);
+        }
+        else if (input.format == "wave")
+        {
+          caps = rawCaps(input);
+          g_object_set(G_OBJECT(input.source), "caps", caps, NULL);
+          gst_caps_unref(caps);
+          gst_element_link(input.source, convert);
+        }
+        else
+        {
+          ROS_ERROR("Unsupported format for %s: %s", input.topic.c_str(), input.format.c_str());
+          return false;
+        }
+
+        if (!gst_element_link_many(convert, resample, filter, input.volume, _mixer, NULL))
+        {
+          ROS_ERROR_STREAM("Failed to link " << input.topic << " to the mixer");
+          return false;
+        }
+        return true;
+      }
+
+      void onAudio(Input *input, const audio_common_msgs::AudioDataConstPtr &msg)
+      {
+        double now = ros::WallTime::now().toSec();
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        if (input->info_mismatch || msg->data.empty())
+          return;
+
+        input->jitter.push(msg, now);
+        input->last_size = msg->data.size();
+        input->last_arrival = now;
+        input->conceal_time = 0.0;
+        // The sink has been starving; hand it the next frame right away
+        if (input->need_data)
+          feed(*input);
+      }
+
+      // Push the next frame from the jitter buffer, concealing a gap in raw
+      // streams with silence for up to ~max_conceal. Called with _mutex held.
+      void feed(Input &input)
+      {
+        audio_common_msgs::AudioDataConstPtr frame;
+        if (input.jitter.pop(frame))
+        {
+          pushBuffer(input, wrapFrame(frame));
+        }
+        else if (input.format == "wave" && input.jitter.received() > 0 &&
+                 input.conceal_time < _max_conceal && input.jitter.period() > 0.0)
+        {
+          GstBuffer *buffer = silenceBuffer(input, input.last_size);
+          if (buffer)
+          {
+            pushBuffer(input, buffer);
+            input.concealed++;
+            input.conceal_time += input.jitter.period();
+          }
+        }
+      }
+
+      // Hand the message payload to GStreamer without copying it. The
+      // message is kept alive until GStreamer releases the memory.
+      static GstBuffer *wrapFrame(const audio_common_msgs::AudioDataConstPtr &frame)
+      {
+        return gst_buffer_new_wrapped_full(
+            GST_MEMORY_FLAG_READONLY,
+            const_cast<uint8_t*>(&frame->data[0]), frame->data.size(),
+            0, frame->data.size(),
+            new audio_common_msgs::AudioDataConstPtr(frame), releaseFrame);
+      }
+
+      static void releaseFrame(gpointer data)
+      {
+        delete static_cast<audio_common_msgs::AudioDataConstPtr*>(data);
+      }
+
+      // Silence for concealment comes from a buffer pool sized to the
+      // stream's frames, so gaps don't cost an allocation per frame.
+      GstBuffer *silenceBuffer(Input &input, size_t size)
+      {
+        if (input.pool && size != input.pool_size)
+        {
+          gst_buffer_pool_set_active(input.pool, FALSE);
+          gst_object_unref(input.pool);
+          input.pool = NULL;
+        }
+        if (!input.pool)
+        {
+          input.pool = gst_buffer_pool_new();
+          GstStructure *config = gst_buffer_pool_get_config(input.pool);
+          gst_buffer_pool_config_set_params(config, NULL, size, 2, 0);
+          if (!gst_buffer_pool_set_config(input.pool, config) ||
+              !gst_buffer_pool_set_active(input.pool, TRUE))
+          {
+            ROS_WARN("Failed to set up the silence buffer pool");
+            gst_object_unref(input.pool);
+            input.pool = NULL;
+            return NULL;
+          }
+          input.pool_size = size;
+        }
+
+        GstBuffer *buffer = NULL;
+        if (gst_buffer_pool_acquire_buffer(input.pool, &buffer, NULL) != GST_FLOW_OK)
+          return NULL;
+        gst_buffer_memset(buffer, 0, 0, size);
+        return buffer;
+      }
 
-      void onAudio(const audio_common_msgs::AudioDataConstPtr &msg)
+      void pushBuffer(Input &input, GstBuffer *buffer)
       {
-        GstBuffer *buffer = gst_buffer_new_and_alloc(msg->data.size());
-        gst_buffer_fill(buffer, 0, &msg->data[0], msg->data.size());
         GstFlowReturn ret;
+        g_signal_emit_by_name(input.source, "push-buffer", buffer, &ret);
+        gst_buffer_unref(buffer);
+        input.need_data = false;
+        if (ret != GST_FLOW_OK)
+        {
+          input.push_errors++;
+          ROS_WARN_THROTTLE(5.0, "Failed to push audio into the pipeline: %s",
+                            gst_flow_get_name(ret));
+        }
+      }
+
+      static void cb_need_data(GstElement *appsrc, guint length, gpointer data)
+      {
+        Input *input = reinterpret_cast<Input*>(data);
+        boost::recursive_mutex::scoped_lock lock(input->server->_mutex);
+        input->need_data = true;
+        input->server->feed(*input);
+      }
 
-        g_signal_emit_by_name(_source, "push-buffer", buffer, &ret);
+      static void cb_enough_data(GstElement *appsrc, gpointer data)
+      {
+        Input *input = reinterpret_cast<Input*>(data);
+        boost::recursive_mutex::scoped_lock lock(input->server->_mutex);
+        input->need_data = false;
+      }
+
+      // Duck every input while one of higher priority is playing, ramping
+      // the attenuation so it doesn't click
+      void updateDucking(const ros::TimerEvent &)
+      {
+        double now = ros::WallTime::now().toSec();
+        double step = _duck_ramp > 0.0 ? duck_period / _duck_ramp : 1.0;
+
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        bool playing = false;
+        int top = 0;
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          const Input &input = *_inputs[i];
+          if (input.last_arrival >= 0.0 && now - input.last_arrival < _duck_hold &&
+              (!playing || input.priority > top))
+          {
+            playing = true;
+            top = input.priority;
+          }
+        }
+
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          Input &input = *_inputs[i];
+          double target = (playing && input.priority < top) ? _duck_gain : 1.0;
+          if (input.duck == target)
+            continue;
+          if (input.duck < target)
+            input.duck = std::min(target, input.duck + step);
+          else
+            input.duck = std::max(target, input.duck - step);
+          g_object_set(G_OBJECT(input.volume), "volume", input.gain * input.duck, NULL);
+        }
+      }
+
+      void publishDiagnostics(const ros::TimerEvent &)
+      {
+        diagnostic_msgs::DiagnosticArray da;
+
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        for (size_t i = 0; i < _inputs.size(); i++)
+        {
+          const Input &input = *_inputs[i];
+          diagnostic_msgs::DiagnosticStatus ds;
+          ds.name = ros::this_node::getName().substr(1) + ": Jitter buffer";
+          if (_inputs.size() > 1)
+            ds.name += " (" + input.topic + ")";
+          ds.hardware_id = _nh.resolveName(input.topic);
+
+          ds.level = (input.jitter.priming() && input.jitter.received() > 0) ?
+            diagnostic_msgs::DiagnosticStatus::WARN : diagnostic_msgs::DiagnosticStatus::OK;
+          if (!input.configured)
+            ds.message = "Waiting for " + input.topic + "_info";
+          else
+            ds.message = input.jitter.priming() ? "Buffering" : "Playing";
+          addValue(ds, "Buffer depth [s]", input.jitter.depth());
+          addValue(ds, "Buffered frames", input.jitter.size());
+          addValue(ds, "Target latency [s]", input.jitter.targetLatency());
+          addValue(ds, "Arrival jitter [s]", input.jitter.jitter());
+          addValue(ds, "Received frames", input.jitter.received());
+          addValue(ds, "Underruns", input.jitter.underruns());
+          addValue(ds, "Overruns (dropped frames)", input.jitter.overruns());
+          addValue(ds, "Concealed frames", input.concealed);
+          addValue(ds, "Push errors", input.push_errors);
+          if (input.volume)
+            addValue(ds, "Gain", input.gain * input.duck);
+          da.status.push_back(ds);
+        }
+        lock.unlock();
+
+        da.header.stamp = ros::Time::now();
+        _diagnostic_pub.publish(da);
+      }
+
+      template <typename T>
+      static void addValue(diagnostic_msgs::DiagnosticStatus &ds, const std::string &key, T value)
+      {
+        diagnostic_msgs::KeyValue kv;
+        kv.key = key;
+        std::ostringstream ss;
+        ss << value;
+        kv.value = ss.str();
+        ds.values.push_back(kv);
+      }
+
+      static std::string getString(XmlRpc::XmlRpcValue &value, const std::string &key,
+                                   const std::string &default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeString)
+          return static_cast<std::string>(value[key]);
+        return default_value;
+      }
+
+      static int getInt(XmlRpc::XmlRpcValue &value, const std::string &key, int default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeInt)
+          return static_cast<int>(value[key]);
+        return default_value;
+      }
+
+      static double getDouble(XmlRpc::XmlRpcValue &value, const std::string &key, double default_value)
+      {
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeDouble)
+          return static_cast<double>(value[key]);
+        if (value.hasMember(key) && value[key].getType() == XmlRpc::XmlRpcValue::TypeInt)
+          return static_cast<int>(value[key]);
+        return default_value;
+      }
+
+      void onAudioInfo(Input *input, const audio_common_msgs::AudioInfoConstPtr &info)
+      {
+        boost::recursive_mutex::scoped_lock lock(_mutex);
+        // Take the stream format from the first info message
+        if (!input->configured)
+        {
+          input->format = info->coding_format;
+          input->channels = info->channels;
+          input->sample_rate = info->sample_rate;
+          input->sample_format = info->sample_format;
+          input->configured = true;
+          ROS_INFO("Configured from %s_info: %s, %d channels, %d Hz, %s", input->topic.c_str(),
+                   input->format.c_str(), input->channels, input->sample_rate, input->sample_format.c_str());
+          startWhenConfigured();
+          return;
+        }
+
+        // The pipeline caps are fixed once built; refuse to feed it a stream
+        // it would silently misinterpret. Compressed streams carry their own
+        // raw format, which decodebin picks up.
+        bool mismatch = info->coding_format != input->format;
+        if (input->format == "wave")
+        {
+          mismatch = mismatch ||
+                     info->channels != input->channels ||
+                     (int)info->sample_rate != input->sample_rate ||
+                     info->sample_format != input->sample_format;
+        }
+        if (mismatch && !input->info_mismatch)
+        {
+          ROS_ERROR("%s_info (%s, %d channels, %d Hz, %s) does not match the playback pipeline "
+                    "(%s, %d channels, %d Hz, %s); dropping audio until it matches again",
+                    input->topic.c_str(),
+                    info->coding_format.c_str(), info->channels, (int)info->sample_rate,
+                    info->sample_format.c_str(), input->format.c_str(), input->channels,
+                    input->sample_rate, input->sample_format.c_str());
+        }
+        else if (!mismatch && input->info_mismatch)
+        {
+          ROS_INFO("%s_info matches the playback pipeline again, resuming", input->topic.c_str());
+        }
+        input->info_mismatch = mismatch;
       }
 
      static void cb_newpad (GstElement *decodebin, GstPad *pad, 
                              gpointer data)
       {
-        RosGstPlay *client = reinterpret_cast<RosGstPlay*>(data);
+        Input *input = reinterpret_cast<Input*>(data);
 
         GstCaps *caps;
         GstStructure *str;
         GstPad *audiopad;
 
         /* only link once */
-        audiopad = gst_element_get_static_pad (client->_audio, "sink");
+        audiopad = gst_element_get_static_pad (input->audio, "sink");
         if (GST_PAD_IS_LINKED (audiopad)) 
         {
           g_object_unref (audiopad);
@@ -161,23 +811,53 @@ namespace audio_transport
         g_object_unref (audiopad);
       }
 
+      static const double duck_period;
+
       ros::NodeHandle _nh;
-      ros::Subscriber _sub;
+      std::vector<boost::shared_ptr<Input> > _inputs;
+      ros::Publisher _diagnostic_pub;
+      ros::Timer _diagnostic_timer, _duck_timer, _info_timer;
       boost::thread _gst_thread;
 
-      GstElement *_pipeline, *_source, *_sink, *_decoder, *_convert, *_audio, *_filter;
-      GstElement *_playbin;
+      // Pipeline settings, kept until the inputs are configured
+      std::string _dst_type, _device;
+      bool _do_timestamp, _mixing, _started, _failed, _shutdown_on_error;
+      int _max_queue_bytes, _mix_sample_rate, _mix_channels;
+      double _audio_info_timeout;
+
+      GstElement *_pipeline, *_sink, *_mixer;
+      GMainContext *_context;
       GMainLoop *_loop;
+
+      // recursive: appsrc emits enough-data from within push-buffer
+      boost::recursive_mutex _mutex;
+      double _max_conceal;
+      double _duck_gain, _duck_ramp, _duck_hold;
   };
+
+  const double RosGstPlay::duck_period = 0.02;
 }
 
 
-int main (int argc, char **argv)
+namespace audio_play
 {
-  ros::init(argc, argv, "audio_play");
-  gst_init(&argc, &argv);
-
-  audio_transport::RosGstPlay client;
+  class AudioPlayNodelet : public nodelet::Nodelet
+  {
+    public:
+      virtual void onInit()
+      {
+        gst_init(NULL, NULL);
+        _play.reset(new audio_transport::RosGstPlay(getNodeHandle(), getPrivateNodeHandle()));
+        if (!_play->ok())
+        {
+          NODELET_ERROR("Could not set up audio playback, see the errors above");
+          _play.reset();
+        }
+      }
 
-  ros::spin();
+    private:
+      boost::shared_ptr<audio_transport::RosGstPlay> _play;
+  };
 }
+
+PLUGINLIB_EXPORT_CLASS(audio_play::AudioPlayNodelet, nodelet::Nodelet)
@@ -0,0 +1,25 @@
+#include <ros/ros.h>
+#include <nodelet/loader.h>
+
+// Standalone audio_play: loads the nodelet into this process so the
+// node behaves exactly as when it runs inside a nodelet manager.
+int main (int argc, char **argv)
+{
+  ros::init(argc, argv, "audio_play");
+
+  // The process exists for this one player, so it ends when that fails
+  ros::NodeHandle pnh("~");
+  if (!pnh.hasParam("shutdown_on_error"))
+    pnh.setParam("shutdown_on_error", true);
+
+  nodelet::Loader nodelet(false);
+  nodelet::M_string remap(ros::names::getRemappings());
+  nodelet::V_string nargv(argv + 1, argv + argc);
+  if (!nodelet.load(ros::this_node::getName(), "audio_play/AudioPlayNodelet", remap, nargv))
+  {
+    ROS_ERROR("Failed to load the audio_play nodelet");
+    return 1;
+  }
+
+  ros::spin();
+}
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# Keeps the last ~pre_trigger seconds of the audio topic in memory and, when
+# triggered, writes them plus the following ~post_trigger seconds to a file.
+#
+# Trigger with the ~save service (std_srvs/Trigger, which returns the file
+# name) or by publishing std_msgs/Empty on ~trigger. Triggering again while
+# a recording is running extends it.
+
+import os
+import threading
+import time
+
+import rospy
+from std_msgs.msg import Empty
+from std_srvs.srv import Trigger, TriggerResponse
+
+from audio_stream.recorder import AsyncWriter, open_writer
+from audio_stream.stream import AudioStream
+
+EXTENSIONS = {'wav': '.wav', 'flac': '.flac', 'opus': '.opus'}
+
+
+class AudioRecorder(object):
+    def __init__(self):
+        self.pre_trigger = rospy.get_param('~pre_trigger', 30.0)
+        self.post_trigger = rospy.get_param('~post_trigger', 5.0)
+        self.directory = os.path.expanduser(rospy.get_param('~directory', '~/.ros/audio_recordings'))
+        self.prefix = rospy.get_param('~prefix', 'audio_')
+        self.encoding = rospy.get_param('~format', 'wav')
+        self.chunk_duration = rospy.get_param('~chunk_duration', 1.0)
+        if self.encoding not in EXTENSIONS:
+            rospy.logfatal('~format must be one of %s', ', '.join(sorted(EXTENSIONS)))
+            raise SystemExit(1)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self.lock = threading.Lock()
+        self.writer = None
+        self.path = None
+        # Ring position up to which frames have been handed to the writer,
+        # and the position at which the recording ends
+        self.position = 0
+        self.end = 0
+
+        self.stream = AudioStream('audio', callback=self.on_audio, buffer_duration=self.pre_trigger)
+        rospy.Service('~save', Trigger, self.on_save)
+        rospy.Subscriber('~trigger', Empty, lambda msg: self.trigger())
+
+    def trigger(self):
+        rate = self.stream.sample_rate
+        post = int(self.post_trigger * rate)
+        with self.lock:
+            if self.writer is not None:
+                # Already recording: keep going until post_trigger from now
+                self.end = self.stream.buffer.written + post
+                return self.path
+
+            frames, position = self.stream.buffer.snapshot(int(self.pre_trigger * rate))
+            name = self.prefix + time.strftime('%Y%m%d-%H%M%S') + EXTENSIONS[self.encoding]
+            self.path = os.path.join(self.directory, name)
+            self.writer = AsyncWriter(open_writer(self.path, self.encoding, rate,
+                                                  self.stream.channels, self.stream.dtype))
+            chunk = max(1, int(self.chunk_duration * rate))
+            for start in range(0, len(frames), chunk):
+                self.writer.write(frames[start:start + chunk])
+            self.position = position
+            self.end = position + post
+            rospy.loginfo('Recording %.1fs of audio before the trigger to %s',
+                          float(len(frames)) / rate, self.path)
+            if post == 0:
+                self.finish()
+            return self.path
+
+    def on_save(self, req):
+        try:
+            return TriggerResponse(success=True, message=self.trigger())
+        except Exception as e:
+            return TriggerResponse(success=False, message=str(e))
+
+    # Called on the subscriber thread, right after the frames were written
+    # to the ring, so the ring's write position is where they end.
+    def on_audio(self, frames):
+        with self.lock:
+            if self.writer is None:
+                return
+            end = self.stream.buffer.written
+            start = end - len(frames)
+            first = max(0, self.position - start)
+            last = min(len(frames), self.end - start)
+            if last > first:
+                self.writer.write(frames[first:last])
+            self.position = max(self.position, start + last)
+            if self.position >= self.end:
+                self.finish()
+
+    # Called with the lock held
+    def finish(self):
+        writer, path = self.writer, self.path
+        self.writer = None
+        writer.close()
+
+        def report():
+            writer.join()
+            if writer.error is not None:
+                rospy.logerr('Failed to write %s: %s', path, writer.error)
+            else:
+                rospy.loginfo('Saved %s', path)
+        threading.Thread(target=report).start()
+
+
+if __name__ == '__main__':
+    rospy.init_node('audio_recorder')
+    AudioRecorder()
+    rospy.spin()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Measures latency through an audio pipeline from marker sounds.
+#
+# The same markers (e.g. audio_capture's "ticks" test wave) are captured
+# twice: on ~reference, straight from the source, and on ~playback, after
+# going through the pipeline under test (e.g. audio_play into an ALSA
+# loopback captured by a second audio_capture). Both topics must be raw
+# wave streams with their _stamped and _info topics, so each onset can be
+# placed at the time it was captured. See launch/latency_probe.launch.
+#
+# Per stage, the percentiles over the last ~window markers are logged every
+# ~report_interval seconds, and appended to the CSV file ~output if set:
+#   capture   marker captured -> reference message received
+#   playback  reference message received -> marker heard at the output
+#   total     marker captured -> marker heard at the output
+
+import csv
+import os
+import threading
+
+import rospy
+from audio_common_msgs.msg import AudioDataStamped, AudioInfo
+
+from audio_stream.latency import LatencyStats, MarkerMatcher, OnsetDetector
+from audio_stream.pcm import sample_dtype, to_frames
+
+STAGES = ('capture', 'playback', 'total')
+
+
+class StampedInput(object):
+    def __init__(self, topic, callback, threshold_db, hold, info_timeout):
+        try:
+            info = rospy.wait_for_message(topic + '_info', AudioInfo, timeout=info_timeout)
+        except rospy.ROSException:
+            rospy.logfatal('No %s_info received within %.1fs', topic, info_timeout)
+            raise SystemExit(1)
+        if info.coding_format != 'wave':
+            rospy.logfatal('%s must be a wave stream, not %s', topic, info.coding_format)
+            raise SystemExit(1)
+        self.channels = info.channels
+        self.dtype = sample_dtype(info.sample_format)
+        self.detector = OnsetDetector(info.sample_rate, threshold_db, hold)
+        self._callback = callback
+        self._sub = rospy.Subscriber(topic + '_stamped', AudioDataStamped, self._on_audio, queue_size=100)
+
+    def _on_audio(self, msg):
+        arrival = rospy.get_time()
+        frames = to_frames(msg.audio.data, self.channels, self.dtype)
+        for onset in self.detector.process(frames, msg.header.stamp.to_sec()):
+            self._callback(onset, arrival)
+
+
+class LatencyProbe(object):
+    def __init__(self):
+        threshold_db = rospy.get_param('~threshold_db', -20.0)
+        hold = rospy.get_param('~hold', 0.5)
+        info_timeout = rospy.get_param('~info_timeout', 10.0)
+        self.label = rospy.get_param('~label', '')
+        self.output = os.path.expanduser(rospy.get_param('~output', ''))
+
+        self.lock = threading.Lock()
+        self.stats = LatencyStats(rospy.get_param('~window', 100))
+        self.matcher = MarkerMatcher(rospy.get_param('~max_latency', 0.9))
+        # Capture latency of the recent reference markers, by onset time
+        self.capture = {}
+        self.unmatched = 0
+
+        self.reference = StampedInput('reference', self.on_reference, threshold_db, hold, info_timeout)
+        self.playback = StampedInput('playback', self.on_playback, threshold_db, hold, info_timeout)
+        rospy.Timer(rospy.Duration(rospy.get_param('~report_interval', 10.0)), lambda event: self.report())
+
+    def on_reference(self, onset, arrival):
+        with self.lock:
+            self.matcher.add_reference(onset)
+            self.capture[onset] = arrival - onset
+            self.stats.add('capture', arrival - onset)
+            for t in [t for t in self.capture if t < onset - 10 * self.matcher.max_latency]:
+                del self.capture[t]
+
+    def on_playback(self, onset, arrival):
+        with self.lock:
+            reference = self.matcher.match(onset)
+            if reference is None:
+                self.unmatched += 1
+                return
+            total = onset - reference
+            self.stats.add('total', total)
+            self.stats.add('playback', total - self.capture[reference])
+
+    def report(self):
+        with self.lock:
+            summary = self.stats.summary()
+            unmatched = self.unmatched
+        if not summary:
+            rospy.logwarn('No markers detected yet')
+            return
+        for stage in STAGES:
+            if stage in summary:
+                count, p50, p90, p99, worst = summary[stage]
+                rospy.loginfo('%s%-8s n=%d p50=%.1fms p90=%.1fms p99=%.1fms max=%.1fms',
+                              self.label + ' ' if self.label else '', stage, count,
+                              p50 * 1000, p90 * 1000, p99 * 1000, worst * 1000)
+        if unmatched:
+            rospy.logwarn('%d markers at the output had no reference within ~max_latency', unmatched)
+        if self.output:
+            self.write_csv(summary)
+
+    def write_csv(self, summary):
+        new = not os.path.exists(self.output)
+        with open(self.output, 'a') as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(['time', 'label', 'stage', 'count', 'p50', 'p90', 'p99', 'max'])
+            now = rospy.get_time()
+            for stage in STAGES:
+                if stage in summary:
+                    writer.writerow(['%.3f' % now, self.label, stage] +
+                                    ['%.6f' % v if i else v for (i, v) in enumerate(summary[stage])])
+
+
+if __name__ == '__main__':
+    rospy.init_node('latency_probe')
+    LatencyProbe()
+    rospy.spin()
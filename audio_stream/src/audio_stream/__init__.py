@@ -0,0 +1,6 @@
+# NumPy access to audio_common_msgs/AudioData streams. The ROS subscription
+# lives in audio_stream.stream so the conversion and buffering helpers can
+# be used without a ROS environment.
+
+from audio_stream.pcm import Resampler, sample_dtype, to_float, to_frames
+from audio_stream.ring_buffer import RingBuffer
@@ -0,0 +1,71 @@
+## \brief Decoding of compressed AudioData streams (e.g. mp3) with GStreamer.
+##
+## GStreamer's Python bindings are optional; Decoder raises ImportError
+## when they are not installed.
+
+import numpy as np
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+
+## \brief Incrementally decodes a compressed stream to float32 frames.
+##
+## Compressed payloads are pushed with decode(), which returns whatever
+## audio the decoder has produced so far as a (frames, channels) array.
+## The output can be converted to a fixed rate and channel count.
+class Decoder(object):
+    def __init__(self, sample_rate=None, channels=None):
+        if Gst is None:
+            raise ImportError('Decoding compressed audio requires the GStreamer Python bindings (python-gi)')
+        Gst.init(None)
+
+        caps = 'audio/x-raw,format=F32LE,layout=interleaved'
+        if sample_rate:
+            caps += ',rate=%d' % sample_rate
+        if channels:
+            caps += ',channels=%d' % channels
+        self._pipeline = Gst.parse_launch(
+            'appsrc name=src ! decodebin ! audioconvert ! audioresample ! %s ! '
+            'appsink name=sink sync=false max-buffers=0' % caps)
+        self._src = self._pipeline.get_by_name('src')
+        self._sink = self._pipeline.get_by_name('sink')
+        self._pipeline.set_state(Gst.State.PLAYING)
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    ## \brief Feed compressed data and return the audio decoded so far.
+    def decode(self, data):
+        self._src.emit('push-buffer', Gst.Buffer.new_wrapped(bytes(data)))
+        return self._pull()
+
+    ## \brief Signal the end of the stream and return the remaining audio.
+    def flush(self):
+        self._src.emit('end-of-stream')
+        return self._pull(Gst.SECOND)
+
+    def close(self):
+        self._pipeline.set_state(Gst.State.NULL)
+
+    def _pull(self, timeout=0):
+        chunks = []
+        while True:
+            sample = self._sink.emit('try-pull-sample', timeout)
+            if sample is None:
+                break
+            structure = sample.get_caps().get_structure(0)
+            self.sample_rate = structure.get_value('rate')
+            self.channels = structure.get_value('channels')
+            buf = sample.get_buffer()
+            ok, info = buf.map(Gst.MapFlags.READ)
+            if ok:
+                chunks.append(np.frombuffer(info.data, dtype='<f4').copy())
+                buf.unmap(info)
+        channels = self.channels or 1
+        if not chunks:
+            return np.zeros((0, channels), dtype=np.float32)
+        return np.concatenate(chunks).reshape(-1, channels)
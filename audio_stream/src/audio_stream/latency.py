@@ -0,0 +1,82 @@
+## \brief Marker detection and statistics for audio latency measurements.
+
+import collections
+
+import numpy as np
+
+from audio_stream.pcm import to_float
+
+
+## \brief Finds the onsets of marker sounds (ticks, clicks, chirps) in a
+## stream.
+##
+## An onset is the first sample whose magnitude reaches threshold_db
+## (dBFS) on any channel, at least hold seconds after the previous
+## onset. Audio is fed in chunks with the time of their first sample.
+class OnsetDetector(object):
+    def __init__(self, sample_rate, threshold_db=-20.0, hold=0.5):
+        self.sample_rate = sample_rate
+        self.threshold = 10.0 ** (threshold_db / 20.0)
+        self.hold = hold
+        self._last = None
+
+    ## \brief Times of the onsets in frames, which start at start_time.
+    def process(self, frames, start_time):
+        level = np.abs(to_float(frames))
+        if level.ndim > 1:
+            level = level.max(axis=1)
+        times = start_time + np.flatnonzero(level >= self.threshold) / float(self.sample_rate)
+        onsets = []
+        i = 0
+        while i < len(times):
+            if self._last is not None and times[i] < self._last + self.hold:
+                # Skip the rest of this marker
+                i = np.searchsorted(times, self._last + self.hold)
+                continue
+            self._last = float(times[i])
+            onsets.append(self._last)
+            i += 1
+        return onsets
+
+
+## \brief Percentiles of latency samples per stage over a sliding window.
+class LatencyStats(object):
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, window=100):
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def add(self, stage, latency):
+        self._samples[stage].append(latency)
+
+    ## \brief {stage: (count, p50, p90, p99, max)} of the current window.
+    def summary(self):
+        result = {}
+        for (stage, samples) in self._samples.items():
+            if samples:
+                values = np.array(samples)
+                result[stage] = (len(values),) + tuple(np.percentile(values, self.PERCENTILES)) + (values.max(),)
+        return result
+
+
+## \brief Pairs marker onsets seen downstream with the reference onsets
+## they were produced from.
+##
+## A downstream onset is matched to the latest reference onset before it,
+## if it is at most max_latency older. max_latency must be below the
+## marker period for the pairing to be unambiguous.
+class MarkerMatcher(object):
+    def __init__(self, max_latency=1.0, keep=32):
+        self.max_latency = max_latency
+        self._references = collections.deque(maxlen=keep)
+
+    def add_reference(self, t):
+        self._references.append(t)
+
+    ## \brief The reference time for a downstream onset at t, or None.
+    def match(self, t):
+        best = None
+        for reference in self._references:
+            if reference <= t and t - reference <= self.max_latency:
+                best = reference if best is None else max(best, reference)
+        return best
@@ -0,0 +1,93 @@
+## \brief Conversion of audio_common_msgs/AudioData payloads to NumPy arrays.
+##
+## Raw payloads are viewed in place with np.frombuffer, so turning a
+## message into a (frames, channels) array costs no copy.
+
+import numpy as np
+
+## \brief NumPy dtypes of the raw sample formats used in AudioInfo.sample_format.
+SAMPLE_FORMATS = {
+    'S8': np.dtype('i1'),
+    'U8': np.dtype('u1'),
+    'S16LE': np.dtype('<i2'),
+    'S16BE': np.dtype('>i2'),
+    'U16LE': np.dtype('<u2'),
+    'U16BE': np.dtype('>u2'),
+    'S32LE': np.dtype('<i4'),
+    'S32BE': np.dtype('>i4'),
+    'F32LE': np.dtype('<f4'),
+    'F32BE': np.dtype('>f4'),
+    'F64LE': np.dtype('<f8'),
+    'F64BE': np.dtype('>f8'),
+}
+
+
+## \brief The NumPy dtype of a GStreamer raw sample format such as S16LE.
+def sample_dtype(sample_format):
+    try:
+        return SAMPLE_FORMATS[sample_format]
+    except KeyError:
+        raise ValueError('Unsupported sample format: %s' % sample_format)
+
+
+## \brief View raw interleaved audio as a (frames, channels) array.
+##
+## The array shares memory with data and is read-only. A trailing partial
+## frame is ignored.
+def to_frames(data, channels, dtype):
+    samples = np.frombuffer(data, dtype=dtype, count=len(data) // np.dtype(dtype).itemsize)
+    usable = len(samples) - len(samples) % channels
+    return samples[:usable].reshape(-1, channels)
+
+
+## \brief Scale samples to float32 in [-1, 1].
+def to_float(frames):
+    frames = np.asarray(frames)
+    kind = frames.dtype.kind
+    if kind == 'f':
+        return frames.astype(np.float32, copy=False)
+    bits = 8 * frames.dtype.itemsize
+    if kind == 'u':
+        offset = 2 ** (bits - 1)
+        return (frames.astype(np.float32) - offset) / offset
+    return frames.astype(np.float32) / (2 ** (bits - 1))
+
+
+## \brief Streaming linear-interpolation resampler.
+##
+## Keeps the last input frame and the output phase between calls, so
+## consecutive chunks resample as one continuous signal.
+class Resampler(object):
+    def __init__(self, rate, target_rate):
+        self.rate = rate
+        self.target_rate = target_rate
+        self._step = float(rate) / target_rate
+        self._held = None
+        self._pos = 0.0
+
+    ## \brief Resample a (frames, channels) chunk, returning float32 frames.
+    def process(self, frames):
+        x = np.asarray(frames, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[:, np.newaxis]
+        if self._held is not None:
+            x = np.concatenate((self._held, x))
+        if len(x) == 0:
+            return x
+
+        last = len(x) - 1
+        count = int(np.floor((last - self._pos) / self._step)) + 1 if last >= self._pos else 0
+        positions = self._pos + self._step * np.arange(count)
+        index = positions.astype(np.intp)
+        frac = (positions - index)[:, np.newaxis].astype(np.float32)
+        upper = np.minimum(index + 1, last)
+        out = x[index] * (1.0 - frac) + x[upper] * frac
+
+        # The last frame becomes index 0 of the next chunk
+        self._held = x[-1:]
+        self._pos += self._step * count - last
+        return out
+
+    def reset(self):
+        self._held = None
+        self._pos = 0.0
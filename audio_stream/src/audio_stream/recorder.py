@@ -0,0 +1,133 @@
+## \brief Audio file writers for the recorder, optionally run on a thread.
+
+import threading
+import wave
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import numpy as np
+
+from audio_stream.pcm import to_float
+
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
+
+
+## \brief Writes frames to a WAV file with the standard library.
+##
+## 16 and 32 bit integer audio is written as is; anything else (including
+## float audio) is written as 16 bit PCM.
+class WavWriter(object):
+    def __init__(self, path, sample_rate, channels, dtype):
+        dtype = np.dtype(dtype)
+        if dtype.kind == 'i' and dtype.itemsize in (2, 4):
+            self._dtype = np.dtype('<i%d' % dtype.itemsize)
+        else:
+            self._dtype = None
+        self._file = wave.open(path, 'wb')
+        self._file.setnchannels(channels)
+        self._file.setsampwidth(self._dtype.itemsize if self._dtype else 2)
+        self._file.setframerate(sample_rate)
+
+    def write(self, frames):
+        if self._dtype is not None:
+            data = np.asarray(frames).astype(self._dtype, copy=False)
+        else:
+            data = (np.clip(to_float(frames), -1.0, 1.0) * 32767).astype('<i2')
+        self._file.writeframes(data.tobytes())
+
+    def close(self):
+        self._file.close()
+
+
+## \brief Encodes frames to FLAC or Ogg/Opus with GStreamer.
+class GstWriter(object):
+    ENCODERS = {
+        'flac': 'flacenc',
+        'opus': 'opusenc ! oggmux',
+    }
+
+    def __init__(self, path, encoding, sample_rate, channels):
+        if Gst is None:
+            raise ImportError('Writing %s requires the GStreamer Python bindings (python-gi)' % encoding)
+        if encoding not in self.ENCODERS:
+            raise ValueError('Unsupported encoding: %s' % encoding)
+        Gst.init(None)
+        self._pipeline = Gst.parse_launch(
+            'appsrc name=src format=time '
+            'caps=audio/x-raw,format=F32LE,layout=interleaved,rate=%d,channels=%d ! '
+            'audioconvert ! audioresample ! %s ! filesink name=sink'
+            % (sample_rate, channels, self.ENCODERS[encoding]))
+        self._pipeline.get_by_name('sink').set_property('location', path)
+        self._src = self._pipeline.get_by_name('src')
+        self._sample_rate = sample_rate
+        self._position = 0
+        self._pipeline.set_state(Gst.State.PLAYING)
+
+    def write(self, frames):
+        data = np.ascontiguousarray(to_float(frames), dtype='<f4')
+        buf = Gst.Buffer.new_wrapped(data.tobytes())
+        buf.pts = self._position * Gst.SECOND // self._sample_rate
+        buf.duration = len(data) * Gst.SECOND // self._sample_rate
+        self._position += len(data)
+        self._src.emit('push-buffer', buf)
+
+    def close(self):
+        self._src.emit('end-of-stream')
+        self._pipeline.get_bus().timed_pop_filtered(
+            10 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        self._pipeline.set_state(Gst.State.NULL)
+
+
+## \brief Open a writer for wav, flac or opus files.
+def open_writer(path, encoding, sample_rate, channels, dtype):
+    if encoding == 'wav':
+        return WavWriter(path, sample_rate, channels, dtype)
+    return GstWriter(path, encoding, sample_rate, channels)
+
+
+## \brief Runs a writer on its own thread, fed through a bounded queue.
+##
+## write() only queues the frames, so callers such as subscriber
+## callbacks are not held up by disk or encoder latency. It blocks when
+## max_chunks are already pending, which bounds the memory used.
+class AsyncWriter(object):
+    def __init__(self, writer, max_chunks=64):
+        self._writer = writer
+        self._queue = Queue(max_chunks)
+        self.error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, frames):
+        self._queue.put(frames)
+
+    ## \brief Close the writer once all queued frames are written.
+    def close(self):
+        self._queue.put(None)
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            frames = self._queue.get()
+            if frames is None:
+                break
+            if self.error is None:
+                try:
+                    self._writer.write(frames)
+                except Exception as e:
+                    self.error = e
+        try:
+            self._writer.close()
+        except Exception as e:
+            self.error = self.error or e
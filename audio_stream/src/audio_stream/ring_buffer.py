@@ -0,0 +1,120 @@
+## \brief Preallocated ring buffer of audio frames.
+
+import threading
+
+import numpy as np
+
+
+## \brief Fixed-size ring of (frames, channels) audio.
+##
+## Writers append frames; once the buffer is full the oldest frames are
+## overwritten. Readers either peek at the most recent audio with
+## latest(), or consume it in order with read() and window(), which can
+## return overlapping windows by advancing less than the window size.
+## All methods are thread safe.
+class RingBuffer(object):
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self._data = np.zeros((capacity, channels), dtype=dtype)
+        self._lock = threading.Lock()
+        # Positions count frames since the buffer was created
+        self._written = 0
+        self._read = 0
+        self.overruns = 0
+
+    @property
+    def capacity(self):
+        return self._data.shape[0]
+
+    @property
+    def channels(self):
+        return self._data.shape[1]
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    ## \brief Total number of frames ever written.
+    @property
+    def written(self):
+        return self._written
+
+    ## \brief Append frames, dropping the oldest unread ones on overflow.
+    def write(self, frames):
+        frames = np.asarray(frames).reshape(-1, self.channels)
+        with self._lock:
+            n = len(frames)
+            if n > self.capacity:
+                frames = frames[-self.capacity:]
+            start = (self._written + n - len(frames)) % self.capacity
+            first = min(len(frames), self.capacity - start)
+            self._data[start:start + first] = frames[:first]
+            self._data[:len(frames) - first] = frames[first:]
+            self._written += n
+
+            if self._written - self._read > self.capacity:
+                self.overruns += self._written - self._read - self.capacity
+                self._read = self._written - self.capacity
+
+    ## \brief Number of frames not yet consumed by read() or window().
+    def available(self):
+        with self._lock:
+            return max(0, self._written - self._read)
+
+    ## \brief Copy of the most recent n frames (fewer if not yet written).
+    def latest(self, n):
+        return self.snapshot(n)[0]
+
+    ## \brief The most recent n frames and the write position they end at.
+    ##
+    ## The position can be compared with later values of written to tell
+    ## which frames arrived after the snapshot.
+    def snapshot(self, n):
+        with self._lock:
+            n = min(n, self._written, self.capacity)
+            return self._copy(self._written - n, n), self._written
+
+    ## \brief Consume the next n frames, or return None if not available.
+    def read(self, n):
+        return self.window(n, n)
+
+    ## \brief Return the next size frames and advance by hop.
+    ##
+    ## With hop < size consecutive windows overlap. Returns None until
+    ## size frames are available.
+    def window(self, size, hop=None):
+        if hop is None:
+            hop = size
+        if size > self.capacity:
+            raise ValueError('Window of %d frames exceeds the capacity of %d' % (size, self.capacity))
+        with self._lock:
+            if self._written - self._read < size:
+                return None
+            frames = self._copy(self._read, size)
+            self._read += hop
+            return frames
+
+    ## \brief Iterate over all complete windows currently available.
+    def windows(self, size, hop=None):
+        # Checked here rather than in the generator, so the error points at
+        # the call. Without advancing, the same window would repeat forever.
+        if hop is not None and hop <= 0:
+            raise ValueError('Hop of %d frames must be positive' % hop)
+        return self._windows(size, hop)
+
+    def _windows(self, size, hop):
+        while True:
+            frames = self.window(size, hop)
+            if frames is None:
+                return
+            yield frames
+
+    ## \brief Drop everything not yet consumed.
+    def clear(self):
+        with self._lock:
+            self._read = self._written
+
+    def _copy(self, position, n):
+        start = position % self.capacity
+        if start + n <= self.capacity:
+            return self._data[start:start + n].copy()
+        return np.concatenate((self._data[start:], self._data[:start + n - self.capacity]))
@@ -0,0 +1,89 @@
+## \brief Subscription to an AudioData topic delivering NumPy frames.
+
+import numpy as np
+import rospy
+
+from audio_common_msgs.msg import AudioData, AudioInfo
+from audio_stream.pcm import Resampler, sample_dtype, to_float, to_frames
+from audio_stream.ring_buffer import RingBuffer
+
+
+## \brief Turns an audio_common_msgs/AudioData topic into NumPy frames.
+##
+## The stream format is read from the latched <topic>_info published by
+## audio_capture, falling back to the keyword arguments when it does not
+## arrive within info_timeout. Raw frames are viewed in place as
+## (frames, channels) arrays of the sample dtype; compressed streams are
+## decoded to float32 with GStreamer. With resample_to set, frames are
+## converted to float32 at that rate.
+##
+## Every chunk is appended to a ring buffer holding buffer_duration
+## seconds (see RingBuffer) and passed to callback(frames), if given.
+class AudioStream(object):
+    def __init__(self, topic='audio', callback=None, buffer_duration=10.0,
+                 resample_to=None, info_timeout=5.0, coding_format='wave',
+                 channels=1, sample_rate=16000, sample_format='S16LE'):
+        self.topic = topic
+        self.coding_format = coding_format
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.sample_format = sample_format
+
+        info = None
+        if info_timeout > 0:
+            try:
+                info = rospy.wait_for_message(topic + '_info', AudioInfo, timeout=info_timeout)
+            except rospy.ROSException:
+                rospy.logwarn('No %s_info received within %.1fs, using the given format', topic, info_timeout)
+        if info is not None:
+            self.coding_format = info.coding_format
+            self.channels = info.channels
+            self.sample_rate = info.sample_rate
+            self.sample_format = info.sample_format
+
+        self._decoder = None
+        if self.coding_format == 'wave':
+            self.dtype = sample_dtype(self.sample_format)
+        else:
+            from audio_stream.decoder import Decoder
+            self._decoder = Decoder(sample_rate=resample_to, channels=self.channels)
+            self.dtype = np.dtype(np.float32)
+
+        self._resampler = None
+        if resample_to and resample_to != self.sample_rate and self._decoder is None:
+            self._resampler = Resampler(self.sample_rate, resample_to)
+            self.dtype = np.dtype(np.float32)
+        if resample_to:
+            self.sample_rate = resample_to
+
+        self.buffer = RingBuffer(int(buffer_duration * self.sample_rate), self.channels, self.dtype)
+        self._callback = callback
+        self._sub = rospy.Subscriber(topic, AudioData, self._on_audio, queue_size=100)
+
+    def _on_audio(self, msg):
+        if self._decoder is not None:
+            frames = self._decoder.decode(msg.data)
+        else:
+            frames = to_frames(msg.data, self.channels, self.dtype)
+            if self._resampler is not None:
+                frames = self._resampler.process(to_float(frames))
+        if len(frames) == 0:
+            return
+
+        self.buffer.write(frames)
+        if self._callback is not None:
+            self._callback(frames)
+
+    ## \brief Most recent duration seconds of audio.
+    def latest(self, duration):
+        return self.buffer.latest(int(duration * self.sample_rate))
+
+    ## \brief Next window of duration seconds, advancing by hop seconds.
+    def window(self, duration, hop=None):
+        size = int(duration * self.sample_rate)
+        return self.buffer.window(size, size if hop is None else int(hop * self.sample_rate))
+
+    def close(self):
+        self._sub.unregister()
+        if self._decoder is not None:
+            self._decoder.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+
+from audio_stream.latency import LatencyStats, MarkerMatcher, OnsetDetector
+
+
+class TestLatency(unittest.TestCase):
+    def test_onsets_across_chunks(self):
+        rate = 1000
+        signal = np.zeros((3000, 1), dtype='<i2')
+        for start in (100, 1250, 2400):
+            signal[start:start + 50] = 20000
+        detector = OnsetDetector(rate, threshold_db=-20.0, hold=0.5)
+        onsets = []
+        for offset in range(0, len(signal), 128):
+            onsets += detector.process(signal[offset:offset + 128], 10.0 + float(offset) / rate)
+        np.testing.assert_allclose(onsets, [10.1, 11.25, 12.4])
+
+    def test_quiet_audio_has_no_onsets(self):
+        detector = OnsetDetector(16000, threshold_db=-20.0)
+        self.assertEqual(detector.process(np.full((1600, 2), 0.05, dtype=np.float32), 0.0), [])
+
+    def test_matcher_pairs_latest_reference(self):
+        matcher = MarkerMatcher(max_latency=0.5)
+        matcher.add_reference(1.0)
+        matcher.add_reference(2.0)
+        self.assertEqual(matcher.match(2.2), 2.0)
+        self.assertIsNone(matcher.match(2.7))
+        self.assertIsNone(matcher.match(0.9))
+
+    def test_stats_window(self):
+        stats = LatencyStats(window=100)
+        for latency in range(200):
+            stats.add('total', latency / 1000.0)
+        count, p50, p90, p99, longest = stats.summary()['total']
+        self.assertEqual(count, 100)
+        self.assertAlmostEqual(p50, 0.1495)
+        self.assertAlmostEqual(longest, 0.199)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+
+from audio_stream.pcm import Resampler, sample_dtype, to_float, to_frames
+
+
+class TestPcm(unittest.TestCase):
+    def test_to_frames_shares_memory(self):
+        data = np.arange(8, dtype='<i2').tobytes()
+        frames = to_frames(data, 2, sample_dtype('S16LE'))
+        self.assertEqual(frames.shape, (4, 2))
+        self.assertEqual(frames[1, 1], 3)
+        self.assertFalse(frames.flags.owndata)
+
+    def test_to_frames_drops_partial_frame(self):
+        data = np.arange(7, dtype='<i2').tobytes() + b'\x00'
+        self.assertEqual(to_frames(data, 2, sample_dtype('S16LE')).shape, (3, 2))
+
+    def test_to_float(self):
+        np.testing.assert_allclose(to_float(np.array([-32768, 0, 16384], dtype='<i2')), [-1.0, 0.0, 0.5])
+        np.testing.assert_allclose(to_float(np.array([0, 128], dtype='u1')), [-1.0, 0.0])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, sample_dtype, 'S24LE')
+
+    def test_resampler_is_continuous_across_chunks(self):
+        signal = np.sin(np.arange(1600) * 0.05).astype(np.float32)[:, np.newaxis]
+        whole = Resampler(16000, 48000).process(signal)
+
+        resampler = Resampler(16000, 48000)
+        chunks = [resampler.process(signal[i:i + 160]) for i in range(0, 1600, 160)]
+        np.testing.assert_allclose(np.concatenate(chunks), whole, atol=1e-5)
+        self.assertEqual(len(whole), 3 * 1600 - 2)
+
+    def test_downsample(self):
+        signal = np.arange(100, dtype=np.float32)[:, np.newaxis]
+        out = Resampler(48000, 16000).process(signal)
+        np.testing.assert_allclose(out[:, 0], np.arange(0, 100, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from audio_stream.recorder import AsyncWriter, WavWriter
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_async_wav_roundtrip(self):
+        path = os.path.join(self.directory, 'test.wav')
+        frames = np.arange(-1000, 1000, dtype='<i2').reshape(-1, 2)
+        writer = AsyncWriter(WavWriter(path, 16000, 2, frames.dtype), max_chunks=2)
+        for start in range(0, len(frames), 100):
+            writer.write(frames[start:start + 100])
+        writer.close()
+        writer.join()
+        self.assertIsNone(writer.error)
+
+        f = wave.open(path, 'rb')
+        self.assertEqual((f.getnchannels(), f.getsampwidth(), f.getframerate()), (2, 2, 16000))
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2').reshape(-1, 2)
+        f.close()
+        np.testing.assert_array_equal(data, frames)
+
+    def test_float_audio_is_written_as_16_bit(self):
+        path = os.path.join(self.directory, 'float.wav')
+        writer = WavWriter(path, 8000, 1, np.float32)
+        writer.write(np.array([[0.5], [-1.0], [2.0]], dtype=np.float32))
+        writer.close()
+
+        f = wave.open(path, 'rb')
+        self.assertEqual(f.getsampwidth(), 2)
+        data = np.frombuffer(f.readframes(3), dtype='<i2')
+        f.close()
+        self.assertEqual(data.tolist(), [16383, -32767, 32767])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import unittest
+
+import numpy as np
+
+from audio_stream.ring_buffer import RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wraparound(self):
+        ring = RingBuffer(5, channels=2, dtype=np.int16)
+        ring.write(np.arange(8).reshape(4, 2))
+        ring.write(np.arange(8, 14).reshape(3, 2))
+        np.testing.assert_array_equal(ring.latest(5)[:, 0], [4, 6, 8, 10, 12])
+        self.assertEqual(ring.overruns, 2)
+        self.assertEqual(ring.available(), 5)
+
+    def test_overlapping_windows(self):
+        ring = RingBuffer(16)
+        ring.write(np.arange(10))
+        windows = [w[:, 0].tolist() for w in ring.windows(4, 2)]
+        self.assertEqual(windows, [[0, 1, 2, 3], [2, 3, 4, 5], [4, 5, 6, 7], [6, 7, 8, 9]])
+        self.assertIsNone(ring.window(4, 2))
+        ring.write([10, 11])
+        self.assertEqual(ring.window(4, 2)[:, 0].tolist(), [8, 9, 10, 11])
+
+    def test_windows_need_a_positive_hop(self):
+        ring = RingBuffer(16)
+        ring.write(np.arange(10))
+        self.assertRaises(ValueError, ring.windows, 4, 0)
+        self.assertRaises(ValueError, ring.windows, 4, -2)
+        self.assertEqual(ring.available(), 10)
+
+    def test_oversized_write_keeps_the_newest_frames(self):
+        ring = RingBuffer(4)
+        ring.write(np.arange(10))
+        self.assertEqual(ring.read(4)[:, 0].tolist(), [6, 7, 8, 9])
+        self.assertIsNone(ring.read(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,7 @@
 #include <ros/ros.h>
 #include <ros/node_handle.h>
 #include <sound_play/SoundRequest.h>
+#include <sound_play/SoundRequestBatch.h>
 #include <boost/thread.hpp>
 
 namespace sound_play
@@ -69,6 +70,7 @@ public:
     float vol_;
     std::string arg_;
     std::string arg2_;
+    std::string zone_;
     SoundClient *client_;
 
     Sound(SoundClient *sc, int snd, const std::string &arg, const std::string arg2 = std::string(), const float vol = 1.0f)
@@ -78,26 +80,33 @@ public:
       arg_ = arg;
       arg2_ = arg2;
       vol_ = vol;
+      zone_ = sc->getZone();
     }
 
   public:
     /** \brief Play the Sound.
      *
      * This method causes the Sound to be played once.
+     *
+     * \param start ROS time at which to start playing; ros::Time() plays
+     * right away.
      */
-    void play()
+    void play(const ros::Time &start = ros::Time())
     {
-      client_->sendMsg(snd_, SoundRequest::PLAY_ONCE, arg_, arg2_, vol_);
+      client_->sendMsg(snd_, SoundRequest::PLAY_ONCE, arg_, arg2_, vol_, zone_, start);
     }
 
     /** \brief Play the Sound repeatedly.
      *
      * This method causes the Sound to be played repeatedly until stop() is
      * called.
+     *
+     * \param start ROS time at which to start playing; ros::Time() plays
+     * right away.
      */
-    void repeat()
+    void repeat(const ros::Time &start = ros::Time())
     {
-      client_->sendMsg(snd_, SoundRequest::PLAY_START, arg_, arg2_, vol_);
+      client_->sendMsg(snd_, SoundRequest::PLAY_START, arg_, arg2_, vol_, zone_, start);
     }
 
     /** \brief Stop Sound playback.
@@ -106,7 +115,7 @@ public:
      */
     void stop()
     {
-      client_->sendMsg(snd_, SoundRequest::PLAY_STOP, arg_, arg2_, vol_);
+      client_->sendMsg(snd_, SoundRequest::PLAY_STOP, arg_, arg2_, vol_, zone_);
     }
   };
 
@@ -191,10 +200,13 @@ public:
    *
    * \param s String to say
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void say(const std::string &s, const std::string &voice="voice_kal_diphone", float volume = 1.0f)
+  void say(const std::string &s, const std::string &voice="voice_kal_diphone", float volume = 1.0f,
+           const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::SAY, SoundRequest::PLAY_ONCE, s, voice, volume);
+    sendMsg(SoundRequest::SAY, SoundRequest::PLAY_ONCE, s, voice, volume, start);
   }
 
   /** \brief Say a string repeatedly
@@ -203,10 +215,12 @@ public:
    *
    * \param s String to say repeatedly
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void repeat(const std::string &s, float volume = 1.0f)
+  void repeat(const std::string &s, float volume = 1.0f, const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::SAY, SoundRequest::PLAY_START, s, "", volume);
+    sendMsg(SoundRequest::SAY, SoundRequest::PLAY_START, s, "", volume, start);
   }
 
   /** \brief Stop saying a string
@@ -229,10 +243,12 @@ public:
    * \param s Filename of the WAV or OGG file. Must be an absolute path valid
    * on the computer on which the sound_play node is running
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void playWave(const std::string &s, float volume = 1.0f)
+  void playWave(const std::string &s, float volume = 1.0f, const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_ONCE, s, "", volume);
+    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_ONCE, s, "", volume, start);
   }
 
   /** \brief Plays a WAV or OGG file repeatedly
@@ -242,10 +258,12 @@ public:
    * \param s Filename of the WAV or OGG file. Must be an absolute path valid
    * on the computer on which the sound_play node is running.
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void startWave(const std::string &s, float volume = 1.0f)
+  void startWave(const std::string &s, float volume = 1.0f, const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_START, s, "", volume);
+    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_START, s, "", volume, start);
   }
 
   /** \brief Stop playing a WAV or OGG file
@@ -269,10 +287,13 @@ public:
    * \param s Filename of the WAV or OGG file. Must be an path relative to the package valid
    * on the computer on which the sound_play node is running
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void playWaveFromPkg(const std::string &p, const std::string &s, float volume = 1.0f)
+  void playWaveFromPkg(const std::string &p, const std::string &s, float volume = 1.0f,
+                       const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_ONCE, s, p, volume);
+    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_ONCE, s, p, volume, start);
   }
 
   /** \brief Plays a WAV or OGG file repeatedly
@@ -283,10 +304,13 @@ public:
    * \param s Filename of the WAV or OGG file. Must be an path relative to the package valid
    * on the computer on which the sound_play node is running
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void startWaveFromPkg(const std::string &p, const std::string &s, float volume = 1.0f)
+  void startWaveFromPkg(const std::string &p, const std::string &s, float volume = 1.0f,
+                        const ros::Time &start = ros::Time())
   {
-    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_START, s, p, volume);
+    sendMsg(SoundRequest::PLAY_FILE, SoundRequest::PLAY_START, s, p, volume, start);
   }
 
   /** \brief Stop playing a WAV or OGG file
@@ -310,10 +334,12 @@ public:
    *
    * \param sound Identifier of the sound to play.
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void play(int sound, float volume = 1.0f)
+  void play(int sound, float volume = 1.0f, const ros::Time &start = ros::Time())
   {
-    sendMsg(sound, SoundRequest::PLAY_ONCE, "", "", volume);
+    sendMsg(sound, SoundRequest::PLAY_ONCE, "", "", volume, start);
   }
 
   /** \brief Play a buildin sound repeatedly
@@ -323,10 +349,12 @@ public:
    *
    * \param sound Identifier of the sound to play.
    * \param volume Volume at which to play the sound. 0 is mute, 1.0 is 100%.
+   * \param start ROS time at which the sound_play node starts playing, for
+   * sounds in sync across zones or robots. ros::Time() plays right away.
    */
-  void start(int sound, float volume = 1.0f)
+  void start(int sound, float volume = 1.0f, const ros::Time &start = ros::Time())
   {
-    sendMsg(sound, SoundRequest::PLAY_START, "", "", volume); 
+    sendMsg(sound, SoundRequest::PLAY_START, "", "", volume, start);
   }
 
   /** \brief Stop playing a built-in sound
@@ -362,15 +390,73 @@ public:
     quiet_ = state;
   }
 
+  /** \brief Selects the output zone to play in.
+   *
+   * Zones are configured with the ~zones parameter of the sound_play
+   * node. Subsequent requests, and Sounds created afterwards, play in
+   * this zone. The empty zone is the node's default device.
+   *
+   * \param zone Name of the zone.
+   */
+  void setZone(const std::string &zone)
+  {
+    boost::mutex::scoped_lock lock(mutex_);
+    zone_ = zone;
+  }
+
+  std::string getZone()
+  {
+    boost::mutex::scoped_lock lock(mutex_);
+    return zone_;
+  }
+
+  /** \brief Starts collecting requests into a batch.
+   *
+   * Until endBatch() is called, requests are not published but added to a
+   * batch, which the sound_play node applies in order, without other
+   * requests in between.
+   */
+  void beginBatch()
+  {
+    boost::mutex::scoped_lock lock(mutex_);
+    batching_ = true;
+  }
+
+  /** \brief Publishes the requests collected since beginBatch() in one
+   * message.
+   */
+  void endBatch()
+  {
+    boost::mutex::scoped_lock lock(mutex_);
+    batching_ = false;
+    if (batch_.requests.empty() || !nh_.ok())
+      return;
+
+    batch_pub_.publish(batch_);
+    batch_.requests.clear();
+
+    if (batch_pub_.getNumSubscribers() == 0 && !quiet_)
+      ROS_WARN("Sound command issued, but no node is subscribed to the topic. Perhaps you forgot to run soundplay_node.py");
+  }
+
 private:
   void init(ros::NodeHandle nh, const std::string &topic)
   {
     nh_ = nh;
     pub_ = nh.advertise<sound_play::SoundRequest>(topic, 5);
+    batch_pub_ = nh.advertise<sound_play::SoundRequestBatch>(topic + "_batch", 5);
     quiet_ = false;
+    batching_ = false;
+  }
+
+  void sendMsg(int snd, int cmd, const std::string &s = "", const std::string &arg2 = "", const float &vol = 1.0f,
+               const ros::Time &start = ros::Time())
+  {
+    sendMsg(snd, cmd, s, arg2, vol, getZone(), start);
   }
 
-  void sendMsg(int snd, int cmd, const std::string &s = "", const std::string &arg2 = "", const float &vol = 1.0f)
+  void sendMsg(int snd, int cmd, const std::string &s, const std::string &arg2, const float &vol, const std::string &zone,
+               const ros::Time &start = ros::Time())
   {
     boost::mutex::scoped_lock lock(mutex_);
 
@@ -382,6 +468,8 @@ private:
     msg.command = cmd;
     msg.arg = s;
     msg.arg2 = arg2;
+    msg.zone = zone;
+    msg.start = start;
 
     // ensure volume is in the correct range
     if (vol < 0)
@@ -391,6 +479,12 @@ private:
     else
       msg.volume = vol;
 
+    if (batching_)
+    {
+      batch_.requests.push_back(msg);
+      return;
+    }
+
     pub_.publish(msg);
 
     if (pub_.getNumSubscribers() == 0 && !quiet_)
@@ -398,8 +492,12 @@ private:
   }
 
   bool quiet_;
+  bool batching_;
+  std::string zone_;
+  SoundRequestBatch batch_;
   ros::NodeHandle nh_;
   ros::Publisher pub_;
+  ros::Publisher batch_pub_;
   boost::mutex mutex_;
 };
 
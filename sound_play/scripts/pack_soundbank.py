@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+#***********************************************************
+#* Software License Agreement (BSD License)
+#*
+#*  Copyright (c) 2009, Willow Garage, Inc.
+#*  All rights reserved.
+#*
+#*  Redistribution and use in source and binary forms, with or without
+#*  modification, are permitted provided that the following conditions
+#*  are met:
+#*
+#*   * Redistributions of source code must retain the above copyright
+#*     notice, this list of conditions and the following disclaimer.
+#*   * Redistributions in binary form must reproduce the above
+#*     copyright notice, this list of conditions and the following
+#*     disclaimer in the documentation and/or other materials provided
+#*     with the distribution.
+#*   * Neither the name of the Willow Garage nor the names of its
+#*     contributors may be used to endorse or promote products derived
+#*     from this software without specific prior written permission.
+#*
+#*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#*  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#*  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#*  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#*  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#*  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#*  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#*  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#*  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#*  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#*  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+
+import os
+import sys
+
+
+# Decodes a sound file to 16 bit PCM, returning (pcm, rate, channels)
+def decode(Gst, path):
+    pipeline = Gst.parse_launch(
+        'filesrc name=src ! decodebin ! audioconvert ! audioresample ! '
+        'audio/x-raw,format=S16LE,layout=interleaved ! appsink name=sink sync=false')
+    pipeline.get_by_name('src').set_property('location', path)
+    sink = pipeline.get_by_name('sink')
+    pipeline.set_state(Gst.State.PLAYING)
+    chunks = []
+    rate = channels = None
+    try:
+        while True:
+            sample = sink.emit('try-pull-sample', Gst.SECOND)
+            if sample is None:
+                message = pipeline.get_bus().pop_filtered(Gst.MessageType.ERROR)
+                if message is not None:
+                    raise RuntimeError(message.parse_error()[0].message)
+                if sink.get_property('eos'):
+                    break
+                continue
+            structure = sample.get_caps().get_structure(0)
+            rate = structure.get_value('rate')
+            channels = structure.get_value('channels')
+            buf = sample.get_buffer()
+            chunks.append(buf.extract_dup(0, buf.get_size()))
+        if rate is None:
+            raise RuntimeError('no audio decoded')
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+    return b''.join(chunks), rate, channels
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] == '--help':
+        print('Usage: %s bank_file [name=]sound_file...' % sys.argv[0])
+        print()
+        print('Decodes sound files (.ogg, .wav or anything GStreamer reads) and packs them into a sound bank that sound_play maps into memory. Sounds are named after their file, without the extension, unless given as name=file. List the bank in the sound_banks parameter of soundplay_node.py and play sounds from it as "soundbank:name".')
+        exit(1)
+
+    # Import after printing usage for speed.
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+    from sound_play.soundbank import write_bank
+
+    Gst.init(None)
+    sounds = []
+    names = set()
+    for arg in sys.argv[2:]:
+        name, sep, path = arg.partition('=')
+        if not sep:
+            path = arg
+            name = os.path.splitext(os.path.basename(arg))[0]
+        if name in names:
+            print('Duplicate sound name "%s"' % name)
+            exit(1)
+        names.add(name)
+        try:
+            pcm, rate, channels = decode(Gst, path)
+        except Exception as e:
+            print('Could not decode %s: %s' % (path, e))
+            exit(1)
+        print('%s: %.2fs, %d Hz, %d channels' % (name, float(len(pcm)) / (2 * channels * rate), rate, channels))
+        sounds.append((name, pcm, rate, channels, 2))
+
+    write_bank(sys.argv[1], sounds)
+    print('Wrote %d sounds to %s' % (len(sounds), sys.argv[1]))
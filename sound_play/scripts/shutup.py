@@ -36,24 +36,40 @@
 
 # Author: Blaise Gassend
 
+import signal
+import sys
+import time
+
 import rospy
-from sound_play.msg import SoundRequest
 from sound_play.libsoundplay import SoundClient
 
+# The node releases itself this long after the last renewal, in case this
+# node is killed without getting to release it
+LEASE = 5.0
+
 if __name__ == '__main__':
-    rospy.init_node('shutup', anonymous=True)
+    # Handle Ctrl+C and SIGTERM here, so that the node can be released
+    # before exiting
+    rospy.init_node('shutup', anonymous=True, disable_signals=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     soundhandle = SoundClient()
-    rospy.sleep(0.5)  # let ROS get started...
+    rospy.loginfo("Waiting for the sound_play node...")
+    soundhandle.inhibit(lease=LEASE)
 
-    rospy.loginfo("Sending stopAll commande every 100 ms.")
-    rospy.loginfo("Note: This will not prevent a node that is continuing to issue commands")
-    rospy.loginfo("from producing sound.")
+    rospy.loginfo("The sound_play node is inhibited: it stopped all sounds and drops")
+    rospy.loginfo("new requests until this node exits.")
     rospy.loginfo("Press Ctrl+C to exit.")
 
-    while not rospy.is_shutdown():
-        soundhandle.stopAll()
-        try:
-            rospy.sleep(.1)
-        except:
-            pass
+    try:
+        while not rospy.is_shutdown():
+            time.sleep(1)
+            try:
+                soundhandle.inhibit(timeout=1.0, lease=LEASE)
+            except (rospy.ROSException, rospy.ServiceException) as e:
+                rospy.logwarn('Could not renew the inhibit: %s'%str(e))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        soundhandle.release(timeout=1.0)
+        rospy.signal_shutdown('released')
@@ -44,10 +44,16 @@ import logging
 import sys
 import traceback
 import tempfile
+import time
+import collections
 from diagnostic_msgs.msg import DiagnosticStatus, KeyValue, DiagnosticArray
-from sound_play.msg import SoundRequest, SoundRequestAction, SoundRequestResult, SoundRequestFeedback
+from sound_play.msg import SoundRequest, SoundRequestAction, SoundRequestResult, SoundRequestFeedback, SoundRequestBatch, InhibitState
+from sound_play.msg import SoundPlayStatus, SoundStatus
+from sound_play.srv import Profile, ProfileRequest, ProfileResponse
+from sound_play.srv import SetInhibit, SetInhibitRequest, SetInhibitResponse
+from sound_play import profiling, soundbank, synthesizers, templates
 
-from multiprocessing import Queue, Value
+from multiprocessing import Value
 from ctypes import c_bool
 
 try:
@@ -78,9 +84,9 @@ class soundtype:
     LOOPING = 1
     COUNTING = 2
 
-    _sound_say_started = Value(c_bool, False)
-
     def __init__(self, file, device, volume = 1.0):
+        # Per sound, now that phrases in different zones play concurrently
+        self._sound_say_started = Value(c_bool, False)
         self.lock = threading.RLock()
         self.state = self.STOPPED
         self.sound = Gst.ElementFactory.make("playbin",None)
@@ -101,10 +107,26 @@ class soundtype:
 
         self.uri = uri
         self.volume = volume
+        self.duck = 1.0
         self.sound.set_property('uri', uri)
         self.sound.set_property("volume",volume)
         self.staleness = 1
         self.file = file
+        # Pinned sounds are never purged from the cache; prerolled ones are
+        # kept paused at the start instead of being shut down when stopped.
+        self.pinned = False
+        self.prerolled = False
+        # When and at which priority the sound was last started, to choose
+        # which sound to stop when all channels are in use
+        self.started = 0
+        self.priority = 0
+        # Whether the pipeline was last started at a given time, with its
+        # own clock and base time (see schedule), and the base time to start
+        # playing at once the pipeline has prerolled
+        self.scheduled = False
+        self.pending_base_time = None
+        # The request that last started the sound
+        self.request = None
 
         self.bus = self.sound.get_bus()
         self.bus.add_signal_watch()
@@ -113,9 +135,20 @@ class soundtype:
     def on_stream_end(self, bus, message):
         if message.type == Gst.MessageType.EOS:
             if (self.state == self.LOOPING):
+                self.unschedule()
                 self.sound.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
             else:
                 self.stop()
+                status_changed.set()
+        elif message.type in (Gst.MessageType.ASYNC_DONE, Gst.MessageType.DURATION_CHANGED):
+            if message.type == Gst.MessageType.ASYNC_DONE:
+                self.lock.acquire()
+                try:
+                    self.start_scheduled()
+                finally:
+                    self.lock.release()
+            # The duration is known once the sound has prerolled
+            status_changed.set()
 
     def __del__(self):
         # stop our GST object so that it gets garbage-collected
@@ -133,6 +166,7 @@ class soundtype:
                 self.stop()
 
             if self.state == self.STOPPED:
+              self.unschedule()
               self.sound.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
               self.sound.set_state(Gst.State.PLAYING)
             self.state = self.LOOPING
@@ -159,11 +193,42 @@ class soundtype:
         if self.state != self.STOPPED:
             self.lock.acquire()
             try:
-                self.sound.set_state(Gst.State.NULL)
+                self.pending_base_time = None
+                if self.prerolled:
+                    self.sound.set_state(Gst.State.PAUSED)
+                    self.sound.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
+                else:
+                    self.sound.set_state(Gst.State.NULL)
                 self.state = self.STOPPED
             finally:
                 self.lock.release()
 
+    ## Decode the start of the sound now, so that playing it later starts
+    ## without delay. This keeps the output device open.
+    def preroll(self):
+        self.lock.acquire()
+        try:
+            self.prerolled = True
+            if self.state == self.STOPPED:
+                self.sound.set_state(Gst.State.PAUSED)
+        finally:
+            self.lock.release()
+
+    def set_volume(self, volume):
+        if self.volume != volume:
+            self.volume = volume
+            self.sound.set_property('volume', volume * self.duck)
+
+    ## Attenuate the sound by gain, on top of its requested volume
+    def set_duck(self, gain):
+        self.lock.acquire()
+        try:
+            if self.sound is not None and self.duck != gain:
+                self.duck = gain
+                self.sound.set_property('volume', self.volume * gain)
+        finally:
+            self.lock.release()
+
     def single(self):
         self.lock.acquire()
         try:
@@ -173,12 +238,84 @@ class soundtype:
             if self.state == self.LOOPING:
                 self.stop()
 
+            self.unschedule()
             self.sound.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH, 0)
             self.sound.set_state(Gst.State.PLAYING)
             self.state = self.COUNTING
         finally:
             self.lock.release()
 
+    ## Preroll the sound and start it when clock reaches base_time. Once
+    ## prerolled, the pipeline is set to PLAYING with that base time, so its
+    ## sink renders the first sample at exactly base_time. Prerolling
+    ## finishes on the GStreamer thread (see on_stream_end), so callers
+    ## holding the node's mutex don't wait for it.
+    def schedule(self, cmd, base_time, clock):
+        self.lock.acquire()
+        try:
+            rospy.logdebug("Scheduling %s"%self.uri)
+            self.staleness = 0
+            self._sound_say_started.value = False
+            self.sound.set_state(Gst.State.NULL)
+            self.sound.use_clock(clock)
+            # Keep the base time set below instead of computing a new one
+            self.sound.set_start_time(Gst.CLOCK_TIME_NONE)
+            self.scheduled = True
+            self.state = self.LOOPING if cmd == SoundRequest.PLAY_START else self.COUNTING
+            self.pending_base_time = base_time
+            result = self.sound.set_state(Gst.State.PAUSED)
+            if result == Gst.StateChangeReturn.FAILURE:
+                rospy.logerr('Could not preroll %s'%self.uri)
+                self.pending_base_time = None
+                self.state = self.STOPPED
+            elif result != Gst.StateChangeReturn.ASYNC:
+                self.start_scheduled()
+        finally:
+            self.lock.release()
+
+    # Start a scheduled sound once it has prerolled. Called with the lock
+    # held.
+    def start_scheduled(self):
+        if self.pending_base_time is None:
+            return
+        self.sound.set_base_time(self.pending_base_time)
+        self.pending_base_time = None
+        self.sound.set_state(Gst.State.PLAYING)
+
+    # Go back to the pipeline choosing its clock and base time
+    def unschedule(self):
+        self.pending_base_time = None
+        if self.scheduled:
+            self.sound.use_clock(None)
+            self.sound.set_start_time(0)
+            self.scheduled = False
+
+    ## How late the sound started, in seconds: the clock time elapsed since
+    ## base_time minus the position the pipeline has reached.
+    def onset_error(self, base_time):
+        self.lock.acquire()
+        try:
+            if not self.scheduled:
+                return None
+            (ok, position) = self.sound.query_position(Gst.Format.TIME)
+            if not ok:
+                return None
+            return (self.sound.get_clock().get_time() - base_time - position) / 1e9
+        finally:
+            self.lock.release()
+
+    ## Position and duration in seconds, 0 where not known
+    def progress(self):
+        self.lock.acquire()
+        try:
+            if self.sound is None:
+                return (0, 0)
+            (ok, position) = self.sound.query_position(Gst.Format.TIME)
+            (known, duration) = self.sound.query_duration(Gst.Format.TIME)
+            return (position / 1e9 if ok else 0, duration / 1e9 if known else 0)
+        finally:
+            self.lock.release()
+
     def command(self, cmd):
          if cmd == SoundRequest.PLAY_STOP:
              self.stop()
@@ -219,188 +356,645 @@ class soundtype:
     def get_playing(self):
         return self.state == self.COUNTING
 
+## A sound from a memory-mapped sound bank. playbin reads the entry's wave
+## data from the mapping through an appsrc, chunk by chunk, so nothing is
+## opened or decoded when the sound is created.
+class banksoundtype(soundtype):
+    def __init__(self, bank, name, device, volume = 1.0):
+        self.feed = soundbank.SourceFeed(bank.wave(name), Gst.Buffer.new_wrapped)
+        soundtype.__init__(self, "appsrc://", device, volume)
+        self.file = BANK_PREFIX + name
+        self.uri = self.file
+        self.source_conn_id = self.sound.connect("source-setup", self.on_source_setup)
+
+    def on_source_setup(self, playbin, source):
+        self.feed.setup(source)
+
+    def dispose(self):
+        self.lock.acquire()
+        try:
+            if self.sound is not None:
+                self.sound.disconnect(self.source_conn_id)
+        finally:
+            self.lock.release()
+        soundtype.dispose(self)
+
+## Phrases waiting to be said in one zone, by priority. Each zone says one
+## phrase at a time, but zones don't wait for each other.
+class speechqueue:
+    def __init__(self):
+        self.queues = [collections.deque(), collections.deque(), collections.deque()]
+        self.busy = False
+        self.last_sound = None
+
+    def put(self, data):
+        self.queues[data.priority].append(data)
+
+    def get(self):
+        for priority in (SoundRequest.PRIORITY_THREE, SoundRequest.PRIORITY_TWO, SoundRequest.PRIORITY_ONE):
+            if self.queues[priority]:
+                return self.queues[priority].popleft()
+        return None
+
+    ## Queued requests, in the order they will be said
+    def pending(self):
+        return [data for priority in (SoundRequest.PRIORITY_THREE, SoundRequest.PRIORITY_TWO, SoundRequest.PRIORITY_ONE)
+                for data in list(self.queues[priority])]
+
+BANK_PREFIX = "soundbank:"
+
+# Always-on timing of the node's main entry points, see ~slow_call_threshold
+call_timer = profiling.CallTimer()
+
+# Set wherever what the node plays or queues changes, see publish_status
+status_changed = threading.Event()
+
 class soundplay:
     _feedback = SoundRequestFeedback()
     _result   = SoundRequestResult()
 
-    _queues_to_say = [Queue(), Queue(), Queue()]
-    _queues_to_say_busy = Value(c_bool, False)
-
-    _last_sound_say = None
-    _sound_say_busy = Value(c_bool, False)
+    # Sound caches are keyed by (zone, sound), so the same sound can play in
+    # several zones at once. Synthesized speech is shared between zones.
+    def stopdict(self,dict, zone=None):
+        for (key, sound) in dict.items():
+            if zone is None or key[0] == zone:
+                sound.stop()
 
-    def stopdict(self,dict):
-        for sound in dict.values():
-            sound.stop()
+    def stopall(self, zone=None):
+        self.stopdict(self.builtinsounds, zone)
+        self.stopdict(self.filesounds, zone)
+        self.stopdict(self.voicesounds, zone)
 
-    def stopall(self):
-        self.stopdict(self.builtinsounds)
-        self.stopdict(self.filesounds)
-        self.stopdict(self.voicesounds)
+    ## Output device of a zone, or None if the zone is unknown. The empty
+    ## zone is ~device.
+    def zone_device(self, zone):
+        if not zone:
+            return self.device
+        if zone in self.zones:
+            return self.zones[zone]
+        rospy.logerr('Unknown sound zone "%s". Known zones: %s'%(zone, ', '.join(sorted(self.zones))))
+        return None
 
+    @call_timer.timed("select_sound")
     def select_sound(self, data):
+        device = self.zone_device(data.zone)
+        if device is None:
+            return
         if data.sound == SoundRequest.PLAY_FILE:
             if not data.arg2:
-                if not data.arg in self.filesounds.keys():
-                    rospy.logdebug('command for uncached wave: "%s"'%data.arg)
-                    try:
-                        self.filesounds[data.arg] = soundtype(data.arg, self.device, data.volume)
-                    except:
-                        rospy.logerr('Error setting up to play "%s". Does this file exist on the machine on which sound_play is running?'%data.arg)
-                        return
-                else:
-                    rospy.logdebug('command for cached wave: "%s"'%data.arg)
-                    if self.filesounds[data.arg].sound.get_property('volume') != data.volume:
-                        rospy.logdebug('volume for cached wave has changed, resetting volume')
-                        self.filesounds[data.arg].sound.set_property('volume', data.volume)
-                sound = self.filesounds[data.arg]
+                filename = data.arg
+                if filename.startswith(BANK_PREFIX):
+                    return self.select_bank_sound(data, device)
             else:
-                absfilename = os.path.join(roslib.packages.get_pkg_dir(data.arg2), data.arg)
-                if not absfilename in self.filesounds.keys():
-                    rospy.logdebug('command for uncached wave: "%s"'%absfilename)
-                    try:
-                        self.filesounds[absfilename] = soundtype(absfilename, self.device, data.volume)
-                    except:
+                filename = os.path.join(roslib.packages.get_pkg_dir(data.arg2), data.arg)
+            key = (data.zone, filename)
+            if not key in self.filesounds.keys():
+                rospy.logdebug('command for uncached wave: "%s"'%filename)
+                try:
+                    self.filesounds[key] = soundtype(filename, device, data.volume)
+                except:
+                    if not data.arg2:
+                        rospy.logerr('Error setting up to play "%s". Does this file exist on the machine on which sound_play is running?'%data.arg)
+                    else:
                         rospy.logerr('Error setting up to play "%s" from package "%s". Does this file exist on the machine on which sound_play is running?'%(data.arg, data.arg2))
-                        return
-                else:
-                    rospy.logdebug('command for cached wave: "%s"'%absfilename)
-                    if self.filesounds[absfilename].sound.get_property('volume') != data.volume:
-                        rospy.logdebug('volume for cached wave has changed, resetting volume')
-                        self.filesounds[absfilename].sound.set_property('volume', data.volume)
-                sound = self.filesounds[absfilename]
+                    return
+            else:
+                rospy.logdebug('command for cached wave: "%s"'%filename)
+                if self.filesounds[key].sound.get_property('volume') != data.volume:
+                    rospy.logdebug('volume for cached wave has changed, resetting volume')
+                    self.filesounds[key].set_volume(data.volume)
+            sound = self.filesounds[key]
         elif data.sound == SoundRequest.SAY:
             if data.command == SoundRequest.PLAY_STOP:
-                self._loading_speaking_command(data)
-            else:
-                self._add_to_queue_to_say(data)
+                # Only a phrase that was said can be stopped; don't
+                # synthesize it just to stop it
+                return self.voicesounds.get(self.voice_key(data))
+            self._add_to_queue_to_say(data)
             sound = None
         else:
             rospy.logdebug('command for builtin wave: %i'%data.sound)
-            if data.sound not in self.builtinsounds or (data.sound in self.builtinsounds and data.volume != self.builtinsounds[data.sound].volume):
-                params = self.builtinsoundparams[data.sound]
-                volume = data.volume
-                if params[1] != 1: # use the second param as a scaling for the input volume
-                    volume = (volume + params[1])/2
-                self.builtinsounds[data.sound] = soundtype(params[0], self.device, volume)
-            sound = self.builtinsounds[data.sound]
+            if data.sound not in self.builtinsoundparams:
+                rospy.logerr('Unknown builtin sound %i'%data.sound)
+                return
+            key = (data.zone, data.sound)
+            if key not in self.builtinsounds:
+                self.builtinsounds[key] = self.load_builtin(data.sound, device)
+            sound = self.builtinsounds[key]
+            # The volume is changed in place, so alternating volumes don't
+            # rebuild the sound
+            sound.set_volume(self.builtin_volume(data.sound, data.volume))
         if sound is not None and \
                 sound.staleness != 0 and data.command != SoundRequest.PLAY_STOP:
             # This sound isn't counted in active_sounds
             rospy.logdebug("activating %i %s"%(data.sound,data.arg))
             self.active_sounds = self.active_sounds + 1
             sound.staleness = 0
-            #                    if self.active_sounds > self.num_channels:
-            #                        mixer.set_num_channels(self.active_sounds)
-            #                        self.num_channels = self.active_sounds
         return sound
 
+    def select_bank_sound(self, data, device):
+        key = (data.zone, data.arg)
+        if key not in self.filesounds:
+            name = data.arg[len(BANK_PREFIX):]
+            bank = self.banks.get(name)
+            if bank is None:
+                rospy.logerr('No sound named "%s" in the sound banks'%name)
+                return None
+            self.filesounds[key] = banksoundtype(bank, name, device, data.volume)
+        elif self.filesounds[key].sound.get_property('volume') != data.volume:
+            self.filesounds[key].set_volume(data.volume)
+        return self.filesounds[key]
+
+    def builtin_volume(self, id, volume):
+        scale = self.builtinsoundparams[id][1]
+        if scale != 1: # use the second param as a scaling for the input volume
+            volume = (volume + scale)/2
+        return volume
+
+    def load_builtin(self, id, device):
+        (file, scale, preload) = self.builtinsoundparams[id]
+        if file.startswith(BANK_PREFIX):
+            name = file[len(BANK_PREFIX):]
+            if name not in self.banks:
+                raise Exception('No sound named "%s" in the sound banks'%name)
+            sound = banksoundtype(self.banks[name], name, device, self.builtin_volume(id, 1.0))
+        else:
+            sound = soundtype(file, device, self.builtin_volume(id, 1.0))
+        sound.pinned = preload
+        return sound
+
+    # Create, and optionally preroll, the builtin sounds marked for preloading
+    # in every zone
+    def preload_builtins(self):
+        for (id, params) in self.builtinsoundparams.items():
+            if not params[2]:
+                continue
+            for zone in [''] + sorted(self.zones):
+                if (zone, id) in self.builtinsounds:
+                    continue
+                try:
+                    sound = self.load_builtin(id, self.zone_device(zone))
+                    if self.preroll:
+                        sound.preroll()
+                    self.builtinsounds[(zone, id)] = sound
+                except Exception as e:
+                    rospy.logerr('Could not preload builtin sound %i: %s'%(id, str(e)))
+
+    def playing_sounds(self):
+        sounds = []
+        for dict in (self.builtinsounds, self.filesounds, self.voicesounds):
+            sounds.extend(sound for sound in list(dict.values()) if sound.state != sound.STOPPED)
+        return sounds
+
+    # Make room for sound to start playing, within ~num_channels sounds, by
+    # stopping another one according to ~steal_policy. Returns False if the
+    # request has to be rejected instead. Called with the mutex held.
+    def allocate_channel(self, sound, data):
+        if self.num_channels > 0 and sound.state == sound.STOPPED:
+            playing = self.playing_sounds()
+            if len(playing) >= self.num_channels:
+                victim = None
+                if self.steal_policy == 'oldest':
+                    victim = min(playing, key=lambda s: s.started)
+                elif self.steal_policy == 'quietest':
+                    victim = min(playing, key=lambda s: (s.volume, s.started))
+                elif self.steal_policy == 'priority':
+                    victim = min(playing, key=lambda s: (s.priority, s.started))
+                    if victim.priority > data.priority:
+                        victim = None
+                if victim is None:
+                    self.rejections += 1
+                    rospy.logwarn('All %i sound channels are in use, not playing %s'%(self.num_channels, sound.uri))
+                    return False
+                rospy.logdebug('Stopping %s to play %s'%(victim.uri, sound.uri))
+                victim.stop()
+                self.steals += 1
+        # Scheduled sounds start at data.start, or now if that has passed
+        sound.started = max(rospy.get_time(), data.start.to_sec())
+        sound.priority = data.priority
+        sound.request = data
+        return True
+
     def _add_to_queue_to_say(self, data):
+        if data.zone not in self.speech:
+            self.speech[data.zone] = speechqueue()
         try:
-            self._queues_to_say[data.priority].put(data)
+            self.speech[data.zone].put(data)
         except Exception as e:
             rospy.logerr("Exception in _add_to_queue_to_say: " + str(e) +
                             "\nMaybe invalid priority level: " + str(data.priority))
 
+    # Called with the mutex held
     def _say_from_queue(self):
-        if self._sound_say_busy.value is False:
-            data = None
-            if not self._queues_to_say[SoundRequest.PRIORITY_THREE].empty():
-                data = self._queues_to_say[SoundRequest.PRIORITY_THREE].get()
-            
-            elif not self._queues_to_say[SoundRequest.PRIORITY_TWO].empty():
-                data = self._queues_to_say[SoundRequest.PRIORITY_TWO].get()
-            
-            elif not self._queues_to_say[SoundRequest.PRIORITY_ONE].empty():
-                data = self._queues_to_say[SoundRequest.PRIORITY_ONE].get()
-            
-            if data is not None:
-                self._sound_say_busy.value = True     
-                # No need to check the lock as it is an atomic action
-
-                sound_say = self._loading_speaking_command(data)
-                sound_say.command(data.command)
-                self._last_sound_say = sound_say
+        for speech in list(self.speech.values()):
+            if not speech.busy:
+                data = speech.get()
+                if data is not None:
+                    inhibit = self.inhibits(data)
+                    if inhibit is not None:
+                        # Queued before the node was inhibited
+                        self.hold(data, inhibit)
+                        continue
+                    sound_say = self._loading_speaking_command(data)
+                    if sound_say is None:
+                        continue
+                    # The mutex is released while synthesizing
+                    inhibit = self.inhibits(data)
+                    if inhibit is not None:
+                        self.hold(data, inhibit)
+                        continue
+                    if not self.allocate_channel(sound_say, data):
+                        continue
+                    speech.busy = True
+                    if data.start.is_zero():
+                        sound_say.command(data.command)
+                    else:
+                        self.start_at(sound_say, data)
+                    speech.last_sound = sound_say
+                    self.duck_event.set()
+                    status_changed.set()
 
+    # Called with the mutex held
     def _end_phrase_check(self):
-        if self._sound_say_busy.value is True and \
-                self._last_sound_say.get_staleness(True) != 0:
-            self._sound_say_busy.value = False
+        for speech in list(self.speech.values()):
+            if speech.busy and speech.last_sound.get_staleness(True) != 0:
+                speech.busy = False
+                status_changed.set()
+
+    # arg2 selects the synthesizer and voice, as in "espeak:en-us"; without
+    # a synthesizer name it is a voice of ~default_synthesizer.
+    def _synthesize(self, data):
+        (name, voice) = synthesizers.parse_voice(data.arg2, self.default_synthesizer)
+        key = (name, voice, data.arg)
+        if key in self.voicefiles:
+            return self.voicefiles[key]
+        (wavfile,wavfilename) = tempfile.mkstemp(prefix='sound_play', suffix='.wav')
+        os.close(wavfile)
+        try:
+            synthesizer = synthesizers.get(name)
+            if not self.composer.compose(synthesizer, name, voice, data.arg, wavfilename):
+                synthesizer.synthesize(data.arg, voice, wavfilename)
+        except Exception as e:
+            rospy.logerr(str(e))
+            os.remove(wavfilename)
+            return None
+        self.voicefiles[key] = wavfilename
+        return wavfilename
+
+    # Cache key of a phrase in voicesounds: the same text said by another
+    # synthesizer or voice is another sound
+    def voice_key(self, data):
+        (name, voice) = synthesizers.parse_voice(data.arg2, self.default_synthesizer)
+        return (data.zone, name, voice, data.arg)
 
+    @call_timer.timed("_loading_speaking_command")
     def _loading_speaking_command(self, data):
-        if not data.arg in self.voicesounds.keys():
+        key = self.voice_key(data)
+        if not key in self.voicesounds.keys():
             rospy.logdebug('command for uncached text: "%s"' % data.arg)
-            txtfile = tempfile.NamedTemporaryFile(prefix='sound_play', suffix='.txt')
-            (wavfile,wavfilename) = tempfile.mkstemp(prefix='sound_play', suffix='.wav')
-            txtfilename=txtfile.name
-            os.close(wavfile)
-            voice = data.arg2
+            device = self.zone_device(data.zone)
+            if device is None:
+                return None
+            # Synthesis can take seconds, so requests are handled meanwhile.
+            # Only this thread adds to voicesounds.
+            self.mutex.release()
             try:
-                try:
-                    txtfile.write(data.arg.decode('UTF-8').encode('ISO-8859-15'))
-                except UnicodeEncodeError:
-                    txtfile.write(data.arg)
-                txtfile.flush()
-                os.system("text2wave -eval '("+voice+")' "+txtfilename+" -o "+wavfilename)
-                try:
-                    if os.stat(wavfilename).st_size == 0:
-                        raise OSError # So we hit the same catch block
-                except OSError:
-                    rospy.logerr('Sound synthesis failed. Is festival installed? Is a festival voice installed? Try running "rosdep satisfy sound_play|sh". Refer to http://wiki.ros.org/sound_play/Troubleshooting')
-                    return
-                self.voicesounds[data.arg] = soundtype(wavfilename, self.device, data.volume)
+                wavfilename = self._synthesize(data)
             finally:
-                txtfile.close()
+                self.mutex.acquire()
+            if wavfilename is None:
+                return None
+            self.voicesounds[key] = soundtype(wavfilename, device, data.volume)
         else:
             rospy.logdebug('command for cached text: "%s"'%data.arg)
-            if self.voicesounds[data.arg].sound.get_property('volume') != data.volume:
+            if self.voicesounds[key].sound.get_property('volume') != data.volume:
                 rospy.logdebug('volume for cached text has changed, resetting volume')
-                self.voicesounds[data.arg].sound.set_property('volume', data.volume)
-        sound = self.voicesounds[data.arg]
+                self.voicesounds[key].set_volume(data.volume)
+        sound = self.voicesounds[key]
         return sound
         
-    def callback(self,data):
-        if not self.initialized:
-            return
-        self.mutex.acquire()
-
+    # Called with the mutex held
+    def handle(self, data):
         try:
-            if data.sound == SoundRequest.ALL and data.command == SoundRequest.PLAY_STOP:
-                self.stopall()
+            inhibit = self.inhibits(data)
+            if inhibit is not None:
+                self.hold(data, inhibit)
+            elif data.sound == SoundRequest.ALL and data.command == SoundRequest.PLAY_STOP:
+                self.stopall(data.zone or None)
+            elif not data.start.is_zero() and data.command != SoundRequest.PLAY_STOP and \
+                    data.sound != SoundRequest.SAY:
+                # Speech is scheduled when its turn in the queue comes
+                self.schedule(data)
             else:
                 sound = self.select_sound(data)
-                if data.sound != SoundRequest.SAY or \
-                        data.command == SoundRequest.PLAY_STOP:
-                    sound.command(data.command)
+                if sound is not None and (data.sound != SoundRequest.SAY or \
+                        data.command == SoundRequest.PLAY_STOP):
+                    if data.command == SoundRequest.PLAY_STOP or self.allocate_channel(sound, data):
+                        sound.command(data.command)
         except Exception as e:
             rospy.logerr('Exception in callback: %s'%str(e))
             rospy.loginfo(traceback.format_exc())
+        status_changed.set()
+
+    # Prepare the sound now and start it at data.start
+    def schedule(self, data):
+        sound = self.select_sound(data)
+        if sound is None or not self.allocate_channel(sound, data):
+            return
+        self.start_at(sound, data)
+
+    # The ROS time is converted to wall clock time, which is what
+    # self.clock counts
+    def start_at(self, sound, data):
+        start = data.start.to_sec() - rospy.get_time() + time.time()
+        if start < time.time():
+            rospy.logwarn('Sound %i %s was scheduled %.3fs ago, playing it late'%(data.sound, data.arg, time.time() - start))
+            # A base time in the past would skip the start of the sound
+            start = time.time()
+        base_time = int(start * Gst.SECOND)
+        sound.schedule(data.command, base_time, self.clock)
+        if data.sound == SoundRequest.SAY:
+            self.duck_event.set()
+        # Measure once the sound has been playing for a moment
+        timer = threading.Timer(max(0, start - time.time()) + 0.2, self.report_onset, (sound, base_time))
+        timer.daemon = True
+        timer.start()
+
+    def report_onset(self, sound, base_time):
+        try:
+            error = sound.onset_error(base_time)
+        except Exception as e:
+            rospy.logdebug('Could not measure onset error: %s'%str(e))
+            return
+        if error is not None:
+            self.onset_error = error
+            rospy.loginfo('Scheduled sound %s started %.1f ms %s'%(sound.uri, abs(error) * 1000, 'late' if error >= 0 else 'early'))
+
+    def start_profile(self, req):
+        if self.profiler is not None:
+            if req.duration > 0:
+                return ProfileResponse(False, 'Already profiling to %s'%self.profiler.filename, self.profiler.filename)
+            return self.stop_profile()
+        if req.duration <= 0:
+            return ProfileResponse(False, 'Not profiling', '')
+        mode = req.mode or ProfileRequest.SAMPLING
+        filename = req.filename
+        if not filename:
+            filename = os.path.join(os.path.expanduser('~/.ros'), 'sound_play_%s.%s'%(
+                time.strftime('%Y%m%d-%H%M%S'), 'folded' if mode == ProfileRequest.SAMPLING else 'prof'))
+        try:
+            profiler = profiling.Profiler(mode, filename)
+            profiler.start()
+        except Exception as e:
+            return ProfileResponse(False, str(e), '')
+        self.profiler = profiler
+        self.profile_timer = threading.Timer(req.duration, self.stop_profile)
+        self.profile_timer.daemon = True
+        self.profile_timer.start()
+        rospy.loginfo('Profiling for %.1fs to %s'%(req.duration, filename))
+        return ProfileResponse(True, 'Profiling for %.1fs'%req.duration, filename)
+
+    def stop_profile(self):
+        (profiler, self.profiler) = (self.profiler, None)
+        if profiler is None:
+            return ProfileResponse(False, 'Not profiling', '')
+        self.profile_timer.cancel()
+        try:
+            profiler.stop()
+        except Exception as e:
+            rospy.logerr('Could not write profile %s: %s'%(profiler.filename, str(e)))
+            return ProfileResponse(False, str(e), profiler.filename)
+        rospy.loginfo('Wrote profile %s'%profiler.filename)
+        return ProfileResponse(True, 'Wrote profile', profiler.filename)
+
+    # Ramp the gain of sounds down while speech of the same or a higher
+    # priority plays in their zone, and back up afterwards. Only the
+    # volume changes, so the sounds keep playing where they are. The loop
+    # sleeps on duck_event until speech starts.
+    def duck_loop(self):
+        period = 0.01
+        step = (1.0 - self.duck_gain) * period / self.duck_ramp if self.duck_ramp > 0 else 1.0
+        while not rospy.is_shutdown():
+            if not self.duck_event.wait(1.0):
+                continue
+            self.duck_event.clear()
+            # Keep the thread alive, or ducking would stop for good
+            try:
+                while self.update_ducking(step) and not rospy.is_shutdown():
+                    time.sleep(period)
+            except Exception as e:
+                rospy.logerr('Exception in duck_loop: %s'%str(e))
+
+    # One step of the ramps. Returns whether speech is playing or any sound
+    # is still ducked.
+    def update_ducking(self, step):
+        self.mutex.acquire()
+        try:
+            speaking = {}
+            for (key, sound) in list(self.voicesounds.items()):
+                if sound.state != sound.STOPPED:
+                    speaking[key[0]] = max(speaking.get(key[0], sound.priority), sound.priority)
+            active = bool(speaking)
+            for dict in (self.builtinsounds, self.filesounds):
+                for (key, sound) in list(dict.items()):
+                    if key[0] in speaking and sound.priority <= speaking[key[0]]:
+                        target = self.duck_gain
+                    else:
+                        target = 1.0
+                    if sound.duck > target:
+                        sound.set_duck(max(target, sound.duck - step))
+                    elif sound.duck < target:
+                        sound.set_duck(min(target, sound.duck + step))
+                    active = active or sound.duck != 1.0
+            return active
+        finally:
+            self.mutex.release()
+
+    # The SetInhibit request that inhibits data, or None. The request is
+    # passed on to hold(), so a release in between can't leave it None.
+    def inhibits(self, data):
+        inhibit = self.inhibit
+        if inhibit is None or data.command == SoundRequest.PLAY_STOP:
+            return None
+        if (not inhibit.priorities or data.priority in inhibit.priorities) and \
+                (not inhibit.sounds or data.sound in inhibit.sounds):
+            return inhibit
+        return None
+
+    def hold(self, data, inhibit):
+        if inhibit.mode == SetInhibitRequest.QUEUE:
+            self.held.append(data)
+            if len(self.held) > self.inhibit_queue_size:
+                self.held.pop(0)
+                self.dropped += 1
+        else:
+            self.dropped += 1
+            rospy.logdebug('Inhibited, dropping request for sound %i %s'%(data.sound, data.arg))
+
+    def set_inhibit(self, req):
+        self.mutex.acquire()
+        try:
+            return self.apply_inhibit(req)
+        finally:
+            self.mutex.release()
+
+    # Called with the mutex held
+    def apply_inhibit(self, req):
+        if req.inhibit:
+            if req.mode not in (SetInhibitRequest.DROP, SetInhibitRequest.QUEUE):
+                return SetInhibitResponse(False, 'Unknown inhibit mode %i'%req.mode)
+            if self.same_inhibit(req):
+                # A client renewing its lease: nothing new to stop or publish
+                self.renew_lease(req.lease)
+                rospy.logdebug('Inhibit lease renewed')
+                return SetInhibitResponse(True, 'Inhibited')
+            self.inhibit = req
+            self.renew_lease(req.lease)
+            # Stop what is playing already, as if it had been inhibited
+            for (sound_id, dict) in ((None, self.builtinsounds),
+                    (SoundRequest.PLAY_FILE, self.filesounds), (SoundRequest.SAY, self.voicesounds)):
+                for (key, sound) in list(dict.items()):
+                    if sound.state != sound.STOPPED and \
+                            (not req.priorities or sound.priority in req.priorities) and \
+                            (not req.sounds or (key[1] if sound_id is None else sound_id) in req.sounds):
+                        sound.stop()
+            message = 'Inhibited'
+        else:
+            self.inhibit = None
+            self.renew_lease(rospy.Duration(0))
+            (held, self.held) = (self.held, [])
+            for data in held:
+                self.handle(data)
+            message = 'Released, playing %i held requests'%len(held)
+        rospy.loginfo(message)
+        self.publish_inhibit_state()
+        status_changed.set()
+        self.publish_status()
+        return SetInhibitResponse(True, message)
+
+    # Whether req inhibits exactly what is inhibited already
+    def same_inhibit(self, req):
+        inhibit = self.inhibit
+        return inhibit is not None and inhibit.mode == req.mode and \
+                list(inhibit.priorities) == list(req.priorities) and \
+                list(inhibit.sounds) == list(req.sounds)
+
+    # Release the node if it isn't inhibited again within lease, so a
+    # client that dies without releasing doesn't mute it for good
+    def renew_lease(self, lease):
+        if self.lease_timer is not None:
+            self.lease_timer.cancel()
+            self.lease_timer = None
+        if lease > rospy.Duration(0):
+            self.lease_timer = threading.Timer(lease.to_sec(), self.expire_lease)
+            self.lease_timer.daemon = True
+            self.lease_timer.args = (self.lease_timer,)
+            self.lease_timer.start()
+
+    def expire_lease(self, timer):
+        self.mutex.acquire()
+        try:
+            # Unless it was renewed while waiting for the mutex
+            if self.lease_timer is timer:
+                rospy.logwarn('Inhibit lease expired, releasing')
+                self.apply_inhibit(SetInhibitRequest(inhibit=False))
+        finally:
+            self.mutex.release()
+
+    def publish_inhibit_state(self):
+        state = InhibitState()
+        if self.inhibit is not None:
+            state.inhibited = True
+            state.mode = self.inhibit.mode
+            state.priorities = self.inhibit.priorities
+            state.sounds = self.inhibit.sounds
+        state.dropped = self.dropped
+        state.held = len(self.held)
+        self.inhibit_pub.publish(state)
+
+    def sound_status(self, data):
+        return SoundStatus(sound=data.sound, command=data.command, volume=data.volume,
+                priority=data.priority, arg=data.arg, zone=data.zone)
+
+    # Publish what is playing and queued on robotsound_status, if
+    # status_changed was set since the last message. Called with the mutex
+    # held.
+    def publish_status(self):
+        if not self.initialized or not status_changed.is_set():
+            return
+        status_changed.clear()
+        try:
+            msg = SoundPlayStatus()
+            msg.stamp = rospy.get_rostime()
+            for sound in self.playing_sounds():
+                if sound.request is None:
+                    continue
+                status = self.sound_status(sound.request)
+                (position, duration) = sound.progress()
+                status.started = rospy.Time.from_sec(sound.started)
+                status.position = rospy.Duration.from_sec(position)
+                status.duration = rospy.Duration.from_sec(duration)
+                msg.playing.append(status)
+            for zone in sorted(self.speech):
+                msg.queued.extend(self.sound_status(data) for data in self.speech[zone].pending())
+        except Exception as e:
+            rospy.logerr('Exception in publish_status: %s'%str(e))
+            return
+        self.status_pub.publish(msg)
+
+    @call_timer.timed("callback")
+    def callback(self,data):
+        if not self.initialized:
+            return
+        self.mutex.acquire()
+        try:
+            self.handle(data)
+            self.publish_status()
         finally:
             self.mutex.release()
             rospy.logdebug("done callback")
 
+    @call_timer.timed("batch_callback")
+    def batch_callback(self, batch):
+        if not self.initialized:
+            return
+        self.mutex.acquire()
+        try:
+            for data in batch.requests:
+                self.handle(data)
+            self.publish_status()
+        finally:
+            self.mutex.release()
+            rospy.logdebug("done batch callback")
+
     # Purge sounds that haven't been played in a while.
     def cleanupdict(self, dict):
         purgelist = []
-        for (key,sound) in dict.iteritems():
+        for (key,sound) in list(dict.items()):
             try:
                 staleness = sound.get_staleness()
             except Exception as e:
                 rospy.logerr('Exception in cleanupdict for sound (%s): %s'%(str(key),str(e)))
                 staleness = 100 # Something is wrong. Let's purge and try again.
             #print "%s %i"%(key, staleness)
-            if staleness >= 10:
+            if staleness >= 10 and not sound.pinned:
                 purgelist.append(key)
-            if staleness == 0: # Sound is playing
+            if staleness == 0 and not (sound.prerolled and sound.state == sound.STOPPED): # Sound is playing
                 self.active_sounds = self.active_sounds + 1
         for key in purgelist:
-            rospy.logdebug('Purging %s from cache'%key)
-            if dict[key].file[0:4] == "/tmp":
-                os.remove(dict[key].file) 
-                rospy.logdebug("Remove " + dict[key].file)
+            rospy.logdebug('Purging %s from cache'%str(key))
+            file = dict[key].file
             dict[key].dispose() # clean up resources
             del dict[key]
+            # Synthesized speech may still be cached for another zone
+            if file[0:4] == "/tmp" and \
+                    not any(sound.file == file for sound in self.voicesounds.values()):
+                os.remove(file)
+                rospy.logdebug("Remove " + file)
+                for (text, wavfile) in list(self.voicefiles.items()):
+                    if wavfile == file:
+                        del self.voicefiles[text]
 
+    @call_timer.timed("cleanup")
     def cleanup(self):
         self.mutex.acquire()
         try:
@@ -423,9 +1017,22 @@ class soundplay:
                 ds.message = "%i sounds playing"%self.active_sounds
                 ds.values.append(KeyValue("Active sounds", str(self.active_sounds)))
                 ds.values.append(KeyValue("Allocated sound channels", str(self.num_channels)))
+                ds.values.append(KeyValue("Channel steal policy", self.steal_policy))
+                ds.values.append(KeyValue("Stolen channels", str(self.steals)))
+                ds.values.append(KeyValue("Rejected requests", str(self.rejections)))
+                ds.values.append(KeyValue("Inhibited", str(self.inhibit is not None)))
+                ds.values.append(KeyValue("Slowest calls (ms)", ", ".join(
+                        "%s %.1f"%(name, duration * 1000) for (duration, when, name) in call_timer.slowest()[:5])))
+                if self.onset_error is not None:
+                    ds.values.append(KeyValue("Last scheduled onset error (ms)", "%.1f"%(self.onset_error * 1000)))
                 ds.values.append(KeyValue("Buffered builtin sounds", str(len(self.builtinsounds))))
                 ds.values.append(KeyValue("Buffered wave sounds", str(len(self.filesounds))))
                 ds.values.append(KeyValue("Buffered voice sounds", str(len(self.voicesounds))))
+                ds.values.append(KeyValue("Synthesized phrases", str(len(self.voicefiles))))
+                ds.values.append(KeyValue("Zones", ", ".join(sorted(self.zones))))
+                ds.values.append(KeyValue("Default synthesizer", self.default_synthesizer))
+                ds.values.append(KeyValue("Cached template fragments", str(len(self.composer.cache))))
+                ds.values.append(KeyValue("Sound bank sounds", str(len(self.banks))))
             elif state == 1:
                 ds.level = DiagnosticStatus.WARN
                 ds.message = "Sound device not open yet."
@@ -444,30 +1051,131 @@ class soundplay:
 
         # Start gobject thread to receive gstreamer messages
         GObject.threads_init()
-        self.g_loop = threading.Thread(target=GObject.MainLoop().run)
+        self.g_loop = threading.Thread(target=GObject.MainLoop().run, name="gobject_loop")
         self.g_loop.daemon = True
         self.g_loop.start()
 
 
         rospy.init_node('sound_play')
         self.device = rospy.get_param("~device", "default")
+        # Additional outputs, as a dictionary from zone name to ALSA device.
+        # Requests name the zone to play in; the default zone is ~device.
+        self.zones = rospy.get_param("~zones", {})
+        # Speech synthesizers from other packages, as a dictionary from name
+        # to the import path of a sound_play.synthesizers.Synthesizer class
+        for (name, path) in rospy.get_param("~synthesizers", {}).items():
+            try:
+                synthesizers.register(name, path)
+            except Exception as e:
+                rospy.logerr('Could not load synthesizer "%s" from %s: %s'%(name, path, str(e)))
+        self.default_synthesizer = rospy.get_param("~default_synthesizer", "festival")
+        if self.default_synthesizer not in synthesizers.names():
+            rospy.logerr('Unknown ~default_synthesizer "%s", using festival. Known synthesizers: %s'%(self.default_synthesizer, ', '.join(synthesizers.names())))
+            self.default_synthesizer = "festival"
+        # Phrases matching one of ~templates, such as "Battery at {percent}
+        # percent", are joined from separately synthesized fragments, which
+        # are cached and shared between phrases.
+        self.composer = templates.PhraseComposer(rospy.get_param("~templates", []),
+                cache_size=rospy.get_param("~template_cache_size", 200),
+                crossfade=rospy.get_param("~template_crossfade", 0.01),
+                gap=rospy.get_param("~template_gap", 0.05))
+        vocabulary = rospy.get_param("~template_vocabulary", [])
+        # Voices to preload the fragments for, as in SoundRequest.arg2. An
+        # empty voice, which SoundClient.say() sends by default, is the
+        # same as the synthesizer's default voice (voice_kal_diphone).
+        voices = rospy.get_param("~template_voices", ["voice_kal_diphone"])
+        if self.composer.templates:
+            preload = threading.Thread(target=self.preload_templates, args=(vocabulary, voices))
+            preload.daemon = True
+            preload.start()
+        # Sound banks made with pack_soundbank.py. Their sounds are played as
+        # "soundbank:<name>"; a name in several banks plays from the first.
+        self.banks = {}
+        for path in rospy.get_param("~sound_banks", []):
+            try:
+                bank = soundbank.SoundBank(os.path.expanduser(path))
+            except Exception as e:
+                rospy.logerr('Could not load sound bank %s: %s'%(path, str(e)))
+                continue
+            for name in bank.names():
+                self.banks.setdefault(name, bank)
+            rospy.loginfo('Loaded %i sounds from %s'%(len(bank), path))
         self.diagnostic_pub = rospy.Publisher("/diagnostics", DiagnosticArray, queue_size=1)
         rootdir = os.path.join(roslib.packages.get_pkg_dir('sound_play'),'sounds')
 
+        # Builtin sounds, as (file, volume scale, preload)
         self.builtinsoundparams = {
-                SoundRequest.BACKINGUP              : (os.path.join(rootdir, 'BACKINGUP.ogg'), 0.1),
-                SoundRequest.NEEDS_UNPLUGGING       : (os.path.join(rootdir, 'NEEDS_UNPLUGGING.ogg'), 1),
-                SoundRequest.NEEDS_PLUGGING         : (os.path.join(rootdir, 'NEEDS_PLUGGING.ogg'), 1),
-                SoundRequest.NEEDS_UNPLUGGING_BADLY : (os.path.join(rootdir, 'NEEDS_UNPLUGGING_BADLY.ogg'), 1),
-                SoundRequest.NEEDS_PLUGGING_BADLY   : (os.path.join(rootdir, 'NEEDS_PLUGGING_BADLY.ogg'), 1),
+                SoundRequest.BACKINGUP              : (os.path.join(rootdir, 'BACKINGUP.ogg'), 0.1, False),
+                SoundRequest.NEEDS_UNPLUGGING       : (os.path.join(rootdir, 'NEEDS_UNPLUGGING.ogg'), 1, False),
+                SoundRequest.NEEDS_PLUGGING         : (os.path.join(rootdir, 'NEEDS_PLUGGING.ogg'), 1, False),
+                SoundRequest.NEEDS_UNPLUGGING_BADLY : (os.path.join(rootdir, 'NEEDS_UNPLUGGING_BADLY.ogg'), 1, False),
+                SoundRequest.NEEDS_PLUGGING_BADLY   : (os.path.join(rootdir, 'NEEDS_PLUGGING_BADLY.ogg'), 1, False),
                 }
+        # Additional or replacement builtin sounds, as a list of
+        # {id, file, volume, preload}. Files are absolute, relative to the
+        # sounds directory, or soundbank:<name>. Preloaded sounds are created
+        # at startup in every zone and never purged.
+        for entry in rospy.get_param("~builtin_sounds", []):
+            try:
+                id = int(entry['id'])
+                file = entry['file']
+            except (KeyError, TypeError, ValueError):
+                rospy.logerr('Builtin sounds need an integer id and a file: %s'%str(entry))
+                continue
+            if id < 1 or id > 127:
+                rospy.logerr('Builtin sound ids must be between 1 and 127, not %i'%id)
+                continue
+            if not file.startswith(BANK_PREFIX) and ":" not in file:
+                file = os.path.join(rootdir, file)
+            self.builtinsoundparams[id] = (file, entry.get('volume', 1), entry.get('preload', True))
+        self.preroll = rospy.get_param("~preroll", True)
+        # Maximum number of sounds playing at once (0 for no limit), and how
+        # to make room for another: stop the oldest, quietest or lowest
+        # priority sound, or reject the new one
+        self.num_channels = rospy.get_param("~num_channels", 10)
+        self.steal_policy = rospy.get_param("~steal_policy", "oldest")
+        if self.steal_policy not in ('oldest', 'quietest', 'priority', 'reject'):
+            rospy.logerr('Unknown ~steal_policy "%s", using oldest. Use oldest, quietest, priority or reject.'%self.steal_policy)
+            self.steal_policy = 'oldest'
+        self.steals = 0
+        self.rejections = 0
+        # Gain of other sounds while speech plays (the default of 1 disables
+        # ducking), and the time to ramp it down or back up
+        self.duck_gain = rospy.get_param("~duck_gain", 1.0)
+        self.duck_ramp = rospy.get_param("~duck_ramp", 0.2)
+        self.duck_event = threading.Event()
+        if self.duck_gain < 1.0:
+            self.duck_thread = threading.Thread(target=self.duck_loop, name="duck_loop")
+            self.duck_thread.daemon = True
+            self.duck_thread.start()
 
         self.no_error = True
         self.initialized = False
         self.active_sounds = 0
+        self.builtinsounds = {}
 
         self.mutex = threading.Lock()
+        # Not behind the mutex, so that a stalled node can still be profiled
+        self.profiler = None
+        rospy.Service("~profile", Profile, self.start_profile)
+        call_timer.threshold = rospy.get_param("~slow_call_threshold", 0.5)
+        call_timer.on_slow = lambda name, duration: rospy.logwarn('%s took %.0f ms'%(name, duration * 1000))
+        # Clock of scheduled sounds, counting wall clock time in nanoseconds
+        self.clock = Gst.SystemClock()
+        self.clock.set_property("clock-type", Gst.ClockType.REALTIME)
+        self.onset_error = None
+        # While inhibited, the SetInhibit request in effect
+        self.inhibit = None
+        self.lease_timer = None
+        self.held = []
+        self.dropped = 0
+        self.inhibit_queue_size = rospy.get_param("~inhibit_queue_size", 100)
+        self.inhibit_pub = rospy.Publisher("robotsound_inhibit_state", InhibitState, queue_size=1, latch=True)
+        self.publish_inhibit_state()
+        self.status_pub = rospy.Publisher("robotsound_status", SoundPlayStatus, queue_size=10, latch=True)
+        rospy.Service("robotsound_inhibit", SetInhibit, self.set_inhibit)
         sub = rospy.Subscriber("robotsound", SoundRequest, self.callback)
+        batch_sub = rospy.Subscriber("robotsound_batch", SoundRequestBatch, self.batch_callback)
         # self._as = actionlib.SimpleActionServer('sound_play', SoundRequestAction, execute_cb=self.execute_cb, auto_start = False)
         # self._as.start()
 
@@ -493,12 +1201,29 @@ class soundplay:
             self.diagnostics(2)
         self.mutex.release()
 
+    # Synthesize template fragments for ~template_voices in the background
+    def preload_templates(self, vocabulary, voices):
+        for arg2 in voices:
+            (name, voice) = synthesizers.parse_voice(arg2, self.default_synthesizer)
+            try:
+                self.composer.preload(synthesizers.get(name), name, voice, vocabulary)
+            except Exception as e:
+                rospy.logwarn('Could not preload template fragments for voice "%s": %s'%(arg2, str(e)))
+        rospy.logdebug('Preloaded %i template fragments'%len(self.composer.cache))
+
     def init_vars(self):
-        self.num_channels = 10
-        self.builtinsounds = {}
+        # Preloaded builtins outlive idle_loop, which returns whenever the
+        # node has been idle for a while; anything else left is shut down
+        for (key, sound) in list(self.builtinsounds.items()):
+            if not sound.pinned:
+                sound.dispose()
+                del self.builtinsounds[key]
         self.filesounds = {}
         self.voicesounds = {}
+        self.voicefiles = {}
+        self.speech = {}
         self.hotlist = []
+        self.preload_builtins()
         if not self.initialized:
             rospy.loginfo('sound_play node is ready to play sound')
 
@@ -511,7 +1236,8 @@ class soundplay:
     def idle_loop(self):
         self.last_activity_time = rospy.get_time()
         while (rospy.get_time() - self.last_activity_time < 10 or
-                 len(self.builtinsounds) + len(self.voicesounds) + len(self.filesounds) > 0) \
+                 len([s for s in self.builtinsounds.values() if not s.pinned]) +
+                 len(self.voicesounds) + len(self.filesounds) > 0) \
                 and not rospy.is_shutdown():
             self.diagnostics(0)
             self._say_phrase_with_delay_one_sec(20)
@@ -520,8 +1246,15 @@ class soundplay:
     def _say_phrase_with_delay_one_sec(self, hz):
         one_delay = 1.0 / hz
         for i in range(hz):
-            self._end_phrase_check()
-            self._say_from_queue()
+            # Starting speech allocates channels and reads the inhibit, as
+            # the request callbacks do
+            self.mutex.acquire()
+            try:
+                self._end_phrase_check()
+                self._say_from_queue()
+                self.publish_status()
+            finally:
+                self.mutex.release()
             self.sleep(one_delay)
 
 if __name__ == '__main__':
@@ -38,9 +38,12 @@ import rospy
 import roslib
 # import actionlib
 import os, sys
+from contextlib import contextmanager
 from sound_play.msg import SoundRequest
+from sound_play.msg import SoundRequestBatch
 from sound_play.msg import SoundRequestGoal
 from sound_play.msg import SoundRequestAction
+from sound_play.srv import SetInhibit, SetInhibitRequest
 
 ## \brief Class that publishes messages to the sound_play node.
 ##
@@ -54,11 +57,17 @@ from sound_play.msg import SoundRequestAction
 ##   message can be invoked.
 
 class Sound(object):
-    def __init__(self, client, snd, arg, volume=1.0):
+    def __init__(self, client, snd, arg, volume=1.0, zone=None):
         self.client = client
         self.snd = snd
         self.arg = arg
         self.vol = volume
+        self.zone = zone
+
+    def _kwargs(self, kwargs):
+        if self.zone is not None:
+            kwargs.setdefault('zone', self.zone)
+        return kwargs
 
 ## \brief Play the Sound.
 ##
@@ -66,7 +75,7 @@ class Sound(object):
 
     def play(self, **kwargs):
         self.client.sendMsg(self.snd, SoundRequest.PLAY_ONCE, self.arg,
-                            vol=self.vol, **kwargs)
+                            vol=self.vol, **self._kwargs(kwargs))
 
 ## \brief Play the Sound repeatedly.
 ##
@@ -75,14 +84,15 @@ class Sound(object):
 
     def repeat(self, **kwargs):
        self.client.sendMsg(self.snd, SoundRequest.PLAY_START, self.arg,
-                           vol=self.vol, **kwargs)
+                           vol=self.vol, **self._kwargs(kwargs))
 
 ## \brief Stop Sound playback.
 ##
 ## This method causes the Sound to stop playing.
 
-    def stop(self):
-        self.client.sendMsg(self.snd, SoundRequest.PLAY_STOP, self.arg)
+    def stop(self, **kwargs):
+        self.client.sendMsg(self.snd, SoundRequest.PLAY_STOP, self.arg,
+                            **self._kwargs(kwargs))
 
 ## This class is a helper class for communicating with the sound_play node
 ## via the \ref sound_play.SoundRequest message. There is a one-to-one mapping
@@ -90,7 +100,7 @@ class Sound(object):
 
 class SoundClient(object):
 
-    def __init__(self, blocking=False, sound_action='sound_play', sound_topic='robotsound'):
+    def __init__(self, blocking=False, sound_action='sound_play', sound_topic='robotsound', zone=''):
         """
 
         The SoundClient can send SoundRequests in two modes: non-blocking mode
@@ -112,24 +122,66 @@ class SoundClient(object):
 
         :param sound_topic: Topic name to play sound. The topic interface is used only if blocking
         parameter is False. (default='robotsound')
+
+        :param zone: Output zone of the sound_play node to play in, as
+        configured in its ~zones parameter. Each method can take an optional
+        `zone=` argument to play elsewhere. (default='', the node's ~device)
         """
 
         self._blocking = blocking
+        self._zone = zone
 
         # NOTE: only one of these will be used at once, but we need to create
         # both the publisher and actionlib client here.
         # self.actionclient = actionlib.SimpleActionClient(
         #     sound_action, SoundRequestAction)
         self.pub = rospy.Publisher(sound_topic, SoundRequest, queue_size=5)
+        self.batch_pub = rospy.Publisher(sound_topic + '_batch', SoundRequestBatch, queue_size=5)
+        self._inhibit_service = sound_topic + '_inhibit'
+        self._batch = None
+
+## \brief Send several requests in one message
+##
+## Requests made inside the with block are collected and published
+## together when it ends, so none of them can be dropped by the publisher
+## queue and the node applies them in order, e.g.
+##
+##   with soundhandle.batch():
+##       soundhandle.stopAll()
+##       soundhandle.play(SoundRequest.NEEDS_PLUGGING)
+##
+## Requests in a batch never block. Batches can be nested; the requests
+## are sent when the outermost one ends. If the block raises, none of them
+## are sent.
+
+    @contextmanager
+    def batch(self):
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = []
+        try:
+            yield self
+        except:
+            self._batch = None
+            raise
+        requests, self._batch = self._batch, None
+        if requests:
+            self.batch_pub.publish(SoundRequestBatch(requests=requests))
+            if self.batch_pub.get_num_connections() < 1:
+                rospy.logwarn("Sound command issued, but no node is subscribed"
+                              " to the topic. Perhaps you forgot to run"
+                              " soundplay_node.py?")
 
 ## \brief Create a voice Sound.
 ##
 ## Creates a Sound corresponding to saying the indicated text.
 ##
 ## \param s Text to say
+## \param zone Zone to play in, or None for the client's zone
 
-    def voiceSound(self, s, volume=1.0):
-        return Sound(self, SoundRequest.SAY, s, volume=volume)
+    def voiceSound(self, s, volume=1.0, zone=None):
+        return Sound(self, SoundRequest.SAY, s, volume=volume, zone=zone)
 
 ## \brief Create a wave Sound.
 ##
@@ -137,20 +189,22 @@ class SoundClient(object):
 ##
 ## \param s File to play. Should be an absolute path that exists on the
 ## machine running the sound_play node.
-    def waveSound(self, sound, volume=1.0):
-        if sound[0] != "/":
+## \param zone Zone to play in, or None for the client's zone
+    def waveSound(self, sound, volume=1.0, zone=None):
+        if sound[0] != "/" and ":" not in sound:
           rootdir = os.path.join(roslib.packages.get_pkg_dir('sound_play'),'sounds')
           sound = rootdir + "/" + sound
-        return Sound(self, SoundRequest.PLAY_FILE, sound, volume=volume)
+        return Sound(self, SoundRequest.PLAY_FILE, sound, volume=volume, zone=zone)
 
 ## \brief Create a builtin Sound.
 ##
 ## Creates a Sound corresponding to indicated builtin wave.
 ##
 ## \param id Identifier of the sound to play.
+## \param zone Zone to play in, or None for the client's zone
 
-    def builtinSound(self, id, volume=1.0):
-        return Sound(self, id, "", volume)
+    def builtinSound(self, id, volume=1.0, zone=None):
+        return Sound(self, id, "", volume, zone)
 
 ## \brief Say a string
 ##
@@ -158,6 +212,9 @@ class SoundClient(object):
 ## stopped using stopSaying or stopAll.
 ##
 ## \param text String to say
+## \param voice Voice to say it with. It can name the synthesizer, as in
+## "espeak:en-us" or "flite:slt"; otherwise it is a voice of the node's
+## default synthesizer (a Festival voice such as voice_kal_diphone).
 
     def say(self,text, voice='', volume=1.0, priority=1, **kwargs):
         self.sendMsg(SoundRequest.SAY, SoundRequest.PLAY_ONCE, text, voice,
@@ -180,8 +237,8 @@ class SoundClient(object):
 ##
 ## \param text Same string as in the say or repeat command
 
-    def stopSaying(self,text):
-        self.sendMsg(SoundRequest.SAY, SoundRequest.PLAY_STOP, text)
+    def stopSaying(self,text, **kwargs):
+        self.sendMsg(SoundRequest.SAY, SoundRequest.PLAY_STOP, text, **kwargs)
 
 ## \brief Plays a WAV or OGG file
 ##
@@ -192,7 +249,7 @@ class SoundClient(object):
 ## on the computer on which the sound_play node is running
 
     def playWave(self, sound, volume=1.0, **kwargs):
-        if sound[0] != "/":
+        if sound[0] != "/" and ":" not in sound:
           rootdir = os.path.join(roslib.packages.get_pkg_dir('sound_play'),'sounds')
           sound = rootdir + "/" + sound
         self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_ONCE, sound,
@@ -206,7 +263,7 @@ class SoundClient(object):
 ## on the computer on which the sound_play node is running.
 
     def startWave(self, sound, volume=1.0, **kwargs):
-        if sound[0] != "/":
+        if sound[0] != "/" and ":" not in sound:
           rootdir = os.path.join(roslib.packages.get_pkg_dir('sound_play'),'sounds')
           sound = rootdir + "/" + sound
         self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_START, sound,
@@ -219,11 +276,11 @@ class SoundClient(object):
 ##
 ## \param sound Same string as in the playWave or startWave command
 
-    def stopWave(self,sound):
-        if sound[0] != "/":
-          rootdir = os.path.join(roslib.package.get_pkg_dir('sound_play'),'sounds')
+    def stopWave(self,sound, **kwargs):
+        if sound[0] != "/" and ":" not in sound:
+          rootdir = os.path.join(roslib.packages.get_pkg_dir('sound_play'),'sounds')
           sound = rootdir + "/" + sound
-        self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_STOP, sound)
+        self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_STOP, sound, **kwargs)
 
 ## \brief Plays a WAV or OGG file
 ##
@@ -259,8 +316,8 @@ class SoundClient(object):
 ## \param sound Filename of the WAV or OGG file. Must be an path relative to the package valid
 ## on the computer on which the sound_play node is running
 
-    def stopWaveFromPkg(self,sound, package):
-        self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_STOP, sound, package)
+    def stopWaveFromPkg(self,sound, package, **kwargs):
+        self.sendMsg(SoundRequest.PLAY_FILE, SoundRequest.PLAY_STOP, sound, package, **kwargs)
 
 ## \brief Play a buildin sound
 ##
@@ -288,15 +345,46 @@ class SoundClient(object):
 ##
 ## \param sound Same sound that was used to start playback
 
-    def stop(self,sound):
-        self.sendMsg(sound, SoundRequest.PLAY_STOP, "")
+    def stop(self,sound, **kwargs):
+        self.sendMsg(sound, SoundRequest.PLAY_STOP, "", **kwargs)
 
 ## \brief Stop all currently playing sounds
 ##
 ## This method stops all speech, wave file, and built-in sound playback.
+## With a zone= argument only the sounds playing in that zone are stopped.
 
-    def stopAll(self):
-        self.stop(SoundRequest.ALL)
+    def stopAll(self, **kwargs):
+        self.stop(SoundRequest.ALL, **kwargs)
+
+## \brief Inhibit (mute) the sound_play node
+##
+## While inhibited, the node drops requests to play sounds, or holds them
+## until it is released when mode is SetInhibitRequest.QUEUE, and stops
+## what is playing. Returns the node's message.
+##
+## \param priorities Request priorities to inhibit; all if empty.
+## \param sounds Sounds to inhibit (e.g. SoundRequest.SAY); all if empty.
+## \param timeout Seconds to wait for the node, or None to wait forever.
+## \param lease Seconds after which the node releases itself unless
+## inhibited again, or None to stay inhibited until released.
+
+    def inhibit(self, mode=SetInhibitRequest.DROP, priorities=(), sounds=(), timeout=None, lease=None):
+        return self._set_inhibit(SetInhibitRequest(True, mode, priorities, sounds,
+                                                   rospy.Duration(lease or 0)), timeout)
+
+## \brief Release the sound_play node from inhibit mode
+##
+## Held requests are played.
+
+    def release(self, timeout=None):
+        return self._set_inhibit(SetInhibitRequest(inhibit=False), timeout)
+
+    def _set_inhibit(self, req, timeout):
+        rospy.wait_for_service(self._inhibit_service, timeout)
+        res = rospy.ServiceProxy(self._inhibit_service, SetInhibit)(req)
+        if not res.success:
+            rospy.logerr(res.message)
+        return res.message
 
     def sendMsg(self, snd, cmd, s, arg2="", vol=1.0, prior = 1, **kwargs):
         """
@@ -304,8 +392,11 @@ class SoundClient(object):
         SoundRequest to the soundplay_node or through the actionlib interface
         (which blocks until the sound has finished playing).
 
-        The blocking behavior is nominally the class-wide setting unless it has
-        been explicitly specified in the play call.
+        The blocking behavior and the zone are nominally the class-wide
+        settings unless they have been explicitly specified in the play call.
+
+        A `start=rospy.Time` argument makes the node start the sound at that
+        time rather than when the request arrives.
         """
 
         # Use the passed-in argument if it exists, otherwise fall back to the
@@ -320,6 +411,12 @@ class SoundClient(object):
         msg.arg = s
         msg.arg2 = arg2
         msg.priority = prior
+        msg.zone = kwargs.get('zone', self._zone)
+        msg.start = kwargs.get('start', rospy.Time())
+
+        if self._batch is not None:
+            self._batch.append(msg)
+            return
 
         rospy.logdebug('Sending sound request with volume = {}'
                        ' and blocking = {}'.format(msg.volume, blocking))
@@ -0,0 +1,161 @@
+#***********************************************************
+#* Software License Agreement (BSD License)
+#*
+#*  Copyright (c) 2009, Willow Garage, Inc.
+#*  All rights reserved.
+#*
+#*  Redistribution and use in source and binary forms, with or without
+#*  modification, are permitted provided that the following conditions
+#*  are met:
+#*
+#*   * Redistributions of source code must retain the above copyright
+#*     notice, this list of conditions and the following disclaimer.
+#*   * Redistributions in binary form must reproduce the above
+#*     copyright notice, this list of conditions and the following
+#*     disclaimer in the documentation and/or other materials provided
+#*     with the distribution.
+#*   * Neither the name of the Willow Garage nor the names of its
+#*     contributors may be used to endorse or promote products derived
+#*     from this software without specific prior written permission.
+#*
+#*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#*  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#*  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#*  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#*  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#*  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#*  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#*  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#*  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#*  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#*  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#*  POSSIBILITY OF SUCH DAMAGE.
+#***********************************************************
+
+## \brief Profiling helpers for the sound_play node.
+##
+## CallTimer is cheap enough to stay on: it times selected methods and
+## keeps the slowest calls. Profiler samples the stacks of every thread,
+## or profiles them deterministically with yappi when it is installed,
+## for a while and writes the result to a file.
+
+import functools
+import heapq
+import os
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+
+## \brief Times calls to decorated functions.
+##
+## For each name, counts the calls and their total and maximum duration,
+## and keeps the keep slowest calls overall. Calls slower than threshold
+## seconds are passed to on_slow(name, duration), if given.
+class CallTimer(object):
+    def __init__(self, keep=10, threshold=None, on_slow=None):
+        self.keep = keep
+        self.threshold = threshold
+        self.on_slow = on_slow
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slowest = []
+
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.add(name, time.time() - start)
+            return wrapper
+        return decorator
+
+    def add(self, name, duration):
+        with self._lock:
+            (count, total, longest) = self._stats.get(name, (0, 0.0, 0.0))
+            self._stats[name] = (count + 1, total + duration, max(longest, duration))
+            entry = (duration, time.time(), name)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            elif entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+        if self.threshold is not None and duration > self.threshold and self.on_slow is not None:
+            self.on_slow(name, duration)
+
+    ## \brief {name: (count, mean, max)} in seconds.
+    def stats(self):
+        with self._lock:
+            return dict((name, (count, total / count, longest))
+                        for (name, (count, total, longest)) in self._stats.items())
+
+    ## \brief The slowest calls as (duration, wall time, name), slowest first.
+    def slowest(self):
+        with self._lock:
+            return sorted(self._slowest, reverse=True)
+
+
+## \brief Profiles all threads of the process for a while.
+##
+## In sampling mode, a thread records the stacks of all other threads
+## every interval seconds and writes them in the folded format read by
+## flamegraph.pl and speedscope, one "thread;frame;frame count" line per
+## stack. Deterministic mode uses yappi and writes a pstats file.
+class Profiler(object):
+    SAMPLING = 'sampling'
+    DETERMINISTIC = 'deterministic'
+
+    def __init__(self, mode, filename, interval=0.005):
+        if mode not in (self.SAMPLING, self.DETERMINISTIC):
+            raise ValueError('Unknown profiling mode "%s"' % mode)
+        if mode == self.DETERMINISTIC and yappi is None:
+            raise ImportError('Deterministic profiling of all threads requires yappi')
+        self.mode = mode
+        self.filename = filename
+        self.interval = interval
+        self.samples = 0
+        self._stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.mode == self.DETERMINISTIC:
+            yappi.clear_stats()
+            yappi.start(builtins=False, profile_threads=True)
+        else:
+            self._thread = threading.Thread(target=self._sample)
+            self._thread.daemon = True
+            self._thread.start()
+
+    ## \brief Stop profiling and write the profile.
+    def stop(self):
+        if self.mode == self.DETERMINISTIC:
+            yappi.stop()
+            yappi.get_func_stats().save(self.filename, type='pstat')
+            return
+        self._stop.set()
+        self._thread.join()
+        with open(self.filename, 'w') as f:
+            for (stack, count) in sorted(self._stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+
+    def _sample(self):
+        me = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = ['%s (%s:%d)' % (name, os.path.basename(filename), line)
+                          for (filename, line, name, _) in traceback.extract_stack(frame)]
+                stack = ';'.join([names.get(ident, str(ident))] + frames)
+                self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            self.samples += 1
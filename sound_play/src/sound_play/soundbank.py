@@ -0,0 +1,159 @@
+#***********************************************************
+#* Software License Agreement (BSD License)
+#*
+#*  Copyright (c) 2009, Willow Garage, Inc.
+#*  All rights reserved.
+#*
+#*  Redistribution and use in source and binary forms, with or without
+#*  modification, are permitted provided that the following conditions
+#*  are met:
+#*
+#*   * Redistributions of source code must retain the above copyright
+#*     notice, this list of conditions and the following disclaimer.
+#*   * Redistributions in binary form must reproduce the above
+#*     copyright notice, this list of conditions and the following
+#*     disclaimer in the documentation and/or other materials provided
+#*     with the distribution.
+#*   * Neither the name of the Willow Garage nor the names of its
+#*     contributors may be used to endorse or promote products derived
+#*     from this software without specific prior written permission.
+#*
+#*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#*  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#*  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#*  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#*  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#*  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#*  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#*  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#*  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#*  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#*  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#*  POSSIBILITY OF SUCH DAMAGE.
+#***********************************************************
+
+## \brief Sound banks: many sounds pre-decoded into one memory-mapped file.
+##
+## A bank starts with the magic "SNDBANK1", the length of a JSON index as
+## a little-endian uint32, and the index. The index maps each sound name
+## to the offset and length of a complete wave file holding its PCM, with
+## offsets counted from the data that follows the index (aligned to
+## ALIGNMENT bytes). Banks are mapped read only, so the pages are shared
+## by every process playing from the same bank.
+
+import io
+import json
+import mmap
+import struct
+import wave
+
+MAGIC = b'SNDBANK1'
+ALIGNMENT = 16
+
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+## \brief Write a bank of sounds.
+##
+## \param sounds Iterable of (name, pcm, sample_rate, channels, width),
+## with pcm as interleaved little-endian samples of width bytes.
+def write_bank(path, sounds):
+    index = {}
+    blobs = []
+    offset = 0
+    for (name, pcm, sample_rate, channels, width) in sounds:
+        buf = io.BytesIO()
+        f = wave.open(buf, 'wb')
+        f.setnchannels(channels)
+        f.setsampwidth(width)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm)
+        f.close()
+        blob = buf.getvalue()
+        index[name] = {'offset': offset, 'length': len(blob), 'rate': sample_rate,
+                       'channels': channels, 'width': width}
+        blobs.append(blob + b'\0' * (_align(len(blob)) - len(blob)))
+        offset += len(blobs[-1])
+    header = json.dumps({'sounds': index}, sort_keys=True).encode('UTF-8')
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+        for blob in blobs:
+            f.write(blob)
+
+
+## \brief A bank file mapped into memory.
+class SoundBank(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError('%s is not a sound bank' % path)
+        (length,) = struct.unpack('<I', self._map[len(MAGIC):len(MAGIC) + 4])
+        start = len(MAGIC) + 4
+        self._sounds = json.loads(self._map[start:start + length].decode('UTF-8'))['sounds']
+        self._data = _align(start + length)
+
+    def names(self):
+        return sorted(self._sounds)
+
+    def __contains__(self, name):
+        return name in self._sounds
+
+    def __len__(self):
+        return len(self._sounds)
+
+    ## \brief Sample rate, channels and sample width of a sound.
+    def format(self, name):
+        entry = self._sounds[name]
+        return entry['rate'], entry['channels'], entry['width']
+
+    ## \brief The wave file of a sound, as a view of the mapping.
+    def wave(self, name):
+        entry = self._sounds[name]
+        start = self._data + entry['offset']
+        return memoryview(self._map)[start:start + entry['length']]
+
+    def close(self):
+        self._map.close()
+
+
+## \brief Feeds one sound to a GStreamer appsrc, chunk by chunk.
+##
+## playbin creates a new appsrc, reading from the start, each time the
+## pipeline is set up again, so setup() rewinds. wrap turns a chunk of
+## bytes into a Gst.Buffer.
+class SourceFeed(object):
+    # GST_APP_STREAM_TYPE_RANDOM_ACCESS, so that playbin can seek
+    RANDOM_ACCESS = 2
+
+    def __init__(self, data, wrap):
+        self.data = data
+        self.wrap = wrap
+        self.offset = 0
+
+    ## \brief Connect a new appsrc, from playbin's source-setup signal.
+    def setup(self, source):
+        self.offset = 0
+        source.set_property("stream-type", self.RANDOM_ACCESS)
+        source.set_property("size", len(self.data))
+        source.connect("need-data", self.on_need_data)
+        source.connect("seek-data", self.on_seek_data)
+
+    def on_need_data(self, source, length):
+        if self.offset >= len(self.data):
+            source.emit("end-of-stream")
+            return
+        # The mapping is read without a copy, but PyGObject can only wrap
+        # bytes, so each chunk is copied once into its buffer
+        chunk = self.data[self.offset:self.offset + length]
+        self.offset += len(chunk)
+        source.emit("push-buffer", self.wrap(chunk.tobytes()))
+
+    def on_seek_data(self, source, offset):
+        self.offset = offset
+        return True
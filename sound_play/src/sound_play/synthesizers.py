@@ -0,0 +1,277 @@
+#***********************************************************
+#* Software License Agreement (BSD License)
+#*
+#*  Copyright (c) 2009, Willow Garage, Inc.
+#*  All rights reserved.
+#*
+#*  Redistribution and use in source and binary forms, with or without
+#*  modification, are permitted provided that the following conditions
+#*  are met:
+#*
+#*   * Redistributions of source code must retain the above copyright
+#*     notice, this list of conditions and the following disclaimer.
+#*   * Redistributions in binary form must reproduce the above
+#*     copyright notice, this list of conditions and the following
+#*     disclaimer in the documentation and/or other materials provided
+#*     with the distribution.
+#*   * Neither the name of the Willow Garage nor the names of its
+#*     contributors may be used to endorse or promote products derived
+#*     from this software without specific prior written permission.
+#*
+#*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#*  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#*  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#*  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#*  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#*  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#*  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#*  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#*  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#*  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#*  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#*  POSSIBILITY OF SUCH DAMAGE.
+#***********************************************************
+
+## \brief Speech synthesizers used by the sound_play node.
+##
+## A synthesizer turns text into a wave file. Engines that run in-process
+## produce 16 bit PCM with pcm() instead, which the base class writes out.
+## Synthesizers are looked up by name in a registry, to which plugins can
+## add their own with register().
+
+import ctypes
+import ctypes.util
+import importlib
+import os
+import subprocess
+import tempfile
+import threading
+import wave
+
+
+class SynthesisError(Exception):
+    pass
+
+
+## \brief Base class of speech synthesizers.
+##
+## Subclasses implement either synthesize(), writing a wave file, or
+## pcm(), returning (samples, sample_rate) with samples as mono 16 bit
+## little-endian bytes. Each is provided in terms of the other.
+class Synthesizer(object):
+    # The voice an empty voice stands for, see parse_voice()
+    default_voice = ''
+
+    def synthesize(self, text, voice, path):
+        _require(self, 'pcm')
+        samples, sample_rate = self.pcm(text, voice)
+        f = wave.open(path, 'wb')
+        try:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(samples)
+        finally:
+            f.close()
+
+    def pcm(self, text, voice):
+        _require(self, 'synthesize')
+        (fd, path) = tempfile.mkstemp(prefix='sound_play', suffix='.wav')
+        os.close(fd)
+        try:
+            self.synthesize(text, voice, path)
+            f = wave.open(path, 'rb')
+            try:
+                if f.getsampwidth() != 2 or f.getnchannels() != 1:
+                    raise SynthesisError('%s did not produce 16 bit mono audio' % type(self).__name__)
+                return f.readframes(f.getnframes()), f.getframerate()
+            finally:
+                f.close()
+        finally:
+            os.remove(path)
+
+
+# The default synthesize() and pcm() call each other, so a subclass must
+# override at least one of them
+def _require(synthesizer, name):
+    method = getattr(type(synthesizer), name)
+    if getattr(method, '__func__', method) is Synthesizer.__dict__[name]:
+        raise SynthesisError('%s implements neither synthesize() nor pcm()' % type(synthesizer).__name__)
+
+
+def _encode(text, encoding):
+    if isinstance(text, bytes):
+        text = text.decode('UTF-8')
+    try:
+        return text.encode(encoding)
+    except UnicodeEncodeError:
+        return text.encode('UTF-8')
+
+
+## \brief Runs a command, raising SynthesisError unless it wrote path.
+def _run(args, path, hint, stdin=None):
+    try:
+        process = subprocess.Popen(args, stdin=subprocess.PIPE if stdin is not None else None)
+        process.communicate(stdin)
+    except OSError as e:
+        raise SynthesisError('Could not run %s: %s. %s' % (args[0], e, hint))
+    try:
+        if process.returncode != 0 or os.stat(path).st_size == 0:
+            raise OSError # So we hit the same error
+    except OSError:
+        raise SynthesisError('Sound synthesis with %s failed. %s' % (args[0], hint))
+
+
+## \brief Festival's text2wave. The voice is a Festival command such as
+## voice_kal_diphone.
+class FestivalSynthesizer(Synthesizer):
+    default_voice = 'voice_kal_diphone'
+
+    def synthesize(self, text, voice, path):
+        with tempfile.NamedTemporaryFile(prefix='sound_play', suffix='.txt') as txtfile:
+            txtfile.write(_encode(text, 'ISO-8859-15'))
+            txtfile.flush()
+            _run(['text2wave', '-eval', '(' + voice + ')', txtfile.name, '-o', path], path,
+                 'Is festival installed? Is a festival voice installed? Try running "rosdep satisfy sound_play|sh". Refer to http://wiki.ros.org/sound_play/Troubleshooting')
+
+
+## \brief flite. The voice is a built-in voice name (kal, slt, ...) or the
+## path of a .flitevox file.
+class FliteSynthesizer(Synthesizer):
+    def synthesize(self, text, voice, path):
+        args = ['flite', '-o', path]
+        if voice:
+            args += ['-voice', voice]
+        _run(args, path, 'Is flite installed?', stdin=_encode(text, 'UTF-8'))
+
+
+## \brief SVOX pico2wave. The voice is a language such as en-US.
+class PicoSynthesizer(Synthesizer):
+    def synthesize(self, text, voice, path):
+        # pico2wave picks the format from the file name
+        if not path.endswith('.wav'):
+            raise SynthesisError('pico2wave can only write .wav files')
+        args = ['pico2wave', '-w', path]
+        if voice:
+            args += ['-l', voice]
+        _run(args + ['--', _encode(text, 'UTF-8')], path,
+             'Is pico2wave (libttspico-utils) installed?')
+
+
+## \brief espeak-ng, run in-process through libespeak-ng when it is
+## available and as the espeak-ng command otherwise. The voice is an
+## espeak voice name such as en-us.
+class EspeakSynthesizer(Synthesizer):
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    POS_CHARACTER = 1
+    espeakCHARS_UTF8 = 1
+
+    _CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+
+    def __init__(self):
+        # The library has global state, so synthesis is serialized
+        self._lock = threading.Lock()
+        self._lib = None
+        self._voice = None
+        name = ctypes.util.find_library('espeak-ng')
+        if name is None:
+            return
+        try:
+            lib = ctypes.cdll.LoadLibrary(name)
+        except OSError:
+            return
+        lib.espeak_Initialize.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        lib.espeak_SetVoiceByName.argtypes = [ctypes.c_char_p]
+        lib.espeak_Synth.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_uint, ctypes.c_int,
+                                     ctypes.c_uint, ctypes.c_uint, ctypes.c_void_p, ctypes.c_void_p]
+        self._sample_rate = lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 0, None, 0)
+        if self._sample_rate <= 0:
+            return
+        self._chunks = []
+        # Keep a reference, the library only holds a pointer
+        self._callback = self._CALLBACK(self._on_samples)
+        lib.espeak_SetSynthCallback(self._callback)
+        self._lib = lib
+
+    def _on_samples(self, wav, count, events):
+        if wav and count > 0:
+            self._chunks.append(ctypes.string_at(wav, count * 2))
+        return 0
+
+    def synthesize(self, text, voice, path):
+        if self._lib is not None:
+            return Synthesizer.synthesize(self, text, voice, path)
+        args = ['espeak-ng', '-w', path]
+        if voice:
+            args += ['-v', voice]
+        _run(args + ['--', _encode(text, 'UTF-8')], path,
+             'Is espeak-ng installed?')
+
+    def pcm(self, text, voice):
+        if self._lib is None:
+            return Synthesizer.pcm(self, text, voice)
+        data = _encode(text, 'UTF-8')
+        with self._lock:
+            if voice and voice != self._voice:
+                if self._lib.espeak_SetVoiceByName(voice.encode('UTF-8')) != 0:
+                    raise SynthesisError('Unknown espeak-ng voice "%s"' % voice)
+                self._voice = voice
+            self._chunks = []
+            if self._lib.espeak_Synth(data, len(data) + 1, 0, self.POS_CHARACTER, 0,
+                                      self.espeakCHARS_UTF8, None, None) != 0:
+                raise SynthesisError('espeak-ng failed to synthesize "%s"' % text)
+            samples = b''.join(self._chunks)
+            self._chunks = []
+        return samples, self._sample_rate
+
+
+_registry = {
+    'festival': FestivalSynthesizer,
+    'flite': FliteSynthesizer,
+    'pico': PicoSynthesizer,
+    'espeak': EspeakSynthesizer,
+}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+## \brief Register a synthesizer class (or factory) under a name.
+##
+## \param factory Either a callable returning a Synthesizer, or the
+## import path of one, as in "my_package.module.MySynthesizer".
+def register(name, factory):
+    if not callable(factory):
+        module, _, attr = factory.rpartition('.')
+        factory = getattr(importlib.import_module(module), attr)
+    with _instances_lock:
+        _registry[name] = factory
+        _instances.pop(name, None)
+
+
+def names():
+    return sorted(_registry)
+
+
+## \brief The synthesizer registered under name, created on first use.
+def get(name):
+    with _instances_lock:
+        if name not in _instances:
+            if name not in _registry:
+                raise SynthesisError('Unknown synthesizer "%s". Known synthesizers: %s' % (name, ', '.join(sorted(_registry))))
+            _instances[name] = _registry[name]()
+        return _instances[name]
+
+
+## \brief Split a request's voice into synthesizer name and voice.
+##
+## The voice may be prefixed with a registered synthesizer name, as in
+## "espeak:en-us"; otherwise the default synthesizer is used with the
+## whole string as its voice. An empty voice is the synthesizer's
+## default_voice, so that requests with and without it share cached audio.
+def parse_voice(voice, default):
+    name, sep, rest = voice.partition(':')
+    if not (sep and name in _registry):
+        (name, rest) = (default, voice)
+    if not rest:
+        rest = getattr(_registry.get(name), 'default_voice', '')
+    return name, rest
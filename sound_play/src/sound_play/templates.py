@@ -0,0 +1,232 @@
+#***********************************************************
+#* Software License Agreement (BSD License)
+#*
+#*  Copyright (c) 2009, Willow Garage, Inc.
+#*  All rights reserved.
+#*
+#*  Redistribution and use in source and binary forms, with or without
+#*  modification, are permitted provided that the following conditions
+#*  are met:
+#*
+#*   * Redistributions of source code must retain the above copyright
+#*     notice, this list of conditions and the following disclaimer.
+#*   * Redistributions in binary form must reproduce the above
+#*     copyright notice, this list of conditions and the following
+#*     disclaimer in the documentation and/or other materials provided
+#*     with the distribution.
+#*   * Neither the name of the Willow Garage nor the names of its
+#*     contributors may be used to endorse or promote products derived
+#*     from this software without specific prior written permission.
+#*
+#*  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+#*  "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+#*  LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+#*  FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+#*  COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+#*  INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+#*  BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+#*  LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+#*  CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+#*  LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+#*  ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#*  POSSIBILITY OF SUCH DAMAGE.
+#***********************************************************
+
+## \brief Speech for templated phrases assembled from cached fragments.
+##
+## A template such as "Battery at {percent} percent" splits matching
+## phrases into fragments ("Battery at", "42", "percent"). Each fragment is
+## synthesized once and kept in a bounded cache; phrases are then joined
+## at the PCM level with a short crossfade, so a new value only costs the
+## synthesis of that value, if anything.
+
+import array
+import collections
+import re
+import sys
+import threading
+import wave
+
+
+## \brief 16 bit little-endian PCM bytes as an array of samples.
+def to_samples(data):
+    samples = array.array('h')
+    if hasattr(samples, 'frombytes'):
+        samples.frombytes(data)
+    else:
+        samples.fromstring(data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def write_wave(path, samples, sample_rate):
+    if sys.byteorder == 'big':
+        samples = array.array('h', samples)
+        samples.byteswap()
+    f = wave.open(path, 'wb')
+    try:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes() if hasattr(samples, 'tobytes') else samples.tostring())
+    finally:
+        f.close()
+
+
+## \brief Strip leading and trailing silence, keeping pad samples.
+def trim(samples, threshold=328, pad=0):
+    start = 0
+    while start < len(samples) and abs(samples[start]) < threshold:
+        start += 1
+    end = len(samples)
+    while end > start and abs(samples[end - 1]) < threshold:
+        end -= 1
+    return samples[max(0, start - pad):min(len(samples), end + pad)]
+
+
+## \brief Join sample arrays, overlapping consecutive ones by crossfade
+## samples with a linear fade.
+def concatenate(chunks, crossfade):
+    out = array.array('h')
+    for chunk in chunks:
+        n = min(crossfade, len(out), len(chunk))
+        for i in range(n):
+            w = float(i + 1) / (n + 1)
+            j = len(out) - n + i
+            out[j] = int(out[j] * (1.0 - w) + chunk[i] * w)
+        out.extend(chunk[n:])
+    return out
+
+
+## \brief A phrase with {name} slots.
+##
+## Words are matched whole: where the pattern has a space, the phrase
+## must have one too, so "dock {n}" doesn't match "docking 7".
+class Template(object):
+    def __init__(self, pattern):
+        self.pattern = pattern
+        parts = re.split(r'(\{\w+\})', pattern.strip())
+        regex = ''
+        self.fixed = []
+        for part in parts:
+            if re.match(r'^\{\w+\}$', part):
+                regex += r'(.+?)'
+            elif part:
+                text = part.strip()
+                if part[0].isspace():
+                    regex += r'\s+'
+                if text:
+                    regex += r'\s+'.join(re.escape(word) for word in text.split())
+                    self.fixed.append(text)
+                    if part[-1].isspace():
+                        regex += r'\s+'
+        self._regex = re.compile('^' + regex + '$', re.IGNORECASE)
+        self._parts = [p for p in parts if p.strip()]
+
+    ## \brief The fragments of text, or None if it doesn't match.
+    def split(self, text):
+        m = self._regex.match(text.strip())
+        if m is None:
+            return None
+        values = iter(m.groups())
+        fragments = []
+        for part in self._parts:
+            if re.match(r'^\{\w+\}$', part):
+                fragments.append(next(values).strip())
+            else:
+                fragments.append(part.strip())
+        return fragments
+
+
+## \brief Least recently used cache of synthesized fragments.
+class FragmentCache(object):
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            value = self._items.pop(key)
+            self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+## \brief Synthesizes templated phrases from cached fragments.
+##
+## \param templates Template patterns, tried in order.
+## \param cache_size Maximum number of cached fragments.
+## \param crossfade Length of the fade at each join, in seconds.
+## \param gap Silence between fragments, in seconds.
+class PhraseComposer(object):
+    def __init__(self, templates, cache_size=200, crossfade=0.01, gap=0.05):
+        self.templates = [Template(t) for t in templates]
+        self.cache = FragmentCache(cache_size)
+        self.crossfade = crossfade
+        self.gap = gap
+
+    ## \brief Fragments of text, or None if no template matches.
+    def split(self, text):
+        for template in self.templates:
+            fragments = template.split(text)
+            if fragments is not None:
+                return fragments
+        return None
+
+    ## \brief Samples of one fragment, from the cache or synthesized.
+    def fragment(self, synthesizer, name, voice, text):
+        key = (name, voice, text.lower())
+        value = self.cache.get(key)
+        if value is None:
+            samples, sample_rate = synthesizer.pcm(text, voice)
+            samples = to_samples(samples)
+            value = (trim(samples, pad=int(self.crossfade * sample_rate)), sample_rate)
+            self.cache.put(key, value)
+        return value
+
+    ## \brief Write text to path as a wave file if it matches a template.
+    ##
+    ## Returns False, without writing anything, for phrases no template
+    ## matches.
+    def compose(self, synthesizer, name, voice, text, path):
+        fragments = self.split(text)
+        if fragments is None:
+            return False
+        chunks = []
+        sample_rate = None
+        for fragment in fragments:
+            samples, rate = self.fragment(synthesizer, name, voice, fragment)
+            if sample_rate is not None and rate != sample_rate:
+                raise ValueError('Fragments of "%s" have different sample rates' % text)
+            sample_rate = rate
+            if chunks and self.gap > 0:
+                chunks.append(array.array('h', [0]) * int(self.gap * rate))
+            chunks.append(samples)
+        write_wave(path, concatenate(chunks, int(self.crossfade * sample_rate)), sample_rate)
+        return True
+
+    ## \brief Synthesize the fixed fragments of every template, plus the
+    ## given vocabulary, ahead of time.
+    def preload(self, synthesizer, name, voice, vocabulary=()):
+        for template in self.templates:
+            for fragment in template.fixed:
+                self.fragment(synthesizer, name, voice, fragment)
+        for word in vocabulary:
+            self.fragment(synthesizer, name, voice, str(word))
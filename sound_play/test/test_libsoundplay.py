@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import unittest
+
+from sound_play.libsoundplay import SoundClient
+from sound_play.msg import SoundRequest
+
+
+class FakePublisher(object):
+    def __init__(self):
+        self.published = []
+
+    def publish(self, msg):
+        self.published.append(msg)
+
+    def get_num_connections(self):
+        return 1
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        # A client without the ROS node, publishing into lists
+        self.client = SoundClient.__new__(SoundClient)
+        self.client._blocking = False
+        self.client._zone = ''
+        self.client._batch = None
+        self.client.pub = FakePublisher()
+        self.client.batch_pub = FakePublisher()
+
+    def test_requests_are_sent_together(self):
+        with self.client.batch():
+            self.client.stopAll()
+            with self.client.batch():
+                self.client.play(SoundRequest.NEEDS_PLUGGING)
+        self.assertEqual(self.client.pub.published, [])
+        self.assertEqual(len(self.client.batch_pub.published), 1)
+        requests = self.client.batch_pub.published[0].requests
+        self.assertEqual([r.sound for r in requests], [SoundRequest.ALL, SoundRequest.NEEDS_PLUGGING])
+
+    def test_nothing_is_sent_when_the_block_raises(self):
+        def broken():
+            with self.client.batch():
+                self.client.stopAll()
+                raise RuntimeError('failed half way')
+        self.assertRaises(RuntimeError, broken)
+        self.assertEqual(self.client.batch_pub.published, [])
+        # The client is usable again afterwards
+        self.client.play(SoundRequest.NEEDS_PLUGGING)
+        self.assertEqual(len(self.client.pub.published), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import wave
+
+from sound_play import soundbank
+
+
+## Records what a SourceFeed does to an appsrc
+class FakeAppSrc(object):
+    def __init__(self):
+        self.properties = {}
+        self.handlers = {}
+        self.buffers = []
+        self.ended = False
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def connect(self, signal, handler):
+        self.handlers[signal] = handler
+
+    def emit(self, signal, *args):
+        if signal == 'push-buffer':
+            self.buffers.append(args[0])
+        elif signal == 'end-of-stream':
+            self.ended = True
+
+    ## Pull chunks of length bytes until the end of the stream
+    def play(self, length):
+        self.buffers = []
+        self.ended = False
+        while not self.ended:
+            self.handlers['need-data'](self, length)
+        return b''.join(self.buffers)
+
+
+class TestSoundBank(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.bank')
+        self.sounds = [
+            ('beep', b'\x01\x00\x02\x00\x03\x00', 16000, 1, 2),
+            ('stereo', b'\x00\x01' * 7 * 2, 44100, 2, 2),
+        ]
+        soundbank.write_bank(self.path, self.sounds)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        bank = soundbank.SoundBank(self.path)
+        try:
+            self.assertEqual(bank.names(), ['beep', 'stereo'])
+            self.assertEqual(len(bank), 2)
+            self.assertIn('beep', bank)
+            self.assertNotIn('boop', bank)
+            for (name, pcm, rate, channels, width) in self.sounds:
+                self.assertEqual(bank.format(name), (rate, channels, width))
+                view = bank.wave(name)
+                data = view.tobytes()
+                view.release()
+                self.assertEqual(data[:4], b'RIFF')
+                self.assertEqual(data[8:12], b'WAVE')
+                self.assertEqual(struct.unpack('<I', data[4:8])[0], len(data) - 8)
+                f = wave.open(io.BytesIO(data), 'rb')
+                self.assertEqual((f.getframerate(), f.getnchannels(), f.getsampwidth()), (rate, channels, width))
+                self.assertEqual(f.readframes(f.getnframes()), pcm)
+                f.close()
+        finally:
+            bank.close()
+
+    def test_sounds_are_aligned(self):
+        with open(self.path, 'rb') as f:
+            contents = f.read()
+        bank = soundbank.SoundBank(self.path)
+        try:
+            for name in bank.names():
+                view = bank.wave(name)
+                data = view.tobytes()
+                view.release()
+                start = contents.index(data)
+                self.assertEqual(start % soundbank.ALIGNMENT, 0)
+        finally:
+            bank.close()
+
+    def test_feed_plays_twice(self):
+        bank = soundbank.SoundBank(self.path)
+        try:
+            expected = bank.wave('beep').tobytes()
+            feed = soundbank.SourceFeed(bank.wave('beep'), bytes)
+            # playbin sets up a new appsrc each time the sound is played
+            # again after the pipeline was shut down
+            for _ in range(2):
+                source = FakeAppSrc()
+                feed.setup(source)
+                self.assertEqual(source.properties['size'], len(expected))
+                self.assertEqual(source.play(7), expected)
+            # A seek within the same source goes back to where it asks
+            self.assertTrue(source.handlers['seek-data'](source, 4))
+            self.assertEqual(source.play(7), expected[4:])
+            del feed, source
+        finally:
+            bank.close()
+
+    def test_not_a_bank(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'RIFF' + b'\0' * 60)
+        self.assertRaises(ValueError, soundbank.SoundBank, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+import unittest
+import wave
+
+from sound_play import synthesizers
+
+
+class SilenceSynthesizer(synthesizers.Synthesizer):
+    def pcm(self, text, voice):
+        return b'\0\0' * 100, 8000
+
+
+class TestSynthesizers(unittest.TestCase):
+    def test_synthesize_writes_pcm(self):
+        (fd, path) = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            SilenceSynthesizer().synthesize('hello', '', path)
+            f = wave.open(path, 'rb')
+            self.assertEqual((f.getframerate(), f.getnframes()), (8000, 100))
+            f.close()
+        finally:
+            os.remove(path)
+
+    def test_incomplete_synthesizer_is_an_error(self):
+        class Incomplete(synthesizers.Synthesizer):
+            pass
+        self.assertRaises(synthesizers.SynthesisError, Incomplete().pcm, 'hello', '')
+        self.assertRaises(synthesizers.SynthesisError, Incomplete().synthesize, 'hello', '', '/tmp/x.wav')
+
+    def test_parse_voice(self):
+        self.assertEqual(synthesizers.parse_voice('espeak:en-us', 'festival'), ('espeak', 'en-us'))
+        self.assertEqual(synthesizers.parse_voice('voice_kal_diphone', 'festival'), ('festival', 'voice_kal_diphone'))
+        self.assertEqual(synthesizers.parse_voice('unknown:x', 'festival'), ('festival', 'unknown:x'))
+
+    def test_empty_voice_is_the_default_voice(self):
+        # SoundClient.say() sends an empty voice, say.py voice_kal_diphone
+        self.assertEqual(synthesizers.parse_voice('', 'festival'), ('festival', 'voice_kal_diphone'))
+        self.assertEqual(synthesizers.parse_voice('festival:', 'espeak'), ('festival', 'voice_kal_diphone'))
+        self.assertEqual(synthesizers.parse_voice('', 'espeak'), ('espeak', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
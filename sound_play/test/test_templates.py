@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import array
+import unittest
+
+from sound_play.templates import FragmentCache, Template, concatenate, trim
+
+
+class TestTemplate(unittest.TestCase):
+    def test_split(self):
+        template = Template('Battery at {percent} percent')
+        self.assertEqual(template.split('battery at 42 percent'), ['Battery at', '42', 'percent'])
+        self.assertEqual(template.fixed, ['Battery at', 'percent'])
+        self.assertIsNone(template.split('Battery low'))
+
+    def test_words_are_matched_whole(self):
+        self.assertIsNone(Template('Arriving at dock {n}').split('Arriving at docking 7'))
+        self.assertEqual(Template('{a} {b}').split('hello big world'), ['hello', 'big world'])
+
+    def test_slot_next_to_text(self):
+        self.assertEqual(Template('{n}% charged').split('42% charged'), ['42', '% charged'])
+
+
+class TestSamples(unittest.TestCase):
+    def test_trim(self):
+        samples = array.array('h', [0, 10, 1000, -2000, 5, 0])
+        self.assertEqual(list(trim(samples)), [1000, -2000])
+        self.assertEqual(list(trim(samples, pad=1)), [10, 1000, -2000, 5])
+        self.assertEqual(list(trim(array.array('h', [0, 0]))), [])
+
+    def test_concatenate_crossfades(self):
+        out = concatenate([array.array('h', [100] * 4), array.array('h', [300] * 4)], 1)
+        self.assertEqual(list(out), [100, 100, 100, 200, 300, 300, 300])
+        self.assertEqual(len(concatenate([array.array('h', [1] * 4)] * 3, 0)), 12)
+
+
+class TestFragmentCache(unittest.TestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = FragmentCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c'), len(cache)), (1, 3, 2))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()